@@ -7,36 +7,86 @@
 # ----------------
 # Python
 # ----------------
-import os
-import sys
-import yaml
-import time
 import json
-import shutil
 import logging
 from pyats import aetest
-from pyats import topology
-from pyats.log.utils import banner
-from genie.utils.diff import Diff
-from jinja2 import Environment, FileSystemLoader
-from general_functionalities import ParseConfigFunction, ParseShowCommandFunction
+from device_conversion import DeviceConversion
+from parallel_execution import ParallelRunner
+from stage_metrics import StageMetrics
+from artifact_store import artifact_store as artifact_store_for
+from template_render import TemplateRenderer
+from device_facts import FactsCache
+from conversion_journal import ConversionJournal
+from wave_scheduler import SessionRateLimiter, WaveScheduler
+from connection_pool import ConnectionPool
+from parse_cache import ParseCache, Parser
+from fleet_report import FleetReport
 from datetime import datetime
-from contextlib import redirect_stdout
 
 log = logging.getLogger(__name__)
-template_dir = 'templates/'
-env = Environment(loader=FileSystemLoader(template_dir))
 timestr = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+# ----------------
+# Script Parameters
+# ----------------
+# max_workers: how many devices are converted at the same time (1 = serial)
+# push_mode: 'session' pushes the bundle over the CLI, 'file' copies it from file_server
+# delta_render: push only the lines that change each port instead of the full templates
+# artifact_store: 'json' writes the usual files, 'cas'/'cas-msgpack' a compressed deduplicated store
+# role_templates: give 802.1X ports only their role's template (PORT_TEMPLATES), leaving uplinks and trunks as is
+# verify: 'targeted' re-captures only the touched interfaces and objects after the push, 'full' the whole device
+# facts_ttl: seconds the per-device facts (data VLAN, stack members...) are reused from facts_cache/, 0 to rediscover
+# journal: file recording the stages each device completed
+# resume: pick each device up after the last stage an earlier run completed, skipping converted devices
+# convergence_timeout: seconds to wait for the endpoints to authorize again before the post capture, 0 to not wait
+# parse_workers: processes parsing show outputs while the next command is collected, 0 to parse inline
+# parse_cache: folder keeping the parsed form of each show output for a week, so an identical output is never parsed twice
+# max_sessions: most devices connected at the same time, None for max_workers
+# connect_retries: how many times a failed connect is retried, waiting connect_backoff seconds then twice as long each time
+# rollout: 'parallel' converts every device at once, 'waves' a canary then waves that must settle in turn
+# max_sessions_per_second: fleet-wide cap on endpoints re-authenticating, None for no cap
+# wave_endpoints: most endpoints converted in one wave
+# canary: devices in the first wave
+# settle_timeout: seconds a wave's sessions have to come back before the rollout is held
+# report: SQLite fleet report updated as each device finishes, None to not keep one
+parameters = {
+    'max_workers': 1,
+    'push_mode': 'session',
+    'file_server': None,
+    'delta_render': True,
+    'artifact_store': 'json',
+    'role_templates': False,
+    'verify': 'targeted',
+    'facts_ttl': 86400,
+    'journal': 'journal/C3PL_journal.jsonl',
+    'resume': True,
+    'convergence_timeout': 300,
+    'parse_workers': 0,
+    'parse_cache': 'parse_cache',
+    'max_sessions': None,
+    'connect_retries': 3,
+    'connect_backoff': 5,
+    'rollout': 'parallel',
+    'max_sessions_per_second': None,
+    'wave_endpoints': 2000,
+    'canary': 1,
+    'settle_timeout': 600,
+    'report': 'reports/fleet_report.sqlite',
+}
+
 # ----------------
 # AE Test Setup
 # ----------------
 class common_setup(aetest.CommonSetup):
     """Common Setup section"""
     @aetest.subsection
-    def connect_to_devices(self, testbed):
-        """Connect to all the devices"""
-        testbed.connect()
+    def connection_pool(self, max_workers, max_sessions, connect_retries, connect_backoff):
+        """Devices are connected when their conversion starts and disconnected when it ends"""
+        # Every stage of every device, connects included, is timed into metrics/ as JSON lines
+        metrics = StageMetrics("metrics/%s_metrics.jsonl" % timestr)
+        pool = ConnectionPool(max_sessions=int(max_sessions or max_workers), retries=int(connect_retries),
+                              backoff=float(connect_backoff), metrics=metrics)
+        self.parent.parameters.update(metrics=metrics, connection_pool=pool)
 
 # ----------------
 # Test Case #1
@@ -45,400 +95,128 @@ class Collect_Information(aetest.Testcase):
     """Parse all the commands"""
 
     @aetest.test
-    def parse(self, testbed, section, steps):
+    def parse(self, testbed, section, steps, metrics, connection_pool, max_workers, push_mode, file_server,
+              delta_render, artifact_store, verify, facts_ttl, journal, resume, convergence_timeout, rollout,
+              max_sessions_per_second, wave_endpoints, canary, settle_timeout, parse_workers, parse_cache, report,
+              role_templates):
         """ Testcase Setup section """
+        self.metrics = metrics
+        self.testbed = testbed
+        store = artifact_store_for(artifact_store, timestr)
+        # Templates are compiled once per run (and cached on disk between runs)
+        # and each distinct port layout is rendered once
+        renderer = TemplateRenderer('templates/', bytecode_dir='templates/__pycache__')
+        facts_cache = FactsCache('facts_cache', ttl=int(facts_ttl))
+        conversion_journal = ConversionJournal(journal)
+        limiter = SessionRateLimiter(float(max_sessions_per_second)) if max_sessions_per_second else None
+        self.parser = Parser(ParseCache(parse_cache), workers=int(parse_workers))
+        self.report = FleetReport(report, journal=journal) if report else None
+
+        def conversion(device, **kwargs):
+            options = dict(resume=resume, session_limiter=limiter)
+            options.update(kwargs)
+            return DeviceConversion(device, timestr, push_mode=push_mode, file_server=file_server,
+                                    delta_render=delta_render, metrics=self.metrics, store=store,
+                                    verify=verify, renderer=renderer, facts_cache=facts_cache,
+                                    journal=conversion_journal, convergence_timeout=float(convergence_timeout),
+                                    parser=self.parser, role_templates=role_templates, **options)
+
+        # Each device holds a session only while it is being converted
+        convert = connection_pool.wrap(lambda device, device_steps: conversion(device).run(device_steps))
+
+        if rollout == 'waves':
+            self.run_waves(steps, testbed, conversion, connection_pool, max_workers, wave_endpoints, canary,
+                           settle_timeout)
+            self.report_metrics(connection_pool)
+            return
+
         # ---------------------------------------
-        # Loop over devices
+        # Serial: convert one device at a time straight into the testcase steps
         # ---------------------------------------
-        for device in testbed:
-       
-            # ---------------------------------------
-            # 0. Take Backup 
-            # --------------------------------------- 
-            backup_config_filename = "%s_Backup_%s.cfg" % (device.alias,timestr)
-            
-            with open("backup_configs/%s" % backup_config_filename, "w") as fid:
-                fid.write(device.execute("show run"))
-                fid.close()
-
-
-            # ---------------------------------------
-            # 1. Pre-Change State 
-            # ---------------------------------------  
-
-            # ---------------------------------------
-            # Get running config -> Genie learn('config').info for pre-change state 
-            # ---------------------------------------
-            self.learned_config = ParseConfigFunction.parse_learn(steps, device, "config")
-            pre_learned_config = self.learned_config
-
-            #----------------------------------------
-            # Save Running Config into JSON Pre-Change File
-            #----------------------------------------
-            with steps.start('Store Original Golden Image',continue_=True) as step:
-                
-                pre_config_filename = "%s_Pre_Running_Config_%s.json" % (device.alias,timestr)
-                # Write Original Learned Config as JSON
-                if hasattr(self, 'learned_config'):
-                    with open("pre_configs/%s" % pre_config_filename, "w") as fid:
-                        json.dump(self.learned_config, fid, indent=4, sort_keys=True)
-                        fid.close()
-
-            # ---------------------------------------
-            # Get pre-change state of MAC address table
-            # ---------------------------------------
-            self.parsed_mac_table = ParseShowCommandFunction.parse_show_command(steps, device, "show mac address-table")
-            pre_parsed_mac_table = self.parsed_mac_table
-
-
-            #----------------------------------------
-            # Save MAC Table into JSON Pre-Change File
-            #----------------------------------------
-            with steps.start('Store Pre-state MAC Table',continue_=True) as step:
-                
-                pre_mac_table_filename = "%s_Pre_MAC_Table_%s.json" % (device.alias,timestr)
-                # Write Original Learned Config as JSON
-                with open("pre_configs/%s" % pre_mac_table_filename, "w") as fid:
-                    json.dump(self.parsed_mac_table, fid, indent=4, sort_keys=True)
-                    fid.close()
-
-            # ---------------------------------------
-            # Get pre-change state of Dot1x interfaces 
-            # ---------------------------------------
-            self.parsed_dot1x = ParseShowCommandFunction.parse_show_command(steps, device, "show dot1x all details")
-            pre_parsed_dot1x = self.parsed_dot1x
-
-            #----------------------------------------
-            # Save dot1x ports to JSON Pre-Change File
-            #----------------------------------------
-            with steps.start('Store Pre State Dot1x Interfaces',continue_=True) as step:
-                
-                pre_dot1x_filename = "%s_Pre_Dot1x_%s.json" % (device.alias,timestr)
-                # Write Original Learned Config as JSON
-                with open("pre_configs/%s" % pre_dot1x_filename, "w") as fid:
-                    json.dump(self.parsed_dot1x, fid, indent=4, sort_keys=True)
-                    fid.close()
-
-            # ---------------------------------------
-            # Get pre-change state of Authentication sessions 
-            # ---------------------------------------
-            self.parsed_auth_sessions = ParseShowCommandFunction.parse_show_command(steps, device, "show authentication sessions")
-            pre_parsed_auth_sessions = self.parsed_auth_sessions
-
-            #----------------------------------------
-            # Save Authentication sessions to JSON Pre-Change File
-            #----------------------------------------
-            with steps.start('Store Pre State Authentication Sessions',continue_=True) as step:
-                
-                pre_auth_sessions_filename = "%s_Pre_Authentication_Sessions_%s.json" % (device.alias,timestr)
-                # Write Original Learned Config as JSON
-                with open("pre_configs/%s" % pre_auth_sessions_filename, "w") as fid:
-                    json.dump(self.parsed_auth_sessions, fid, indent=4, sort_keys=True)
-                    fid.close()
-
-            # ---------------------------------------
-            # Genie parse 'show int status' to capture all interfaces on switch
-            # ---------------------------------------
-            self.parsed_int_status = ParseShowCommandFunction.parse_show_command(steps, device, "show interfaces status")
-            pre_parsed_int_status = self.parsed_int_status
-
-            #----------------------------------------
-            # Save all interfaces to JSON Pre-Change File
-            #----------------------------------------
-            with steps.start('Store Pre State Interface Status',continue_=True) as step:
-                
-                original_config_filename = "%s_Pre_Interfaces_Status_%s.json" % (device.alias,timestr)
-                # Write Original Learned Config as JSON
-                with open("pre_configs/%s" % original_config_filename, "w") as fid:
-                    json.dump(self.parsed_int_status, fid, indent=4, sort_keys=True)
-                    fid.close()
-            #----------------------------------------
-            # Keep only Access interfaces
-            #----------------------------------------
-            access_interface_array = []
-            for interface,values in pre_parsed_int_status['interfaces'].items():
-                if values['vlan'] != "trunk" and values['vlan'] != "routed" and interface != "Ap1/0/1" and "/1/" not in interface:
-                    access_interface_array.append(interface)
-                    
-            print(access_interface_array) 
-
-            # ---------------------------------------
-            # 2. Wipe Dot1x configs from all ports 
-            # ---------------------------------------  
-            
-            #---------------------------------------
-            # Create Intent from legacy_dot1x_removal.j2 Template and Data Models
-            # ---------------------------------------
-            with steps.start('Wipe Legacy Dot1x Configs from all ports',continue_=True) as step:
-                legacy_removal_template = env.get_template('legacy_dot1x_removal.j2')
-                legacy_removal = legacy_removal_template.render(interface=access_interface_array)           
-                with open("templates/%s_legacy_removal.txt" % timestr, "w") as fid:
-                    fid.write(legacy_removal)
-                    fid.close()
-          
-            #----------------------------------------
-            # Write Pre-Change File
-            #---------------------------------------
- 
-            device.configure(legacy_removal) 
- 
-            # ---------------------------------------
-            # 3. Convert Dot1x to new-style 
-            # ---------------------------------------  
-           
-            device.execute("authentication display new-style")
-
-            # ---------------------------------------
-            # 4. Remove all default policy-maps and service templates 
-            # --------------------------------------- 
-            
-            junk_interface_removal_template = env.get_template('junk_interface_removal_template.j2')
-            junk_interface_removal = junk_interface_removal_template.render(interface=access_interface_array)
-            
-            with steps.start("Remove applied default policy per interface", continue_=True) as step:
-                try:
-                    device.configure(junk_interface_removal)
-                except Exception as e:
-                    step.failed('Could not remove applied policy correctly\n{e}'.format(e=e))             
-        
-            junk_removal_template = env.get_template('junk_removal_template.j2')
-            junk_removal = junk_removal_template.render(interface=access_interface_array)
-
-            with steps.start("Remove global default policies and templates", continue_=True) as step:
-                try:
-                    device.configure(junk_removal)
-                except Exception as e:
-                    step.failed('Could not remove global configs correctly\n{e}'.format(e=e))
+        if int(max_workers) <= 1:
+            for device in testbed:
+                with steps.start("Convert %s" % device.name, continue_=True) as device_step:
+                    try:
+                        convert(device, device_step)
+                    finally:
+                        self.update_report(device.name)
+            self.report_metrics(connection_pool)
+            return
 
-            # ---------------------------------------
-            # 4. Capture Data VLAN ID
-            # ---------------------------------------
-            vlanlist = device.learn("vlan").info
-            for vlan in vlanlist['vlans']:
-                if vlanlist['vlans'][vlan]['name'] == "data_vlan":
-                    data_vlan = vlanlist['vlans'][vlan]['vlan_id']
-
-            new_global_config_template = env.get_template('C3PL_new_global_configs.j2')
-            new_global_config = new_global_config_template.render(vlan=data_vlan)
-
-            device.configure(new_global_config)
- 
-            # ---------------------------------------
-            # 5. Add per-interface new config 
-            # ---------------------------------------
-
-            #Ask for enforcement or monitor before applying config to interfaces?
-            
-            print(pre_parsed_dot1x)
-
-            if "interfaces" in pre_parsed_dot1x:
-                with steps.start('Applying new interface configs',continue_=True) as step:
-                    new_int_template = env.get_template('C3PL_new_int_config_enforcement.j2')
-                    new_int_config = new_int_template.render(interface=pre_parsed_dot1x['interfaces']) 
-
-                    device.configure(new_int_config)
-
-            # ---------------------------------------
-            # Write mem once complete
-            # ---------------------------------------
-            device.execute("wr mem")
-
-            # ---------------------------------------
-            # Re-capture state - Running config
-            # ---------------------------------------
-            self.learned_config = ParseConfigFunction.parse_learn(steps, device, "config")
-            post_learned_config = self.learned_config
-#
-            # ---------------------------------------
-            # Write post-change state - Running Config
-            # ---------------------------------------
-            with steps.start('Store Post Running Config',continue_=True) as step:
-                
-                new_config_filename = "%s_Post_Running_Config_%s.json" % (device.alias,timestr)
-#
-            # Write New Learned Config as JSON
-                if hasattr(self, 'learned_config'):
-                    with open("post_configs/%s" % new_config_filename, "w") as fid:
-                        json.dump(self.learned_config, fid, indent=4, sort_keys=True)
-                        fid.close()
-#
-            # ---------------------------------------
-            # Show the differential - Running Config
-            # ---------------------------------------
-            with steps.start('Show Running Config Differential',continue_=True) as step:
-                config_diff = Diff(pre_learned_config, post_learned_config)
-                config_diff.findDiff()
-                
-                if config_diff.diffs:
-                    print(config_diff)
-                
-                    with open('changelog/%s_C3PL_Conversion_Running_Config.txt_%s' % (device.alias,timestr), 'w') as f:
-                        with redirect_stdout(f):
-                            print(config_diff)
-                            f.close()
-    #
-                else:
-                    
-                    with open('changelog/%s_C3PL_Conversion_Running_Config.txt_%s' % (device.alias,timestr), 'w') as f:
-                        f.write("NO CHANGES")
-                        f.close()
-             
-            # ---------------------------------------
-            # Re-capture state - MAC Table 
-            # ---------------------------------------
-            self.parsed_mac_table = ParseShowCommandFunction.parse_show_command(steps, device, "show mac address-table")
-            post_parsed_mac_table = self.parsed_mac_table 
-
-            # ---------------------------------------
-            # Write post-change state - MAC Table
-            # ---------------------------------------
-            with steps.start('Store Post MAC Table',continue_=True) as step:
-                
-                new_config_filename = "%s_Post_MAC_Table_%s.json" % (device.alias,timestr)
-#
-            # Write New Learned Config as JSON
-                with open("post_configs/%s" % new_config_filename, "w") as fid:
-                    json.dump(self.parsed_mac_table, fid, indent=4, sort_keys=True)
-                    fid.close()
-#
-            # ---------------------------------------
-            # Show the differential - MAC TAble
-            # ---------------------------------------
-            with steps.start('Show MAC Table Differential',continue_=True) as step:
-                config_diff = Diff(pre_parsed_mac_table, post_parsed_mac_table)
-                config_diff.findDiff()
-                
-                if config_diff.diffs:
-                    print(config_diff)
-                
-                    with open('changelog/%s_C3PL_Conversion_MAC_Table.txt_%s' % (device.alias,timestr), 'w') as f:
-                        with redirect_stdout(f):
-                            print(config_diff)
-                            f.close()
-    #
-                else:
-                    
-                    with open('changelog/%s_C3PL_Conversion_MAC_Table.txt_%s' % (device.alias,timestr), 'w') as f:
-                        f.write("NO CHANGES")
-                        f.close()
-
-            # ---------------------------------------
-            # Re-capture state - Dot1x 
-            # ---------------------------------------
-            self.parsed_dot1x = ParseShowCommandFunction.parse_show_command(steps, device, "show mac address-table")
-            post_parsed_dot1x = self.parsed_dot1x 
-
-
-            # ---------------------------------------
-            # Write post-change state - Dot1x 
-            # ---------------------------------------
-            with steps.start('Store Post Dot1x',continue_=True) as step:
-                
-                new_config_filename = "%s_Post_Dot1x_%s.json" % (device.alias,timestr)
-#
-            # Write New Learned Config as JSON
-                with open("post_configs/%s" % new_config_filename, "w") as fid:
-                    json.dump(self.parsed_dot1x, fid, indent=4, sort_keys=True)
-                    fid.close()
-
-#
-            # ---------------------------------------
-            # Show the differential - Dot1x
-            # ---------------------------------------
-            with steps.start('Show Dot1x Differential',continue_=True) as step:
-                config_diff = Diff(pre_parsed_dot1x, post_parsed_dot1x)
-                config_diff.findDiff()
-                
-                if config_diff.diffs:
-                    print(config_diff)
-                
-                    with open('changelog/%s_C3PL_Conversion_Dot1x.txt_%s' % (device.alias,timestr), 'w') as f:
-                        with redirect_stdout(f):
-                            print(config_diff)
-                            f.close()
-    #
-                else:
-                    
-                    with open('changelog/%s_C3PL_Conversion_Dot1x.txt_%s' % (device.alias,timestr), 'w') as f:
-                        f.write("NO CHANGES")
-                        f.close()
-
-            # ---------------------------------------
-            # Re-capture state - Authentication Sessions 
-            # ---------------------------------------
-            self.parsed_auth_sessions = ParseShowCommandFunction.parse_show_command(steps, device, "show authentication sessions")
-            post_parsed_auth_sessions = self.parsed_auth_sessions 
-
-            # ---------------------------------------
-            # Write post-change state - Authentication Sessions 
-            # ---------------------------------------
-            with steps.start('Store Post Authentication Sessions',continue_=True) as step:
-                
-                new_config_filename = "%s_Post_Authentication_Sessions_%s.json" % (device.alias,timestr)
-#
-            # Write New Learned Config as JSON
-                with open("post_configs/%s" % new_config_filename, "w") as fid:
-                    json.dump(self.parsed_auth_sessions, fid, indent=4, sort_keys=True)
-                    fid.close()
-#
-            # ---------------------------------------
-            # Show the differential - Authentication Sessions
-            # ---------------------------------------
-            with steps.start('Show Authentication Sessions Differential',continue_=True) as step:
-                config_diff = Diff(pre_parsed_auth_sessions, post_parsed_auth_sessions)
-                config_diff.findDiff()
-                
-                if config_diff.diffs:
-                    print(config_diff)
-                
-                    with open('changelog/%s_C3PL_Conversion_Authentication_Sessions.txt_%s' % (device.alias,timestr), 'w') as f:
-                        with redirect_stdout(f):
-                            print(config_diff)
-                            f.close()
-    #
-                else:
-                    
-                    with open('changelog/%s_C3PL_Conversion_Authentication_Sessions.txt_%s' % (device.alias,timestr), 'w') as f:
-                        f.write("NO CHANGES")
-                        f.close()
-
-            # ---------------------------------------
-            # Re-capture state - Interfaces 
-            # ---------------------------------------
-            self.parsed_int_status = ParseShowCommandFunction.parse_show_command(steps, device, "show interfaces status")
-            post_parsed_int_status = self.parsed_int_status 
-
-
-            # ---------------------------------------
-            # Write post-change state - Interfaces 
-            # ---------------------------------------
-            with steps.start('Store Post Interfaces',continue_=True) as step:
-                
-                new_config_filename = "%s_Post_Interfaces_%s.json" % (device.alias,timestr)
-#
-            # Write New Learned Config as JSON
-                with open("post_configs/%s" % new_config_filename, "w") as fid:
-                    json.dump(self.parsed_int_status, fid, indent=4, sort_keys=True)
-                    fid.close()
-
-#
-            # ---------------------------------------
-            # Show the differential - Interfaces
-            # ---------------------------------------
-            with steps.start('Show Interfaces Differential',continue_=True) as step:
-                config_diff = Diff(pre_parsed_int_status, post_parsed_int_status)
-                config_diff.findDiff()
-                
-                if config_diff.diffs:
-                    print(config_diff)
-                
-                    with open('changelog/%s_C3PL_Conversion_Interfaces.txt_%s' % (device.alias,timestr), 'w') as f:
-                        with redirect_stdout(f):
-                            print(config_diff)
-                            f.close()
-    #
-                else:
-                    
-                    with open('changelog/%s_C3PL_Conversion_Interfaces.txt_%s' % (device.alias,timestr), 'w') as f:
-                        f.write("NO CHANGES")
-                        f.close()
\ No newline at end of file
+        # ---------------------------------------
+        # Parallel: each device records its own steps, reported once it finishes
+        # ---------------------------------------
+        runner = ParallelRunner(max_workers=max_workers,
+                                on_finish=lambda device_result: self.update_report(device_result.device_name))
+        results = runner.run(list(testbed), convert)
+
+        for device_name in sorted(results):
+            device_result = results[device_name]
+            with steps.start("Convert %s" % device_name, continue_=True) as device_step:
+                device_result.steps.report(device_step)
+                for artifact in device_result.artifacts:
+                    log.info("%s artifact: %s", device_name, artifact)
+                if device_result.exception is not None:
+                    device_step.errored("Conversion stopped\n{e}".format(e=device_result.exception))
+        self.report_metrics(connection_pool)
+
+    def run_waves(self, steps, testbed, conversion, connection_pool, max_workers, wave_endpoints, canary,
+                  settle_timeout):
+        """Back up and capture every device, then convert a canary and waves sized by their endpoints"""
+        @connection_pool.wrap
+        def prepare(device, device_steps):
+            prepared = conversion(device, stop_after="pre_capture")
+            prepared.run(device_steps)
+            return {"endpoints": prepared.endpoints, "sessions": prepared.sessions}
+
+        @connection_pool.wrap
+        def convert(device, device_steps):
+            # The backup and pre-capture of the prepare pass are picked up from the journal
+            return conversion(device, resume=True).run(device_steps)
+
+        runner = ParallelRunner(max_workers=max(1, int(max_workers)),
+                                on_finish=lambda device_result: self.update_report(device_result.device_name))
+        scheduler = WaveScheduler(runner, canary=int(canary),
+                                  wave_endpoints=int(wave_endpoints), settle_timeout=float(settle_timeout))
+        # Connected once for the whole settle polling of a device
+        rollout = scheduler.run(list(testbed), prepare, convert, lease=connection_pool.wrap)
+
+        wave_of = {name: index + 1 for index, wave in enumerate(rollout.waves) for name in wave}
+        for device_name in sorted(rollout.prepared):
+            with steps.start("Convert %s" % device_name, continue_=True) as device_step:
+                for device_result in (rollout.prepared[device_name], rollout.converted.get(device_name)):
+                    if device_result is None:
+                        continue
+                    device_result.steps.report(device_step)
+                    for artifact in device_result.artifacts:
+                        log.info("%s artifact: %s", device_name, artifact)
+                    if device_result.exception is not None:
+                        device_step.errored("Conversion stopped\n{e}".format(e=device_result.exception))
+                if device_name in rollout.unsettled:
+                    device_step.failed("Sessions did not come back within %ss" % settle_timeout)
+                if device_name in rollout.held:
+                    device_step.skipped("Held: wave %d waits for an earlier wave to settle" % wave_of[device_name])
+                elif device_name in wave_of and device_name not in rollout.converted:
+                    device_step.skipped("Not converted")
+
+    def update_report(self, device_name):
+        """Index what the device just wrote into the fleet report"""
+        if self.report is None:
+            return
+        device = self.testbed.devices[device_name]
+        try:
+            self.report.update(devices={device_name, device.alias})
+        except Exception:
+            log.exception("Could not update the fleet report with %s", device_name)
+
+    def report_metrics(self, connection_pool):
+        """Log where the run spent its time and keep the summary next to the metrics"""
+        self.parser.close()
+        log.info("Parse cache: %d hit(s), %d miss(es)", self.parser.cache.hits, self.parser.cache.misses)
+        log.info("At most %d of %d session(s) were open at once", connection_pool.peak, connection_pool.max_sessions)
+        self.metrics.write_summary("metrics/%s_summary.json" % timestr)
+        log.info("Run summary\n%s", self.metrics.format_summary())
+        if self.report is not None:
+            self.report.update()
+            log.info("Fleet report in %s\n%s", self.report.path, json.dumps(self.report.summary(), indent=4))
+            self.report.close()
@@ -0,0 +1,270 @@
+'''
+Where the pre/post captures and changelogs of a run are kept.
+
+Export a run kept in the content-addressed store to the usual JSON layout:
+
+$ python artifact_store.py export 20210823_114838 --out exported/
+
+'''
+
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import json
+import zlib
+import hashlib
+import argparse
+import tempfile
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# ----------------
+# Canonical encoding
+# ----------------
+def canonical_bytes(data):
+    """Compact, key-sorted JSON: identical structures give identical bytes"""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+# ----------------
+# JSON file store
+# ----------------
+class JsonFileStore:
+    """The original layout: one indented JSON or text file per capture"""
+    def __init__(self, run=None):
+        self.run = run
+
+    def put(self, folder, filename, data, device=None):
+        path = os.path.join(folder, filename)
+        with open(path, "w") as fid:
+            json.dump(data, fid, indent=4, sort_keys=True)
+        return path
+
+    def writer(self, folder, filename, device=None):
+        return open(os.path.join(folder, filename), "w")
+
+    def get(self, ref):
+        with open(ref) as fid:
+            return json.load(fid)
+
+# ----------------
+# Content-addressed store
+# ----------------
+class _BlobWriter:
+    """Stream text into a compressed blob, hashing it on the way"""
+    def __init__(self, store, folder, filename, device):
+        self.store = store
+        self.entry = {"folder": folder, "filename": filename, "device": device, "kind": "text"}
+        self._hash = hashlib.sha256()
+        self._compressor = zlib.compressobj(store.level)
+        self._size = 0
+        fd, self._temp = tempfile.mkstemp(dir=store.root, prefix=".blob_")
+        self._fid = os.fdopen(fd, "wb")
+
+    def write(self, text):
+        data = text.encode()
+        self._hash.update(data)
+        self._size += len(data)
+        self._fid.write(self._compressor.compress(data))
+
+    def close(self):
+        if self._fid is None:
+            return
+        self._fid.write(self._compressor.flush())
+        self._fid.close()
+        self._fid = None
+        digest = self._hash.hexdigest()
+        path = self.store._blob_path(digest, "txt")
+        if os.path.exists(path):
+            os.remove(self._temp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._temp, path)
+        self.entry.update({"hash": digest, "bytes": self._size, "stored_bytes": os.path.getsize(path)})
+        self.store._index(self.entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class ContentAddressedStore:
+    """Compressed blobs named by the hash of their content, plus a run index
+
+    Every dict or list (down to ``max_depth`` levels) whose canonical JSON is
+    larger than ``min_blob_size`` is stored once as its own blob and
+    referenced from its parent as ``{"$ref": <hash>}``, so subtrees that
+    repeat across devices and phases (unchanged interface tables, the same
+    policy-maps) cost one write. Blobs
+    are zlib compressed and, when ``msgpack`` is installed and asked for,
+    binary encoded. ``index/<run>.jsonl`` lists what the run stored.
+    """
+    def __init__(self, run, root="artifacts", level=6, min_blob_size=512, max_depth=2, encoding="json"):
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack encoding needs the msgpack package installed")
+        self.run = run
+        self.root = root
+        self.level = level
+        self.min_blob_size = min_blob_size
+        self.max_depth = max_depth
+        self.encoding = encoding
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "index"), exist_ok=True)
+
+    def _blob_path(self, digest, extension):
+        return os.path.join(self.root, "objects", digest[:2], "%s.%s" % (digest[2:], extension))
+
+    def _index(self, entry):
+        entry["run"] = self.run
+        with self._lock, open(os.path.join(self.root, "index", "%s.jsonl" % self.run), "a") as fid:
+            fid.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def _write_blob(self, data):
+        digest = content_hash(data)
+        extension = "mp" if self.encoding == "msgpack" else "json"
+        path = self._blob_path(digest, extension)
+        # Identical content is already there: nothing to write
+        if not os.path.exists(path):
+            if self.encoding == "msgpack":
+                data = msgpack.packb(json.loads(data), use_bin_type=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=self.root, prefix=".blob_")
+            with os.fdopen(fd, "wb") as fid:
+                fid.write(zlib.compress(data, self.level))
+            os.replace(temp, path)
+        return digest
+
+    def _encode(self, data, depth=0):
+        """Canonical bytes of ``data`` with large subtrees swapped for references
+
+        Below ``max_depth`` the subtree is serialised in one go; splitting
+        there would cost more than the deduplication saves.
+        """
+        if depth >= self.max_depth:
+            body = canonical_bytes(data)
+        elif isinstance(data, dict):
+            body = b"{" + b",".join(json.dumps(str(key)).encode() + b":" + self._encode(data[key], depth + 1)
+                                    for key in sorted(data, key=str)) + b"}"
+        elif isinstance(data, (list, tuple)):
+            body = b"[" + b",".join(self._encode(item, depth + 1) for item in data) + b"]"
+        else:
+            return canonical_bytes(data)
+        if len(body) < self.min_blob_size:
+            return body
+        return canonical_bytes({"$ref": self._write_blob(body)})
+
+    def put(self, folder, filename, data, device=None):
+        encoded = self._encode(data)
+        digest = json.loads(encoded)["$ref"] if encoded.startswith(b'{"$ref"') else self._write_blob(encoded)
+        self._index({"folder": folder, "filename": filename, "device": device, "kind": "json", "hash": digest})
+        return "%s:%s" % (self.run, digest)
+
+    def writer(self, folder, filename, device=None):
+        return _BlobWriter(self, folder, filename, device)
+
+    # ---------------------------------------
+    # Reading back
+    # ---------------------------------------
+    def _read_blob(self, digest):
+        for extension in ("json", "mp"):
+            path = self._blob_path(digest, extension)
+            if os.path.exists(path):
+                with open(path, "rb") as fid:
+                    data = zlib.decompress(fid.read())
+                return msgpack.unpackb(data, raw=False) if extension == "mp" else json.loads(data)
+        raise KeyError("No blob %s in %s" % (digest, self.root))
+
+    def _resolve(self, data):
+        if isinstance(data, dict):
+            if len(data) == 1 and "$ref" in data:
+                return self._resolve(self._read_blob(data["$ref"]))
+            return {key: self._resolve(value) for key, value in data.items()}
+        if isinstance(data, list):
+            return [self._resolve(item) for item in data]
+        return data
+
+    def get(self, ref):
+        return self._resolve({"$ref": ref.rsplit(":", 1)[-1]})
+
+    def read_text(self, digest):
+        with open(self._blob_path(digest, "txt"), "rb") as fid:
+            return zlib.decompress(fid.read()).decode()
+
+    def text_lines(self, digest, chunk_size=65536):
+        """Lines of a text blob, decompressed as they are read"""
+        decompressor = zlib.decompressobj()
+        pending = b""
+        with open(self._blob_path(digest, "txt"), "rb") as fid:
+            for chunk in iter(lambda: fid.read(chunk_size), b""):
+                pending += decompressor.decompress(chunk)
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    yield line.decode() + "\n"
+        pending += decompressor.flush()
+        for line in pending.splitlines(True):
+            yield line.decode()
+
+    def entries(self, run=None):
+        path = os.path.join(self.root, "index", "%s.jsonl" % (run or self.run))
+        with open(path) as fid:
+            for line in fid:
+                yield json.loads(line)
+
+    def export(self, out_dir, run=None):
+        """Write a run back out in the pre_configs/post_configs/changelog layout"""
+        written = []
+        for entry in self.entries(run):
+            folder = os.path.join(out_dir, entry["folder"])
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, entry["filename"])
+            with open(path, "w") as fid:
+                if entry["kind"] == "text":
+                    fid.write(self.read_text(entry["hash"]))
+                else:
+                    json.dump(self.get(entry["hash"]), fid, indent=4, sort_keys=True)
+            written.append(path)
+        return written
+
+# ----------------
+# Factory
+# ----------------
+def artifact_store(kind, run, root="artifacts"):
+    """Store selected by the job's ``artifact_store`` parameter"""
+    if kind == "json":
+        return JsonFileStore(run)
+    if kind in ("cas", "cas-msgpack"):
+        return ContentAddressedStore(run, root=root, encoding="msgpack" if kind == "cas-msgpack" else "json")
+    raise ValueError("Unknown artifact store %r, expected 'json', 'cas' or 'cas-msgpack'" % kind)
+
+# ----------------
+# Command line
+# ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Work with runs kept in the content-addressed artifact store")
+    parser.add_argument("--root", default="artifacts", help="store directory (default: artifacts)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="write a run out as the usual JSON and changelog files")
+    export.add_argument("run", help="run timestamp, e.g. 20210823_114838")
+    export.add_argument("--out", default=".", help="directory to export into (default: current directory)")
+    args = parser.parse_args(argv)
+
+    store = ContentAddressedStore(args.run, root=args.root)
+    for path in store.export(args.out):
+        print(path)
+
+if __name__ == "__main__":
+    main()
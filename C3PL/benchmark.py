@@ -0,0 +1,557 @@
+'''
+Offline benchmarks for the conversion job, run against local mock devices.
+
+Compare the legacy one-session-per-template push with the bundled push:
+
+$ python benchmark.py push --members 8 --line-latency 0.002 --session-latency 0.5
+
+Run the job's conversion over synthetic fleets of replay devices, time every
+stage from its metrics, and fail when a stage got slower than a saved
+baseline (for CI):
+
+$ python benchmark.py --json stages --fleets 1 50 1000 > baseline.json
+$ python benchmark.py stages --fleets 1 50 --baseline baseline.json --tolerance 0.25
+
+Compare converting a fleet all at once with a canary and rate-limited waves,
+against a simulated RADIUS server:
+
+$ python benchmark.py waves --fleet 20 --capacity 100 --rate 80
+
+Build the per-port tables of a fleet and time fleet-wide queries over them:
+
+$ python benchmark.py ports --fleet 1000
+
+Parse, store and diff a large MAC address table with Genie and as a MacTable:
+
+$ python benchmark.py mac --entries 20000
+
+'''
+
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from genie.utils.diff import Diff
+from artifact_store import artifact_store as artifact_store_for
+from config_push import ConfigBundle, ConfigPush
+from conversion_journal import ConversionJournal
+from device_conversion import DeviceConversion, conversion_bundle, render_conversion
+from mac_table import MacTable, MacTableDiff
+from mock_device import MockDevice, format_mac_table
+from parallel_execution import ParallelRunner, StepRecorder
+from parse_cache import ParseCache, Parser, offline_parse
+from port_table import PortTable
+from session_simulation import RadiusModel, ScaledClock, SimulatedSwitch
+from stage_metrics import StageMetrics
+from synthetic_fleet import synthetic_fleet, synthetic_recordings
+from template_render import TemplateRenderer
+from wave_scheduler import AUTHENTICATED, SessionRateLimiter, WaveScheduler, count_sessions, endpoints_per_interface
+
+template_dir = 'templates/'
+renderer = TemplateRenderer(template_dir)
+# What a conversion writes, relative to the folder it runs in
+RUN_FOLDERS = ("backup_configs", "pre_configs", "post_configs", "changelog", "journal", "facts_cache", "artifacts")
+
+# ----------------
+# Synthetic data
+# ----------------
+def access_interfaces(members, ports=48):
+    return ["GigabitEthernet%d/0/%d" % (member, port)
+            for member in range(1, members + 1) for port in range(1, ports + 1)]
+
+def access_ports(interfaces):
+    """Port table of 802.1X access ports with nothing connected"""
+    status = {interface: {"status": "notconnect", "vlan": "100"} for interface in interfaces}
+    dot1x = {interface: {"interface": interface, "pae": "authenticator"} for interface in interfaces}
+    return PortTable.from_captures({"interfaces": status}, {"interfaces": dot1x}, None, None)
+
+def conversion_sections(interfaces, vlan=100):
+    """The rendered templates in the order the job pushes them"""
+    rendered = render_conversion(renderer.render, access_ports(interfaces), vlan)
+    return [
+        ("legacy_dot1x_removal", rendered["legacy_dot1x_removal"]),
+        ("new_style", None),
+        ("junk_interface_removal", rendered["junk_interface_removal"]),
+        ("junk_removal", rendered["junk_removal"]),
+        ("new_global_config", rendered["new_global_config"]),
+        ("new_interface_config", rendered["new_interface_config"]),
+    ]
+
+# ----------------
+# Push benchmark
+# ----------------
+def push_legacy(device, sections):
+    """One configure call per template, as the job did originally"""
+    lines = 0
+    started = time.perf_counter()
+    for name, text in sections:
+        if text is None:
+            device.execute("authentication display new-style")
+            continue
+        lines += len([line for line in text.splitlines() if line.strip()])
+        device.configure(text, error_pattern=[])
+    return lines, time.perf_counter() - started, device.sessions
+
+def push_bundle(device, sections, mode, file_server=None, bundle_dir=None):
+    rendered = {name: text for name, text in sections if text is not None}
+    bundle = conversion_bundle(device.name, rendered, rendered)
+    push = ConfigPush(mode=mode, file_server=file_server, bundle_dir=bundle_dir)
+    push_result = push.apply(device, bundle, timestr="benchmark")
+    return push_result.lines, push_result.duration, push_result.sessions
+
+def run_push(args):
+    interfaces = access_interfaces(args.members, args.ports)
+    sections = conversion_sections(interfaces)
+    results = []
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        for mode in args.modes:
+            device = MockDevice("bench", session_latency=args.session_latency, line_latency=args.line_latency,
+                                exec_latency=args.exec_latency, merge_line_latency=args.merge_line_latency,
+                                file_root=bundle_dir)
+            if mode == "legacy":
+                lines, duration, sessions = push_legacy(device, sections)
+            else:
+                lines, duration, sessions = push_bundle(device, sections, mode, file_server="file://bench", bundle_dir=bundle_dir)
+            results.append({
+                "mode": mode,
+                "interfaces": len(interfaces),
+                "lines": lines,
+                "sessions": sessions,
+                "seconds": round(duration, 3),
+                "lines_per_second": round(lines / duration, 1) if duration else 0.0,
+            })
+    return results
+
+# ----------------
+# Stage benchmark
+# ----------------
+CAPTURE_COMMANDS = ("show mac address-table", "show dot1x all details",
+                    "show authentication sessions", "show interfaces status")
+
+def port_table(pre, device=None):
+    return PortTable.from_captures(pre["show interfaces status"], pre["show dot1x all details"],
+                                   pre["show authentication sessions"], pre["show mac address-table"], device=device)
+
+# The job's metrics stages, grouped into the stages reported here
+STAGE_GROUPS = (
+    ("backup", ("capture pre-change running config", "backup")),
+    # Parsing inline happens as each output is collected
+    ("capture", ("collect ", "parse ")),
+    ("store", ("Store ",)),
+    ("classify", ("port table", "facts")),
+    ("render", ("render ",)),
+    ("delta", ("delta render", "capture converted objects", "capture current running config")),
+    ("push", ("configure ", "wr mem")),
+    ("convergence", ("convergence",)),
+    ("post_capture", ("verify ", "capture post-change running config")),
+    ("diff", ("diff ",)),
+)
+STAGES = tuple(name for name, _ in STAGE_GROUPS) + ("total",)
+
+def stage_group(stage):
+    for name, prefixes in STAGE_GROUPS:
+        if stage.startswith(prefixes):
+            return name
+    return None
+
+@contextmanager
+def run_folder():
+    """Empty folder laid out like C3PL/ to run conversions in, as the working directory"""
+    here = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        for name in RUN_FOLDERS + ("templates",):
+            os.makedirs(os.path.join(folder, name))
+        # Linked one by one: the run writes its removal text next to the templates
+        for name in os.listdir(template_dir):
+            if name.endswith(".j2"):
+                os.symlink(os.path.abspath(os.path.join(template_dir, name)), os.path.join(folder, "templates", name))
+        os.chdir(folder)
+        try:
+            yield folder
+        finally:
+            os.chdir(here)
+
+def clear_run_folder():
+    """Drop what a device wrote, so a large fleet does not fill the disk"""
+    for name in RUN_FOLDERS:
+        shutil.rmtree(name)
+        os.makedirs(name)
+    for filename in os.listdir("templates"):
+        if not filename.endswith(".j2"):
+            os.remove(os.path.join("templates", filename))
+
+def convert_device(device, args, metrics, renderer):
+    """Run the job's whole conversion of one replay device, as the job does"""
+    conversion = DeviceConversion(device, "benchmark", metrics=metrics,
+                                  store=artifact_store_for(args.artifact_store, "benchmark"),
+                                  verify=args.verify, renderer=renderer, journal=ConversionJournal(),
+                                  resume=False, convergence_timeout=args.convergence_timeout,
+                                  parser=Parser(ParseCache()))
+    steps = StepRecorder(device.name)
+    conversion.run(steps)
+    return steps.worst_result
+
+def measure(stage, context, memory=False):
+    """Wall time, CPU time and (when tracing) peak allocated bytes of one stage"""
+    if memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    stage(context)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return wall, cpu, peak
+
+class TracedMetrics(StageMetrics):
+    """Stage metrics that also record the peak memory each stage allocated, as ``peak``
+
+    The peak is over what was in use when the stage started, and includes
+    its nested stages. Needs ``tracemalloc`` tracing and stages run on one
+    thread.
+    """
+    def __init__(self):
+        super().__init__()
+        # Per open stage: memory in use at its start, highest peak seen so far
+        self._frames = []
+
+    @contextmanager
+    def stage(self, device, stage, **fields):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+        frame = [current, 0]
+        self._frames.append(frame)
+        tracemalloc.reset_peak()
+        with super().stage(device, stage, **fields) as record:
+            try:
+                yield record
+            finally:
+                self._frames.pop()
+                peak = max(tracemalloc.get_traced_memory()[1], frame[1])
+                record["peak"] = peak - frame[0]
+                if self._frames:
+                    self._frames[-1][1] = max(self._frames[-1][1], peak)
+
+def run_stages(args):
+    """Convert synthetic fleets with DeviceConversion and add up its per-stage metrics
+
+    Tracing allocations slows everything down, so peak memory comes from a
+    second, untimed pass over each fleet: per stage, the most one device's
+    stage allocated.
+    """
+    results = []
+    fleet_options = dict(seed=args.seed, session_latency=args.session_latency, line_latency=args.line_latency)
+    with run_folder():
+        renderer = TemplateRenderer("templates/")
+        for size in args.fleets:
+            totals = {name: {"wall": 0.0, "cpu": 0.0} for name in STAGES}
+            ports = 0
+            failed = 0
+            for device in synthetic_fleet(size, **fleet_options):
+                ports += len(device.recordings["pre"]["show interfaces status"]["interfaces"])
+                metrics = StageMetrics()
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                result = convert_device(device, args, metrics, renderer)
+                totals["total"]["wall"] += time.perf_counter() - wall
+                totals["total"]["cpu"] += time.process_time() - cpu
+                failed += result == "errored"
+                clear_run_folder()
+                for record in metrics.records:
+                    name = stage_group(record["stage"])
+                    if name is not None:
+                        totals[name]["wall"] += record["duration"]
+                        totals[name]["cpu"] += record.get("cpu", 0.0)
+            if failed:
+                print("%d of %d device(s) did not convert cleanly" % (failed, size), file=sys.stderr)
+
+            peaks = {}
+            if args.memory:
+                tracemalloc.start()
+                try:
+                    for device in synthetic_fleet(size, **fleet_options):
+                        metrics = TracedMetrics()
+                        with metrics.stage(device.alias, "total"):
+                            convert_device(device, args, metrics, renderer)
+                        clear_run_folder()
+                        for record in metrics.records:
+                            # The sections are recorded after the push, which is traced as one stage
+                            name = record["stage"] if record["stage"] in ("push", "total") else stage_group(record["stage"])
+                            if name is not None and "peak" in record:
+                                peaks[name] = max(peaks.get(name, 0), record["peak"])
+                finally:
+                    tracemalloc.stop()
+
+            for name in STAGES:
+                results.append({
+                    "fleet": size,
+                    "ports": ports,
+                    "stage": name,
+                    "wall_seconds": round(totals[name]["wall"], 4),
+                    "cpu_seconds": round(totals[name]["cpu"], 4),
+                    "peak_mb": round(peaks.get(name, 0) / 1048576.0, 2) if args.memory else "",
+                })
+    return results
+
+def regressions(results, baseline, tolerance):
+    """Stages whose wall time grew more than ``tolerance`` over the baseline"""
+    previous = {(result["fleet"], result["stage"]): result for result in baseline}
+    slower = []
+    for result in results:
+        before = previous.get((result["fleet"], result["stage"]))
+        # Ignore stages too short to time reliably
+        if before and before["wall_seconds"] > 0.01 and result["wall_seconds"] > before["wall_seconds"] * (1 + tolerance):
+            slower.append((result, before))
+    return slower
+
+# ----------------
+# Rollout benchmark
+# ----------------
+def run_rollout(args, strategy):
+    """Convert a simulated fleet with one strategy and report the RADIUS load it caused"""
+    clock = ScaledClock(args.scale)
+    model = RadiusModel(args.capacity, timeout=args.radius_timeout, clock=clock)
+    rng = random.Random(args.seed)
+    devices = [SimulatedSwitch("sw%04d" % index, synthetic_recordings(index, rng.randint(1, args.max_members), args.seed), model)
+               for index in range(args.fleet)]
+
+    if strategy == "all-at-once":
+        runner = ParallelRunner(max_workers=len(devices))
+        scheduler = WaveScheduler(runner, canary=0, wave_endpoints=float("inf"), settle_timeout=args.settle_timeout,
+                                  poll_interval=args.poll_interval, clock=clock.time, sleep=clock.sleep)
+        limiter = None
+    else:
+        runner = ParallelRunner(max_workers=args.max_workers)
+        scheduler = WaveScheduler(runner, canary=args.canary, wave_endpoints=args.wave_endpoints,
+                                  settle_timeout=args.settle_timeout, poll_interval=args.poll_interval,
+                                  clock=clock.time, sleep=clock.sleep)
+        limiter = SessionRateLimiter(args.rate, clock=clock.time, sleep=clock.sleep)
+
+    weights = {}
+
+    def prepare(device, steps):
+        sessions = device.recordings["pre"]["show authentication sessions"]
+        weights[device.name] = endpoints_per_interface(sessions, device.recordings["pre"]["show mac address-table"])
+        return {"endpoints": sum(weights[device.name].values()), "sessions": count_sessions(sessions, AUTHENTICATED)}
+
+    def convert(device, steps):
+        interfaces = list(device.recordings["pre"]["show dot1x all details"]["interfaces"])
+        bundle = ConfigBundle(device.name)
+        bundle.add("new_interface_config", renderer.render('C3PL_new_int_config_enforcement.j2', interface=interfaces),
+                   weights=weights[device.name])
+        ConfigPush().apply(device, bundle, limiter=limiter)
+
+    started = clock.time()
+    wave_result = scheduler.run(devices, prepare, convert)
+    summary = model.summary()
+    return {
+        "strategy": strategy,
+        "devices": len(devices),
+        "endpoints": sum(estimate["endpoints"] for estimate in wave_result.estimates.values()),
+        "waves": len(wave_result.waves),
+        "seconds": round(clock.time() - started, 1),
+        "peak_auth_per_second": summary["peak_offered_per_second"],
+        "timeouts": summary["timeouts"],
+        "max_backlog": summary["max_backlog"],
+        "held": len(wave_result.held),
+    }
+
+def run_waves(args):
+    return [run_rollout(args, strategy) for strategy in args.strategies]
+
+# ----------------
+# Port table benchmark
+# ----------------
+FLEET_QUERIES = (
+    ("access ports", lambda ports: ports.select(role="access")),
+    ("802.1X access ports without endpoints", lambda ports: ports.select(role="access", dot1x=1, macs=0, sessions=0)),
+    ("ports with unauthorized sessions", lambda ports: ports.where("sessions", bool) &
+     ~ports.select(authorized=lambda authorized: authorized > 0)),
+    ("uplinks of 8-member stacks", lambda ports: ports.select(role="uplink", member=8)),
+)
+
+def run_ports(args):
+    """Build the port tables of a fleet, then query the fleet as one table"""
+    results = []
+    tables = []
+    build = 0.0
+    captured = 0
+    rng = random.Random(args.seed)
+    for index in range(args.fleet):
+        pre = synthetic_recordings(index, rng.randint(1, args.max_members), args.seed)["pre"]
+        captured += len(json.dumps([pre[command] for command in CAPTURE_COMMANDS]))
+        started = time.perf_counter()
+        tables.append(port_table(pre, device="sw%04d" % index))
+        build += time.perf_counter() - started
+    started = time.perf_counter()
+    fleet = PortTable.concat(tables)
+    concat = time.perf_counter() - started
+    results.append({"query": "build %d device table(s)" % args.fleet, "ports": len(fleet),
+                    "seconds": round(build, 4), "table_kb": round(sum(table.nbytes() for table in tables) / 1024.0, 1),
+                    "captures_kb": round(captured / 1024.0, 1)})
+    results.append({"query": "concatenate the fleet", "ports": len(fleet), "seconds": round(concat, 4),
+                    "table_kb": round(fleet.nbytes() / 1024.0, 1), "captures_kb": ""})
+    for name, query in FLEET_QUERIES:
+        started = time.perf_counter()
+        mask = query(fleet)
+        results.append({"query": name, "ports": fleet.count(mask), "seconds": round(time.perf_counter() - started, 4),
+                        "table_kb": "", "captures_kb": ""})
+    return results
+
+# ----------------
+# MAC table benchmark
+# ----------------
+def mac_tables(entries, churn, seed=0):
+    """Pre and post 'show mac address-table' outputs of ``entries`` MACs, ``churn`` of them moved or replaced"""
+    rng = random.Random(seed)
+    parsed = {"mac_table": {"vlans": {}}}
+    for index in range(entries):
+        vlan = str(100 + index % 4)
+        mac = "%04x.%04x.%04x" % (0x0050, index >> 16, index & 0xFFFF)
+        interface = "GigabitEthernet%d/0/%d" % (1 + index // 48 % 9, 1 + index % 48)
+        parsed["mac_table"]["vlans"].setdefault(vlan, {"vlan": int(vlan), "mac_addresses": {}})["mac_addresses"][mac] = {
+            "mac_address": mac, "interfaces": {interface: {"interface": interface, "entry_type": "dynamic"}}}
+    pre = format_mac_table(parsed)
+    for vlan in parsed["mac_table"]["vlans"].values():
+        addresses = vlan["mac_addresses"]
+        for mac in rng.sample(sorted(addresses), int(len(addresses) * churn)):
+            entry = addresses.pop(mac)
+            if rng.random() < 0.5:
+                addresses[mac.replace("0050.", "00a0.", 1)] = entry
+            else:
+                interface = "GigabitEthernet1/0/%d" % rng.randint(1, 48)
+                addresses[mac] = dict(entry, interfaces={interface: {"interface": interface, "entry_type": "dynamic"}})
+    return pre, format_mac_table(parsed)
+
+def mac_genie(pre, post):
+    pre = offline_parse("show mac address-table", "iosxe", None, pre)[0]
+    post = offline_parse("show mac address-table", "iosxe", None, post)[0]
+    for data in (pre, post):
+        json.dumps(data, indent=4, sort_keys=True)
+    config_diff = Diff(pre, post)
+    config_diff.findDiff()
+    return str(config_diff).count("\n")
+
+def mac_streamed(pre, post):
+    pre = MacTable.from_output(pre)
+    post = MacTable.from_output(post)
+    for table in (pre, post):
+        json.dumps(table.to_parsed(), indent=4, sort_keys=True)
+    changelog = tempfile.TemporaryFile("w")
+    with changelog:
+        return MacTableDiff(pre, post).write(changelog)
+
+def run_mac(args):
+    pre, post = mac_tables(args.entries, args.churn, args.seed)
+    results = []
+    for name, path in (("genie", mac_genie), ("streamed", mac_streamed)):
+        context = {}
+        wall, cpu, peak = measure(lambda context: context.update(lines=path(pre, post)), context, memory=True)
+        results.append({"path": name, "entries": args.entries, "diff_lines": context["lines"],
+                        "wall_seconds": round(wall, 3), "cpu_seconds": round(cpu, 3), "peak_kb": round(peak / 1024.0, 1)})
+    return results
+
+# ----------------
+# Command line
+# ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the C3PL conversion job")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    push = subparsers.add_parser("push", help="time pushing one device's conversion")
+    push.add_argument("--members", type=int, default=1, help="stack members (default: 1)")
+    push.add_argument("--ports", type=int, default=48, help="access ports per member (default: 48)")
+    push.add_argument("--modes", nargs="+", default=["legacy", "session", "file"], choices=["legacy", "session", "file"])
+    push.add_argument("--session-latency", type=float, default=0.5, help="seconds to open a config session")
+    push.add_argument("--line-latency", type=float, default=0.002, help="seconds per config line over the CLI")
+    push.add_argument("--exec-latency", type=float, default=0.1, help="seconds per exec command")
+    push.add_argument("--merge-line-latency", type=float, default=0.0002, help="seconds per line merged from a file")
+    push.set_defaults(run=run_push)
+
+    stages = subparsers.add_parser("stages", help="time every conversion stage over synthetic fleets")
+    stages.add_argument("--fleets", type=int, nargs="+", default=[1, 50, 1000], help="fleet sizes (default: 1 50 1000)")
+    stages.add_argument("--seed", type=int, default=0, help="seed for the synthetic fleet")
+    stages.add_argument("--session-latency", type=float, default=0.0, help="seconds to open a config session")
+    stages.add_argument("--line-latency", type=float, default=0.0, help="seconds per config line over the CLI")
+    stages.add_argument("--no-memory", dest="memory", action="store_false", help="skip peak memory tracing")
+    stages.add_argument("--artifact-store", dest="artifact_store", choices=["json", "cas"], default="json",
+                        help="where the conversions keep their captures (default: json)")
+    stages.add_argument("--full-verify", dest="verify", action="store_const", const="full", default="targeted",
+                        help="re-capture the whole device after the push")
+    stages.add_argument("--convergence-timeout", type=float, default=0,
+                        help="seconds each device waits for its sessions (default: 0, not waiting)")
+    stages.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    stages.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline (default: 0.25)")
+    stages.set_defaults(run=run_stages)
+
+    waves = subparsers.add_parser("waves", help="compare rollout strategies against a simulated RADIUS server")
+    waves.add_argument("--fleet", type=int, default=20, help="switches in the fleet (default: 20)")
+    waves.add_argument("--max-members", type=int, default=4, help="largest stack in the fleet (default: 4)")
+    waves.add_argument("--seed", type=int, default=0, help="seed for the synthetic fleet")
+    waves.add_argument("--strategies", nargs="+", default=["all-at-once", "waves"], choices=["all-at-once", "waves"])
+    waves.add_argument("--capacity", type=float, default=100, help="authentications per second RADIUS answers (default: 100)")
+    waves.add_argument("--radius-timeout", type=float, default=5.0, help="seconds before an endpoint retries (default: 5)")
+    waves.add_argument("--rate", type=float, default=80, help="fleet-wide new sessions per second (default: 80)")
+    waves.add_argument("--canary", type=int, default=1, help="devices in the canary wave (default: 1)")
+    waves.add_argument("--wave-endpoints", type=int, default=1000, help="endpoints per wave (default: 1000)")
+    waves.add_argument("--max-workers", type=int, default=10, help="devices converted at once within a wave (default: 10)")
+    waves.add_argument("--settle-timeout", type=float, default=300, help="simulated seconds a wave may take to settle")
+    waves.add_argument("--poll-interval", type=float, default=5, help="simulated seconds between session checks")
+    waves.add_argument("--scale", type=float, default=50, help="simulated seconds per real second (default: 50)")
+    waves.set_defaults(run=run_waves)
+
+    ports = subparsers.add_parser("ports", help="build per-port tables for a fleet and query it as one")
+    ports.add_argument("--fleet", type=int, default=1000, help="switches in the fleet (default: 1000)")
+    ports.add_argument("--max-members", type=int, default=9, help="largest stack in the fleet (default: 9)")
+    ports.add_argument("--seed", type=int, default=0, help="seed for the synthetic fleet")
+    ports.set_defaults(run=run_ports)
+
+    mac = subparsers.add_parser("mac", help="parse, store and diff a large MAC address table")
+    mac.add_argument("--entries", type=int, default=20000, help="MAC addresses in the table (default: 20000)")
+    mac.add_argument("--churn", type=float, default=0.05, help="share of addresses moved or replaced (default: 0.05)")
+    mac.add_argument("--seed", type=int, default=0, help="seed for the synthetic table")
+    mac.set_defaults(run=run_mac)
+
+    args = parser.parse_args(argv)
+    results = args.run(args)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    else:
+        columns = list(results[0])
+        print("  ".join("%18s" % column for column in columns))
+        for result in results:
+            print("  ".join("%18s" % result[column] for column in columns))
+
+    if getattr(args, "baseline", None):
+        with open(args.baseline) as fid:
+            slower = regressions(results, json.load(fid), args.tolerance)
+        for result, before in slower:
+            print("REGRESSION fleet=%s stage=%s: %.3fs -> %.3fs" % (
+                result["fleet"], result["stage"], before["wall_seconds"], result["wall_seconds"]), file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
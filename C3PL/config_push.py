@@ -0,0 +1,302 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import re
+import time
+import logging
+from bisect import bisect_left
+from running_config import canonical_interface
+
+log = logging.getLogger(__name__)
+
+# IOS marks a rejected line with one of these right after echoing it
+ERROR_LINE = re.compile(r"^%\s*(Invalid input|Incomplete command|Ambiguous command|Unknown command|Error)", re.IGNORECASE)
+PROMPT = re.compile(r"^\S+?\([^)]*\)#")
+
+# ----------------
+# Bundle
+# ----------------
+def config_lines(text):
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith("!")]
+
+class ConfigSection:
+    """A named, ordered block of config lines, or a single exec command
+
+    A section built with ``render`` gets its lines at push time, from
+    ``render(device)``, so it can depend on what earlier sections did. A
+    ``critical`` section is one the sections after it rely on: when the
+    device rejects any of its lines, nothing after it is pushed.
+    """
+    def __init__(self, name, lines, exec_command=False, render=None, weights=None, critical=False):
+        self.name = name
+        self.lines = lines
+        self.exec_command = exec_command
+        self.render = render
+        self.weights = weights
+        self.critical = critical
+
+    def resolve(self, device):
+        if self.lines is None:
+            self.lines = config_lines(self.render(device))
+        return self.lines
+
+class ConfigBundle:
+    """The whole change for one device, in push order"""
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.sections = []
+
+    def add(self, name, text, weights=None, critical=False):
+        """``weights`` maps an interface to the sessions its block restarts, for paced pushes"""
+        self.sections.append(ConfigSection(name, config_lines(text), weights=weights, critical=critical))
+
+    def add_deferred(self, name, render, critical=False):
+        self.sections.append(ConfigSection(name, None, render=render, critical=critical))
+
+    def add_exec(self, name, command):
+        self.sections.append(ConfigSection(name, [command], exec_command=True))
+
+    @property
+    def line_count(self):
+        return sum(len(section.lines or ()) for section in self.sections if not section.exec_command)
+
+    def segments(self):
+        """Group consecutive config sections; exec commands split the bundle
+
+        So their errors can stop the push in time, critical sections are
+        not grouped with the sections after them.
+        """
+        segment = []
+        for section in self.sections:
+            if section.exec_command:
+                if segment:
+                    yield segment
+                    segment = []
+                yield [section]
+            else:
+                if segment and segment[-1].critical and not section.critical:
+                    yield segment
+                    segment = []
+                segment.append(section)
+        if segment:
+            yield segment
+
+    def text(self):
+        blocks = []
+        for section in self.sections:
+            marker = "exec" if section.exec_command else "config"
+            blocks.append("! --- %s (%s) ---" % (section.name, marker))
+            blocks.extend(section.lines if section.lines is not None else ["! rendered at push time"])
+        return "\n".join(blocks) + "\n"
+
+def paced_chunks(segment, budget):
+    """Split a segment's lines into (lines, sessions) chunks of at most ``budget`` sessions
+
+    Splits fall only before an ``interface`` line; a block weighs what its
+    section's ``weights`` give its interface, anything else weighs nothing.
+    A block heavier than the budget goes alone.
+    """
+    chunks = []
+    lines = []
+    weight = 0
+    for section in segment:
+        weights = section.weights or {}
+        for line in section.lines:
+            block_weight = 0
+            if line.startswith("interface "):
+                block_weight = weights.get(canonical_interface(line.split(None, 1)[1]), 0)
+                if lines and block_weight and weight + block_weight > budget:
+                    chunks.append((lines, weight))
+                    lines = []
+                    weight = 0
+            lines.append(line)
+            weight += block_weight
+    if lines:
+        chunks.append((lines, weight))
+    return chunks
+
+# ----------------
+# Results
+# ----------------
+class SectionResult:
+    """How one section of the bundle went on the device"""
+    def __init__(self, name, lines):
+        self.name = name
+        self.lines = lines
+        self.errors = []
+        self.duration = 0.0
+        self.cpu = 0.0
+        self.resumed = False
+        self.held = False
+
+    @property
+    def result(self):
+        if self.errors:
+            return "failed"
+        return "held" if self.held else "passed"
+
+class PushResult:
+    """Per-section results plus totals for one bundle push"""
+    def __init__(self, device_name, mode):
+        self.device_name = device_name
+        self.mode = mode
+        self.sections = {}
+        self.sessions = 0
+        self.lines = 0
+        self.duration = 0.0
+        # Critical sections the device rejected lines of, which stopped the push
+        self.stopped_by = []
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.duration if self.duration else 0.0
+
+# ----------------
+# Push engine
+# ----------------
+class ConfigPush:
+    """Apply a ConfigBundle in as few config sessions as possible
+
+    ``session`` mode sends each run of config sections in one ``configure``
+    call. ``file`` mode writes the run to a file, copies it to flash from
+    ``file_server`` and merges it with ``copy <file> running-config``.
+    """
+    def __init__(self, mode="session", file_server=None, bundle_dir="bundles"):
+        if mode not in ("session", "file"):
+            raise ValueError("Unknown push mode %r, expected 'session' or 'file'" % mode)
+        if mode == "file" and not file_server:
+            raise ValueError("The 'file' push mode needs a file_server URL the device can copy from")
+        self.mode = mode
+        self.file_server = file_server.rstrip("/") if file_server else None
+        self.bundle_dir = bundle_dir
+
+    def apply(self, device, bundle, timestr="", done=(), checkpoint=None, limiter=None):
+        """Push ``bundle``; sections named in ``done`` are left out
+
+        ``checkpoint(sections, push_result)`` is called once each segment
+        is on the device, with the sections it carried. With a ``limiter``
+        (a SessionRateLimiter), sections carrying ``weights`` are pushed in
+        chunks that each wait for room for the sessions they restart. Once
+        a critical section has errors the rest of the bundle is held: not
+        pushed, and listed in ``stopped_by``.
+        """
+        push_result = PushResult(bundle.device_name, self.mode)
+        for section in bundle.sections:
+            push_result.sections[section.name] = SectionResult(section.name, len(section.lines or ()))
+
+        started = time.perf_counter()
+        for index, segment in enumerate(bundle.segments()):
+            if push_result.stopped_by:
+                for section in segment:
+                    push_result.sections[section.name].held = True
+                continue
+            segment_started = time.perf_counter()
+            segment_cpu = time.thread_time()
+            for section in segment:
+                if section.name in done:
+                    # Applied by an earlier run: not rendered, not pushed
+                    section.lines = []
+                    push_result.sections[section.name].resumed = True
+                push_result.sections[section.name].lines = len(section.resolve(device))
+            pending = [section for section in segment if section.name not in done]
+            if not any(section.lines for section in segment):
+                # Nothing left to change in this segment
+                if checkpoint and pending:
+                    checkpoint(pending, push_result)
+                continue
+            if segment[0].exec_command:
+                output = device.execute(segment[0].lines[0])
+            elif self.mode == "session":
+                output = self._push_session(device, segment, limiter)
+            else:
+                if limiter is not None:
+                    # One merge restarts every session in the file at once
+                    limiter.acquire(sum(weight for _, weight in paced_chunks(segment, float("inf"))))
+                output = self._push_file(device, bundle, segment, index, timestr)
+            if not segment[0].exec_command:
+                push_result.sessions += 1
+                push_result.lines += sum(len(section.lines) for section in segment)
+                self._attribute_errors(output or "", segment, push_result)
+            elapsed = time.perf_counter() - segment_started
+            cpu = time.thread_time() - segment_cpu
+            # Sections share their segment's time in proportion to their size
+            segment_lines = sum(len(section.lines) for section in segment) or 1
+            for section in segment:
+                push_result.sections[section.name].duration = elapsed * len(section.lines) / segment_lines
+                push_result.sections[section.name].cpu = cpu * len(section.lines) / segment_lines
+            if checkpoint and pending:
+                checkpoint(pending, push_result)
+            push_result.stopped_by = [section.name for section in segment
+                                      if section.critical and push_result.sections[section.name].errors]
+        push_result.duration = time.perf_counter() - started
+
+        log.info("%s: pushed %d lines in %d session(s), %.1fs (%.0f lines/s)",
+                 bundle.device_name, push_result.lines, push_result.sessions,
+                 push_result.duration, push_result.lines_per_second)
+        return push_result
+
+    def _push_session(self, device, segment, limiter=None):
+        # No error pattern: let the whole segment through and attribute errors after
+        if limiter is None or not any(section.weights for section in segment):
+            lines = [line for section in segment for line in section.lines]
+            return device.configure(lines, error_pattern=[])
+        outputs = []
+        for lines, weight in paced_chunks(segment, limiter.burst):
+            if weight:
+                limiter.acquire(weight)
+            outputs.append(device.configure(lines, error_pattern=[]) or "")
+        return "\n".join(outputs)
+
+    def _push_file(self, device, bundle, segment, index, timestr):
+        from unicon.eal.dialogs import Dialog, Statement
+
+        filename = "%s_C3PL_%s_%d.cfg" % (bundle.device_name, timestr, index)
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        with open(os.path.join(self.bundle_dir, filename), "w") as fid:
+            for section in segment:
+                fid.write("\n".join(section.lines) + "\n")
+            fid.write("end\n")
+
+        confirm = Dialog([
+            Statement(pattern=r"Destination filename \[.*\]\?", action="sendline()", loop_continue=True),
+            Statement(pattern=r"\[confirm\]", action="sendline()", loop_continue=True),
+            Statement(pattern=r"Do you want to over write\? \[confirm\]", action="sendline()", loop_continue=True),
+        ])
+        device.execute("copy %s/%s flash:%s" % (self.file_server, filename, filename), reply=confirm)
+        output = device.execute("copy flash:%s running-config" % filename, reply=confirm, error_pattern=[])
+        device.execute("delete /force flash:%s" % filename)
+        return output
+
+    @staticmethod
+    def _attribute_errors(output, segment, push_result):
+        """Map IOS error markers in the output back to the section that caused them"""
+        positions = {}
+        order = []
+        for section in segment:
+            for line in section.lines:
+                positions.setdefault(line, []).append(len(order))
+                order.append(section.name)
+
+        cursor = 0
+        current = None
+        current_command = None
+        for raw_line in output.splitlines():
+            line = raw_line.strip()
+            if ERROR_LINE.match(line):
+                name = order[current] if current is not None else segment[0].name
+                push_result.sections[name].errors.append("%s: %s" % (current_command, line))
+                continue
+            command = PROMPT.sub("", line).strip()
+            candidates = positions.get(command)
+            if candidates:
+                index = bisect_left(candidates, cursor)
+                if index < len(candidates):
+                    current = candidates[index]
+                    current_command = command
+                    cursor = current + 1
@@ -0,0 +1,95 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from stage_metrics import StageMetrics
+
+try:
+    from unicon.core.errors import ConnectionError as UniconConnectionError
+except ImportError:
+    UniconConnectionError = ConnectionError
+
+log = logging.getLogger(__name__)
+
+# What a connect that may succeed on a later attempt raises; unicon's
+# TimeoutError is a TimeoutError, so an OSError
+CONNECT_ERRORS = (OSError, UniconConnectionError)
+
+# ----------------
+# Connection pool
+# ----------------
+class ConnectionPool:
+    """Connect each device only while its work runs, with at most ``max_sessions`` sessions open
+
+    ``session(device)`` waits for a free slot, connects, retrying a failed
+    connect ``retries`` times with a delay that starts at ``backoff``
+    seconds and doubles each time, and disconnects as soon as the block
+    ends. The time spent connecting is recorded as the ``connect`` stage of
+    the device.
+    """
+    def __init__(self, max_sessions=10, retries=3, backoff=5.0, metrics=None, connect_kwargs=None,
+                 sleep=time.sleep):
+        self.max_sessions = max(1, int(max_sessions))
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics or StageMetrics()
+        self.connect_kwargs = connect_kwargs or {}
+        self.sleep = sleep
+        self.live = 0
+        self.peak = 0
+        self._slots = threading.BoundedSemaphore(self.max_sessions)
+        self._lock = threading.Lock()
+
+    def connect(self, device):
+        """Connect ``device``, retrying with backoff; returns the attempts it took"""
+        with self.metrics.stage(device.alias, "connect", attempts=0) as record:
+            delay = self.backoff
+            while True:
+                record["attempts"] += 1
+                try:
+                    device.connect(**self.connect_kwargs)
+                    return record["attempts"]
+                except CONNECT_ERRORS as e:
+                    if record["attempts"] > self.retries:
+                        raise
+                    log.warning("Could not connect to %s (attempt %d): %s, retrying in %.0fs", device.name,
+                                record["attempts"], e, delay)
+                self.sleep(delay)
+                delay *= 2
+
+    def disconnect(self, device):
+        try:
+            device.disconnect()
+        except Exception:
+            log.exception("Could not disconnect from %s", device.name)
+
+    @contextmanager
+    def session(self, device):
+        with self._slots:
+            with self._lock:
+                self.live += 1
+                self.peak = max(self.peak, self.live)
+            try:
+                if not getattr(device, "connected", False):
+                    self.connect(device)
+                yield device
+            finally:
+                if getattr(device, "connected", False):
+                    self.disconnect(device)
+                with self._lock:
+                    self.live -= 1
+
+    def wrap(self, target):
+        """``target(device, steps)`` run inside a session of the device"""
+        def connected_target(device, *args, **kwargs):
+            with self.session(device):
+                return target(device, *args, **kwargs)
+        return connected_target
@@ -0,0 +1,120 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import json
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The stages of one device's conversion, in order. The six in the middle
+# are the sections of the pushed bundle.
+STAGES = (
+    "backup",
+    "pre_capture",
+    "legacy_dot1x_removal",
+    "new_style",
+    "junk_interface_removal",
+    "junk_removal",
+    "new_global_config",
+    "new_interface_config",
+    "wr_mem",
+    "convergence",
+    "post_capture",
+    "diff",
+)
+PUSH_STAGES = STAGES[2:8]
+
+# ----------------
+# Journal
+# ----------------
+class ConversionJournal:
+    """Append-only record of the stages each device has completed
+
+    One JSON line per completed stage, with whatever the stage needs to be
+    resumed from (artifact references, what it touched). Every line is
+    written with a single ``write`` on a file opened for appending, under a
+    lock and, where available, an exclusive ``flock``, then fsync'ed: worker
+    threads and concurrent jobs can share one journal and a crash loses at
+    most the line being written. A torn last line is ignored on load.
+    Without a ``path`` the journal only lives in memory.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._devices = {}
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fid:
+            for line in fid:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry):
+        if entry.get("event") == "reset":
+            self._devices.pop(entry["device"], None)
+        else:
+            self._devices.setdefault(entry["device"], {})[entry["stage"]] = entry
+
+    def _append(self, entry):
+        with self._lock:
+            self._apply(entry)
+            if not self.path:
+                return
+            line = (json.dumps(entry, sort_keys=True) + "\n").encode()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # ---------------------------------------
+    # Recording
+    # ---------------------------------------
+    def record(self, device, stage, run, **data):
+        if stage not in STAGES:
+            raise ValueError("Unknown conversion stage %r" % stage)
+        self._append({"device": device, "stage": stage, "run": run, "time": round(time.time(), 3), "data": data})
+
+    def reset(self, device, run):
+        """Forget what ``device`` completed; its next run starts from the backup"""
+        self._append({"device": device, "event": "reset", "run": run, "time": round(time.time(), 3)})
+
+    # ---------------------------------------
+    # Reading
+    # ---------------------------------------
+    def completed(self, device):
+        """Completed stages of ``device``: stage -> journal entry"""
+        with self._lock:
+            return dict(self._devices.get(device, {}))
+
+    def data(self, device, stage):
+        entry = self.completed(device).get(stage)
+        return entry["data"] if entry else None
+
+    def finished(self, device):
+        return "diff" in self.completed(device)
+
+    def last_stage(self, device):
+        completed = self.completed(device)
+        return next((stage for stage in reversed(STAGES) if stage in completed), None)
@@ -0,0 +1,159 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import logging
+from running_config import RunningConfig, canonical_interface, config_tree
+
+log = logging.getLogger(__name__)
+
+# Cheap filtered capture of the objects the removal templates act on. Run
+# after 'authentication display new-style', which generates some of them.
+OBJECTS_COMMAND = ("show running-config | include ^interface |^service-template |"
+                   "^policy-map type control |^class-map type control |service-policy type control subscriber")
+
+# ----------------
+# Rendered template parsing
+# ----------------
+def interface_blocks(text):
+    """Split rendered interface template text into (interface, lines) blocks
+
+    The interface templates are not indented, so a block runs from an
+    ``interface`` line to the next one, a blank line or a ``!``. Lines
+    outside any block are returned with ``None`` as the interface.
+    """
+    blocks = []
+    current = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("!"):
+            current = None
+            continue
+        if stripped.startswith("interface "):
+            current = (canonical_interface(stripped.split(None, 1)[1]), [])
+            blocks.append(current)
+        elif current is None:
+            blocks.append((None, [stripped]))
+        else:
+            current[1].append(stripped)
+    return blocks
+
+def flatten(tree, depth=0):
+    """Turn a config tree back into indented lines"""
+    lines = []
+    for line, children in tree.items():
+        lines.append(" " * depth + line)
+        lines.extend(flatten(children, depth + 1))
+    return lines
+
+def matches(command, line):
+    """Whether a running config line is what ``no <command>`` would remove
+
+    A trailing number in the template (a timer, a VLAN) matches whatever
+    value is configured, so ``no dot1x timeout quiet-period 2`` still
+    removes ``dot1x timeout quiet-period 5``.
+    """
+    if line == command or line.startswith(command + " "):
+        return True
+    stem, _, value = command.rpartition(" ")
+    return bool(stem) and value.isdigit() and line.startswith(stem + " ")
+
+# ----------------
+# Delta renderer
+# ----------------
+class DeltaRenderer:
+    """Reduce rendered templates to the lines that change the device
+
+    Removal lines are kept only when what they remove is configured and is
+    not part of the target state; added lines are kept only when they are
+    not configured yet. Ports and global objects already at the target state
+    drop out entirely, so a re-run pushes close to nothing.
+    """
+    def __init__(self, running_config):
+        self.running_config = running_config
+        self.rendered_lines = 0
+        self.delta_lines = 0
+
+    @classmethod
+    def from_device(cls, device):
+        """Renderer over a fresh, filtered capture of the removable objects"""
+        return cls(RunningConfig(device.execute(OBJECTS_COMMAND)))
+
+    def _count(self, rendered, delta):
+        self.rendered_lines += rendered
+        self.delta_lines += delta
+        return delta
+
+    def _present(self, command, interface=None):
+        if interface is None:
+            lines = self.running_config.tree
+        else:
+            lines = self.running_config.interfaces.get(interface, ())
+        return [line for line in lines if matches(command, line)]
+
+    def interface_removals(self, text, target=""):
+        """Keep ``no`` lines that remove something configured and not wanted"""
+        wanted = {}
+        for interface, lines in interface_blocks(target):
+            wanted.setdefault(interface, set()).update(lines)
+
+        # Ports configured alike reduce alike: each distinct port is worked out once
+        reduced = {}
+        output = []
+        for interface, lines in interface_blocks(text):
+            configured = self.running_config.interfaces.get(interface, ()) if interface is not None else None
+            key = (tuple(lines), tuple(configured) if configured is not None else None,
+                   frozenset(wanted.get(interface, ())))
+            keep = reduced.get(key)
+            if keep is None:
+                keep = reduced[key] = []
+                for line in lines:
+                    if not line.startswith("no "):
+                        keep.append(line)
+                        continue
+                    present = self._present(line[3:], interface)
+                    if any(found not in wanted.get(interface, ()) for found in present):
+                        keep.append(line)
+            self._count(len(lines), len(keep))
+            if keep:
+                if interface is not None:
+                    output.append("interface %s" % interface)
+                output.extend(keep)
+        return "\n".join(output)
+
+    def interface_additions(self, text):
+        """Keep interface lines that are not configured yet"""
+        output = []
+        for interface, lines in interface_blocks(text):
+            configured = set(self.running_config.interfaces.get(interface, ()))
+            keep = [line for line in lines if line not in configured]
+            self._count(len(lines), len(keep))
+            if keep:
+                if interface is not None:
+                    output.append("interface %s" % interface)
+                output.extend(keep)
+        return "\n".join(output)
+
+    def global_removals(self, text):
+        """Keep global ``no`` lines whose object exists"""
+        output = []
+        for interface, lines in interface_blocks(text):
+            keep = [line for line in lines if not line.startswith("no ") or self._present(line[3:])]
+            self._count(len(lines), len(keep))
+            output.extend(keep)
+        return "\n".join(output)
+
+    def global_additions(self, text):
+        """Keep global blocks that differ from the running config"""
+        running = self.running_config.tree
+        output = []
+        for line, children in config_tree(text).items():
+            block = flatten({line: children})
+            keep = block if running.get(line) != children else []
+            self._count(len(block), len(keep))
+            output.extend(keep)
+        return "\n".join(output)
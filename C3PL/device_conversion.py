@@ -0,0 +1,584 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import logging
+from general_functionalities import ParseRunningConfigFunction, ParseShowCommandFunction
+from config_push import ConfigBundle, ConfigPush
+from delta_render import DeltaRenderer
+from stage_metrics import StageMetrics
+from artifact_store import JsonFileStore
+from state_diff import StateDiff
+from mac_table import MAC_COMMAND, MacTable, MacTableDiff
+from post_verification import PostVerification, VerificationScope
+from template_render import TemplateRenderer
+from device_facts import DATA_VLAN_NAME, FactsCache
+from conversion_journal import ConversionJournal, PUSH_STAGES
+from running_config import RunningConfig
+from port_table import PortTable
+from session_convergence import ConvergenceWatcher, expected_clients
+
+log = logging.getLogger(__name__)
+template_dir = 'templates/'
+# Shared by every device converted in this process
+default_renderer = TemplateRenderer(template_dir)
+
+# Step reported for each section of the pushed bundle
+SECTION_STEPS = {
+    "legacy_dot1x_removal": 'Wipe Legacy Dot1x Configs from all ports',
+    "new_style": 'Convert Dot1x to new-style',
+    "junk_interface_removal": "Remove applied default policy per interface",
+    "junk_removal": "Remove global default policies and templates",
+    "new_global_config": "Apply new global configs",
+    "new_interface_config": 'Applying new interface configs',
+}
+
+# Template of the new interface config for the 802.1X ports of each role
+PORT_TEMPLATES = {
+    "access": 'C3PL_new_int_config_enforcement.j2',
+}
+
+# Captures taken before the push: command, label, store step
+PRE_CAPTURES = (
+    ("show mac address-table", "MAC_Table", 'Store Pre-state MAC Table'),
+    ("show dot1x all details", "Dot1x", 'Store Pre State Dot1x Interfaces'),
+    ("show authentication sessions", "Authentication_Sessions", 'Store Pre State Authentication Sessions'),
+    ("show interfaces status", "Interfaces_Status", 'Store Pre State Interface Status'),
+)
+# Pre-change captures a device is not converted without
+REQUIRED_CAPTURES = ("show interfaces status", "show dot1x all details")
+
+# Captures re-taken after the push: command, label, store step, diff step
+POST_CAPTURES = (
+    ("show mac address-table", "MAC_Table", 'Store Post MAC Table', 'Show MAC Table Differential'),
+    ("show dot1x all details", "Dot1x", 'Store Post Dot1x', 'Show Dot1x Differential'),
+    ("show authentication sessions", "Authentication_Sessions", 'Store Post Authentication Sessions',
+     'Show Authentication Sessions Differential'),
+    ("show interfaces status", "Interfaces", 'Store Post Interfaces', 'Show Interfaces Differential'),
+)
+
+# ----------------
+# Rendering
+# ----------------
+def render_conversion(render, ports, data_vlan, role_templates=False):
+    """Every template of one device's conversion, by bundle section
+
+    ``render(template_name, **data)`` renders one template. The access
+    ports get the removal templates and every 802.1X port the new interface
+    config; with ``role_templates`` the 802.1X ports of each role get that
+    role's template and ports of other roles are left as is. Only the
+    interface names go in, so identical port layouts share one render.
+    """
+    access = ports.interfaces(ports.select(role="access"))
+    #Ask for enforcement or monitor before applying config to interfaces?
+    new_int_config = ""
+    dot1x = ports.equal("dot1x", 1)
+    if role_templates:
+        for role, template_name in PORT_TEMPLATES.items():
+            interfaces = ports.interfaces(dot1x & ports.equal("role", role))
+            if interfaces:
+                new_int_config += render(template_name, interface=interfaces)
+    elif ports.count(dot1x):
+        new_int_config = render(PORT_TEMPLATES["access"], interface=ports.interfaces(dot1x))
+    return {
+        "legacy_dot1x_removal": render('legacy_dot1x_removal.j2', interface=access),
+        "junk_interface_removal": render('junk_interface_removal_template.j2', interface=access),
+        "junk_removal": render('junk_removal_template.j2', interface=access),
+        "new_global_config": render('C3PL_new_global_configs.j2', vlan=data_vlan),
+        "new_interface_config": new_int_config,
+    }
+
+def untemplated_ports(ports, role_templates=False):
+    """How many 802.1X ports have a role with no template, and are left as is"""
+    if not role_templates:
+        return 0
+    return ports.count(ports.equal("dot1x", 1) & ~ports.where("role", lambda role: role in PORT_TEMPLATES))
+
+def reduce_conversion(delta, rendered):
+    """The sections ``delta`` can reduce against the running config, reduced
+
+    The junk removals act on objects 'authentication display new-style'
+    generates, so they can only be reduced on the device at push time.
+    """
+    return dict(rendered,
+                legacy_dot1x_removal=delta.interface_removals(rendered["legacy_dot1x_removal"],
+                                                              target=rendered["new_interface_config"]),
+                new_global_config=delta.global_additions(rendered["new_global_config"]),
+                new_interface_config=delta.interface_additions(rendered["new_interface_config"]))
+
+def conversion_bundle(alias, rendered, sections, objects=None, weights=None):
+    """One device's conversion as an ordered bundle, as the job pushes it
+
+    ``sections`` are what gets pushed of ``rendered``: reduced by
+    ``reduce_conversion`` or the templates in full. With ``objects``, a
+    function of the device returning a ``DeltaRenderer`` over the objects
+    left after 'authentication display new-style', the junk removals are
+    reduced against it at push time; without it they are pushed in full.
+    ``weights`` are the sessions each port's new config restarts. The
+    removals and the global config are critical: the ports are not given
+    their new config when any of them is rejected.
+    """
+    bundle = ConfigBundle(alias)
+
+    # 2. Wipe Dot1x configs from all ports
+    bundle.add("legacy_dot1x_removal", sections["legacy_dot1x_removal"], critical=True)
+
+    # 3. Convert Dot1x to new-style
+    bundle.add_exec("new_style", "authentication display new-style")
+
+    # 4. Remove all default policy-maps and service templates
+    if objects is not None:
+        # Against the full target: a converted port's reduced config no longer has its policy line
+        bundle.add_deferred("junk_interface_removal", lambda device: objects(device).interface_removals(
+            rendered["junk_interface_removal"], target=rendered["new_interface_config"]), critical=True)
+        bundle.add_deferred("junk_removal", lambda device: objects(device).global_removals(rendered["junk_removal"]),
+                            critical=True)
+    else:
+        bundle.add("junk_interface_removal", sections["junk_interface_removal"], critical=True)
+        bundle.add("junk_removal", sections["junk_removal"], critical=True)
+    bundle.add("new_global_config", sections["new_global_config"], critical=True)
+
+    # 5. Add per-interface new config
+    # Its endpoints re-authenticate as each port gets it: weighed for the session rate limit
+    bundle.add("new_interface_config", sections["new_interface_config"], weights=weights)
+    return bundle
+
+# ----------------
+# Per-device conversion
+# ----------------
+class DeviceConversion:
+    """Backup, capture, convert and verify a single device
+
+    All state lives on the instance so several devices can be converted at
+    the same time without sharing anything but the run timestamp. Each
+    completed stage is written to the journal; with ``resume`` a device
+    picks up after the last stage an earlier run completed, keeping that
+    run's backup and pre-change captures as its baseline.
+    """
+    def __init__(self, device, timestr, push_mode="session", file_server=None, delta_render=True, metrics=None,
+                 store=None, verify="targeted", per_interface_share=0.1, renderer=None,
+                 facts_cache=None, journal=None, resume=True, stop_after=None, session_limiter=None,
+                 convergence_timeout=300, parser=None, role_templates=False):
+        if verify not in ("targeted", "full"):
+            raise ValueError("Unknown verify mode %r, expected 'targeted' or 'full'" % verify)
+        self.device = device
+        self.timestr = timestr
+        self.metrics = metrics or StageMetrics()
+        self.store = store or JsonFileStore(timestr)
+        self.renderer = renderer or default_renderer
+        self.facts_cache = facts_cache or FactsCache()
+        self.delta_render = delta_render
+        self.push_mode = push_mode
+        self.file_server = file_server
+        self.verify = verify
+        self.per_interface_share = per_interface_share
+        self.journal = journal or ConversionJournal()
+        self.resume = resume
+        self.stop_after = stop_after
+        self.session_limiter = session_limiter
+        self.convergence_timeout = convergence_timeout
+        self.parser = parser
+        self.role_templates = role_templates
+        self.artifacts = []
+        self.pre_running_config = None
+        self.post_running_config = None
+        self.diff_counts = {}
+        self.facts = {}
+        self.endpoints = 0
+        self.endpoint_weights = {}
+        self.sessions = 0
+        self.ports = None
+        self.convergence = None
+
+    # ---------------------------------------
+    # Helpers
+    # ---------------------------------------
+    def _stage(self, stage, **fields):
+        return self.metrics.stage(self.device.alias, stage, **fields)
+
+    def _render(self, template_name, **data):
+        with self._stage("render %s" % template_name) as record:
+            rendered, record["cached"] = self.renderer.render_cached(template_name, **data)
+            record["lines"] = rendered.count("\n")
+            return rendered
+
+    def _store_json(self, steps, step_name, folder, filename, data):
+        with steps.start(step_name, continue_=True), self._stage(step_name) as record:
+            if isinstance(data, MacTable):
+                # Compact in memory, Genie's layout on disk like every other capture
+                data = data.to_parsed()
+            record["artifact"] = self.store.put(folder, filename, data, device=self.device.alias)
+            self.artifacts.append("%s/%s" % (folder, filename))
+            # A capture that failed is no baseline: without a reference it is taken again on resume
+            return record["artifact"] if data is not None else None
+
+    def _store_diff(self, steps, step_name, label, pre, post):
+        with steps.start(step_name, continue_=True), self._stage("diff %s" % label) as record:
+            filename = '%s_C3PL_Conversion_%s.txt_%s' % (self.device.alias, label, self.timestr)
+            if isinstance(pre, MacTable) or isinstance(post, MacTable):
+                # Both tables are sorted: one merge pass, nothing built per entry
+                state_diff = MacTableDiff(pre, post)
+            else:
+                state_diff = StateDiff(pre, post)
+
+            # Changed paths go to the changelog as they are found
+            with self.store.writer('changelog', filename, device=self.device.alias) as f:
+                state_diff.write(f)
+            record.update(state_diff.counts)
+            self.diff_counts[label] = dict(state_diff.counts)
+            log.info("%s %s: %d added, %d removed, %d modified", self.device.alias, label,
+                     state_diff.counts["added"], state_diff.counts["removed"], state_diff.counts["modified"])
+            self.artifacts.append("changelog/%s" % filename)
+
+    def _load(self, refs):
+        """State stored by an earlier run, from its references"""
+        state = {command: self.store.get(ref) for command, ref in refs.items()}
+        if state.get(MAC_COMMAND) is not None:
+            state[MAC_COMMAND] = MacTable.from_stored(state[MAC_COMMAND])
+        return state
+
+    # ---------------------------------------
+    # Stages
+    # ---------------------------------------
+    def run(self, steps):
+        device = self.device
+        alias = device.alias
+        timestr = self.timestr
+
+        completed = self.journal.completed(alias) if self.resume else {}
+        if "diff" in completed:
+            with steps.start("Resume from the conversion journal", continue_=True) as step:
+                step.skipped("Converted by run %s" % completed["diff"]["run"])
+            return self.artifacts
+        if completed:
+            log.info("%s: resuming after stage '%s' of run %s", alias, self.journal.last_stage(alias),
+                     completed[self.journal.last_stage(alias)]["run"])
+        elif self.journal.completed(alias):
+            # Starting over: the earlier run's stages no longer apply
+            self.journal.reset(alias, timestr)
+
+        # ---------------------------------------
+        # 0. Take Backup
+        # ---------------------------------------
+        # One 'show running-config' feeds the backup file, the structured
+        # config used for the diff and any later template decisions
+        if "backup" in completed:
+            backup_config_filename = completed["backup"]["data"]["path"]
+            with open(backup_config_filename) as fid:
+                self.pre_running_config = RunningConfig(fid.read())
+        else:
+            self.pre_running_config = ParseRunningConfigFunction.parse_running_config(
+                steps, device, "pre-change", self.metrics, self.parser)
+            if self.pre_running_config is None:
+                raise RuntimeError("Could not capture the running config of %s, not converting it" % alias)
+
+            backup_config_filename = "backup_configs/%s_Backup_%s.cfg" % (alias, timestr)
+
+            with self._stage("backup") as record, open(backup_config_filename, "w") as fid:
+                fid.write(self.pre_running_config.raw)
+                record["bytes_written"] = len(self.pre_running_config.raw)
+            self.artifacts.append(backup_config_filename)
+            self.journal.record(alias, "backup", timestr, path=backup_config_filename)
+
+        # ---------------------------------------
+        # 1. Pre-Change State
+        # ---------------------------------------
+        if "pre_capture" in completed:
+            refs = completed["pre_capture"]["data"]["refs"]
+            pre_state = self._load(refs)
+        else:
+            pre_state = self._pre_capture(steps)
+        pre_state["config"] = self.pre_running_config.tree
+        # Without them the ports cannot be classified: the removals would go out with nothing in their place
+        for command in REQUIRED_CAPTURES:
+            if pre_state.get(command) is None:
+                raise RuntimeError("Could not capture '%s' on %s, not converting it" % (command, alias))
+
+        # One row per port, joining every capture, used by the stages below
+        with self._stage("port table") as record:
+            self.ports = PortTable.from_captures(pre_state["show interfaces status"], pre_state["show dot1x all details"],
+                                                 pre_state["show authentication sessions"],
+                                                 pre_state["show mac address-table"], device=alias)
+            record.update(ports=len(self.ports), roles=self.ports.role_counts())
+
+        # Endpoints that re-authenticate once converted, and the sessions expected back
+        self.endpoint_weights = self.ports.endpoint_weights()
+        self.endpoints = sum(self.endpoint_weights.values())
+        self.sessions = sum(self.ports.numbers["authorized"])
+        if self.stop_after == "pre_capture":
+            return self.artifacts
+
+        # ---------------------------------------
+        # 2. - 5. Convert, unless an earlier run already saved the result
+        # ---------------------------------------
+        if "wr_mem" not in completed:
+            self._convert(steps, pre_state, completed)
+
+        # ---------------------------------------
+        # Wait for the endpoints to authorize again before re-capturing
+        # ---------------------------------------
+        if "convergence" not in completed and self.convergence_timeout:
+            self._converge(steps, pre_state)
+
+        # ---------------------------------------
+        # Re-capture state and compare it with the pre-change state
+        # ---------------------------------------
+        scope = None
+        if self.verify == "targeted":
+            # Everything this run and earlier runs pushed
+            scope = VerificationScope()
+            for stage in PUSH_STAGES:
+                data = self.journal.data(alias, stage)
+                if data:
+                    scope.update(VerificationScope(data["interfaces"], data["objects"]))
+
+        if "post_capture" in completed:
+            refs = completed["post_capture"]["data"]["refs"]
+            post_state = self._load(refs)
+        else:
+            post_state = self._post_capture(steps, scope)
+        self._diff(steps, pre_state, post_state, scope)
+        self.journal.record(alias, "diff", timestr, counts=self.diff_counts)
+
+        return self.artifacts
+
+    def _pre_capture(self, steps):
+        """Capture and store the pre-change state"""
+        device = self.device
+        alias = device.alias
+        timestr = self.timestr
+        pre_state = {}
+
+        # ---------------------------------------
+        # Running config tree, parsed locally from the backup capture
+        # ---------------------------------------
+        refs = {"config": self._store_json(steps, 'Store Original Golden Image', "pre_configs",
+                                           "%s_Pre_Running_Config_%s.json" % (alias, timestr),
+                                           self.pre_running_config.tree)}
+
+        # ---------------------------------------
+        # MAC address table, Dot1x interfaces, Authentication sessions and
+        # 'show int status' to capture all interfaces on switch
+        # ---------------------------------------
+        # Each output is parsed while the next command is collected
+        pre_state = ParseShowCommandFunction.parse_show_commands(
+            steps, device, [command for command, _, _ in PRE_CAPTURES], self.metrics, self.parser)
+        for command, label, store_step in PRE_CAPTURES:
+            refs[command] = self._store_json(steps, store_step, "pre_configs",
+                                             "%s_Pre_%s_%s.json" % (alias, label, timestr), pre_state[command])
+
+        # A capture that could not be stored has to be taken again on resume
+        if all(ref is not None for ref in refs.values()):
+            refs.pop("config")
+            self.journal.record(alias, "pre_capture", timestr, refs=refs)
+        return pre_state
+
+    def _convert(self, steps, pre_state, completed):
+        """Render, push and save the conversion, skipping sections already pushed"""
+        device = self.device
+        alias = device.alias
+        timestr = self.timestr
+        ports = self.ports
+
+        #----------------------------------------
+        # Keep only Access interfaces
+        #----------------------------------------
+        access = ports.select(role="access")
+        access_interface_array = ports.interfaces(access)
+
+        log.info("%s access interfaces: %s", alias, access_interface_array)
+
+        # ---------------------------------------
+        # Capture Data VLAN ID
+        # ---------------------------------------
+        # From the facts cache, or the running config already captured
+        self.facts = self.facts_cache.facts(device, self.pre_running_config, self.metrics)
+        data_vlan = self.facts["data_vlan"]
+        if data_vlan is None:
+            raise RuntimeError("No VLAN named %s on %s, not converting it" % (DATA_VLAN_NAME, alias))
+
+        # ---------------------------------------
+        # Render the templates
+        # ---------------------------------------
+        rendered = render_conversion(self._render, ports, data_vlan, self.role_templates)
+        skipped = untemplated_ports(ports, self.role_templates)
+        if skipped:
+            log.warning("%s: %d 802.1X port(s) have no template for their role, left as is", alias, skipped)
+
+        # ---------------------------------------
+        # Reduce them to what actually changes on this device
+        # ---------------------------------------
+        # A resumed device may be partly converted: compare with what is on it now
+        running_config = self.pre_running_config
+        if "backup" in completed and self.delta_render:
+            running_config = ParseRunningConfigFunction.parse_running_config(
+                steps, device, "current", self.metrics, self.parser)
+            if running_config is None:
+                raise RuntimeError("Could not capture the current running config of %s, not resuming it" % alias)
+        delta = DeltaRenderer(running_config)
+        converted = {}
+
+        def converted_objects(device):
+            # Objects generated by the new-style conversion, captured once
+            if "renderer" not in converted:
+                with self._stage("capture converted objects"):
+                    converted["renderer"] = DeltaRenderer.from_device(device)
+            return converted["renderer"]
+
+        sections = rendered
+        if self.delta_render:
+            with self._stage("delta render"):
+                sections = reduce_conversion(delta, rendered)
+
+        # ---------------------------------------
+        # Build the whole change as one ordered bundle
+        # ---------------------------------------
+        legacy_removal_filename = "templates/%s_%s_legacy_removal.txt" % (alias, timestr)
+        with open(legacy_removal_filename, "w") as fid:
+            fid.write(sections["legacy_dot1x_removal"])
+        self.artifacts.append(legacy_removal_filename)
+        bundle = conversion_bundle(alias, rendered, sections, objects=converted_objects if self.delta_render else None,
+                                   weights=self.endpoint_weights)
+
+        # ---------------------------------------
+        # Push the bundle and report each section on its own
+        # ---------------------------------------
+        def checkpoint(sections, push_result):
+            # Journal each section, and what it touched, once it is on the device; a rejected one is pushed again
+            for section in sections:
+                if push_result.sections[section.name].errors:
+                    continue
+                section_scope = VerificationScope.from_lines(None if section.exec_command else section.lines)
+                self.journal.record(alias, section.name, timestr, lines=len(section.lines),
+                                    interfaces=sorted(section_scope.interfaces), objects=sorted(section_scope.objects))
+
+        done = [stage for stage in PUSH_STAGES if stage in completed]
+        # The whole push as one stage; each section gets its own record below
+        with self._stage("push", push_mode=self.push_mode):
+            push_result = ConfigPush(mode=self.push_mode, file_server=self.file_server).apply(
+                device, bundle, timestr, done=done, checkpoint=checkpoint, limiter=self.session_limiter)
+        if self.delta_render:
+            renderers = [delta] + ([converted["renderer"]] if converted.get("renderer") else [])
+            log.info("%s: pushing %d of %d rendered lines", alias,
+                     sum(renderer.delta_lines for renderer in renderers),
+                     sum(renderer.rendered_lines for renderer in renderers))
+
+        for section in bundle.sections:
+            section_result = push_result.sections[section.name]
+            self.metrics.add({
+                "device": device.alias, "stage": "configure %s" % section.name,
+                "result": section_result.result, "duration": round(section_result.duration, 4),
+                "cpu": round(section_result.cpu, 4),
+                "lines_pushed": section_result.lines,
+                "bytes_sent": sum(len(line) + 1 for line in section.lines or ()),
+                "errors": len(section_result.errors), "push_mode": push_result.mode,
+            })
+            with steps.start(SECTION_STEPS[section.name], continue_=True) as step:
+                if section_result.errors:
+                    step.failed('Device rejected {n} line(s)\n{e}'.format(
+                        n=len(section_result.errors), e="\n".join(section_result.errors)))
+                if section_result.held:
+                    step.skipped('Not pushed: the device rejected {s}'.format(s=", ".join(push_result.stopped_by)))
+                if section_result.resumed:
+                    step.skipped('Applied by run %s' % completed[section.name]["run"])
+                if not section_result.lines:
+                    step.skipped('Already at the target state')
+
+        # Like a failed configure call, rejected lines stop the device before anything is saved
+        rejected = [section.name for section in bundle.sections if push_result.sections[section.name].errors]
+        if rejected:
+            raise RuntimeError("%s rejected lines of %s, not saving its config" % (alias, ", ".join(rejected)))
+
+        # ---------------------------------------
+        # Write mem once complete
+        # ---------------------------------------
+        with self._stage("wr mem"):
+            device.execute("wr mem")
+        self.journal.record(alias, "wr_mem", timestr)
+
+    # ---------------------------------------
+    # Post-change verification
+    # ---------------------------------------
+    def _converge(self, steps, pre_state):
+        """Time how long the endpoints of the converted ports take to be authorized again"""
+        alias = self.device.alias
+        expected = expected_clients(pre_state["show dot1x all details"], pre_state["show authentication sessions"],
+                                    pre_state["show mac address-table"])
+        # Latencies count from when this run pushed the interface config
+        pushed = self.journal.completed(alias).get("new_interface_config")
+        origin = pushed["time"] if pushed and pushed["run"] == self.timestr else None
+
+        report = None
+        with steps.start('Waiting for authentication sessions to converge', continue_=True) as step:
+            with self._stage("convergence") as record:
+                watcher = ConvergenceWatcher(self.device, expected, timeout=self.convergence_timeout,
+                                             per_interface_limit=int(self.per_interface_share * len(self.ports)))
+                report = watcher.watch(origin)
+                self.convergence = report.summary()
+                record.update(self.convergence)
+            log.info("%s: %d of %d endpoint(s) authorized again, device latency %s", alias,
+                     self.convergence["endpoints_converged"], self.convergence["endpoints"],
+                     self.convergence["device_latency"])
+            if not report.converged:
+                step.failed('{n} endpoint(s) on {p} port(s) not authorized again after {t}s'.format(
+                    n=sum(len(macs) for macs in report.pending.values()), p=len(report.pending),
+                    t=self.convergence_timeout))
+        if report is None:
+            return
+
+        ref = self._store_json(steps, 'Store Convergence Report', "post_configs",
+                               "%s_Convergence_%s.json" % (alias, self.timestr), report.to_dict())
+        self.journal.record(alias, "convergence", self.timestr, ref=ref, converged=report.converged,
+                            device_latency=self.convergence["device_latency"])
+
+    def _post_capture(self, steps, scope=None):
+        """Re-capture and store the post-change state
+
+        The whole device with no ``scope``; otherwise only the touched
+        interfaces and objects.
+        """
+        device = self.device
+        alias = device.alias
+        post_state = {}
+        if scope is None:
+            self.post_running_config = ParseRunningConfigFunction.parse_running_config(
+                steps, device, "post-change", self.metrics, self.parser)
+            post_state["config"] = self.post_running_config.tree if self.post_running_config is not None else None
+        else:
+            log.info("%s: verifying %d interface(s) and %d global object(s)", alias,
+                     len(scope.interfaces), len(scope.objects))
+            verification = PostVerification(device, scope, self.metrics, total_interfaces=len(self.ports),
+                                            per_interface_share=self.per_interface_share, parser=self.parser)
+            post_state["config"] = verification.running_config(steps)
+
+        refs = {"config": None}
+        if post_state["config"] is not None:
+            refs["config"] = self._store_json(steps, 'Store Post Running Config', "post_configs",
+                                              "%s_Post_Running_Config_%s.json" % (alias, self.timestr),
+                                              post_state["config"])
+
+        if scope is None:
+            post_state.update(ParseShowCommandFunction.parse_show_commands(
+                steps, device, [command for command, _, _, _ in POST_CAPTURES], self.metrics, self.parser))
+        for command, label, store_step, diff_step in POST_CAPTURES:
+            if scope is not None:
+                post_state[command] = verification.capture(steps, command)
+            refs[command] = self._store_json(steps, store_step, "post_configs",
+                                             "%s_Post_%s_%s.json" % (alias, label, self.timestr), post_state[command])
+
+        if all(ref is not None for ref in refs.values()):
+            self.journal.record(alias, "post_capture", self.timestr, refs=refs)
+        return post_state
+
+    def _diff(self, steps, pre_state, post_state, scope=None):
+        """Changelog of every capture, against the same slice of the pre-change state"""
+        pre_config = pre_state["config"] if scope is None else scope.slice_config(pre_state["config"])
+        self._store_diff(steps, 'Show Running Config Differential', "Running_Config", pre_config, post_state["config"])
+
+        for command, label, store_step, diff_step in POST_CAPTURES:
+            pre = pre_state[command] if scope is None else scope.slice(command, pre_state[command])
+            self._store_diff(steps, diff_step, label, pre, post_state[command])
@@ -0,0 +1,137 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from running_config import canonical_interface
+
+log = logging.getLogger(__name__)
+
+DATA_VLAN_NAME = "data_vlan"
+# Bumped when the facts gathered change shape, so older cache files are ignored
+FACTS_VERSION = 1
+
+# Lines that change without the configuration changing
+VOLATILE_LINE = re.compile(r"^(Building configuration|Current configuration\s*:|! Last configuration change|"
+                           r"! NVRAM config last updated|ntp clock-period)")
+VLAN_LINE = re.compile(r"^vlan (\d+)$")
+PROVISION_LINE = re.compile(r"^switch (\d+) provision (\S+)$")
+VLAN_BRIEF_LINE = re.compile(r"^(\d+)\s+(\S+)\s")
+
+# ----------------
+# Discovery
+# ----------------
+def config_fingerprint(raw):
+    """Hash of the running config, ignoring the lines that change on their own"""
+    digest = hashlib.sha256()
+    for line in raw.splitlines():
+        if not VOLATILE_LINE.match(line):
+            digest.update(line.encode() + b"\n")
+    return digest.hexdigest()
+
+def vlan_names(output):
+    """VLAN names by ID from 'show vlan brief'"""
+    names = {}
+    for line in output.splitlines():
+        found = VLAN_BRIEF_LINE.match(line)
+        if found:
+            names[found.group(1)] = found.group(2)
+    return names
+
+def discover_facts(device, running_config):
+    """Facts about a device, from its running config and at most one command
+
+    VLANs are in the running config in VTP transparent or off mode; only
+    when the data VLAN is not found there is 'show vlan brief' run. With
+    no ``device`` (offline) the running config is all there is.
+    """
+    tree = running_config.tree
+    vlans = {}
+    members = {}
+    access_ports = []
+    for line, children in tree.items():
+        vlan = VLAN_LINE.match(line)
+        if vlan:
+            vlans[vlan.group(1)] = next((child[5:] for child in children if child.startswith("name ")), None)
+            continue
+        provision = PROVISION_LINE.match(line)
+        if provision:
+            members[provision.group(1)] = provision.group(2)
+        elif line.startswith("interface ") and "switchport mode access" in children:
+            access_ports.append(canonical_interface(line.split(None, 1)[1]))
+
+    source = "running-config"
+    if DATA_VLAN_NAME not in vlans.values() and device is not None:
+        source = "show vlan brief"
+        vlans.update(vlan_names(device.execute("show vlan brief")))
+
+    return {
+        "data_vlan": next((vlan for vlan, name in vlans.items() if name == DATA_VLAN_NAME), None),
+        "platform": members[min(members, key=int)] if members else getattr(device, "platform", None),
+        "stack_members": sorted(members, key=int),
+        "access_ports": access_ports,
+        "vlan_source": source,
+    }
+
+# ----------------
+# Facts cache
+# ----------------
+class FactsCache:
+    """Per-device facts kept on disk between runs
+
+    An entry is used while it is younger than ``ttl`` seconds and the
+    running config still has the fingerprint it was gathered from; any
+    config change makes the facts be discovered again. A ``ttl`` of 0 turns
+    the cache off.
+    """
+    def __init__(self, root="facts_cache", ttl=86400):
+        self.root = root
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _path(self, alias):
+        return os.path.join(self.root, "%s.json" % alias)
+
+    def get(self, alias, fingerprint):
+        if not self.ttl:
+            return None
+        try:
+            with open(self._path(alias)) as fid:
+                entry = json.load(fid)
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != FACTS_VERSION or entry.get("fingerprint") != fingerprint:
+            return None
+        if time.time() - entry.get("collected", 0) > self.ttl:
+            return None
+        return entry["facts"]
+
+    def put(self, alias, fingerprint, facts):
+        if not self.ttl:
+            return
+        entry = {"version": FACTS_VERSION, "fingerprint": fingerprint, "collected": time.time(), "facts": facts}
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self._path(alias), "w") as fid:
+                json.dump(entry, fid, indent=4, sort_keys=True)
+
+    def facts(self, device, running_config, metrics):
+        """Cached facts for ``device`` if still valid, otherwise discover and keep them"""
+        with metrics.stage(device.alias, "facts") as record:
+            fingerprint = config_fingerprint(running_config.raw)
+            facts = self.get(device.alias, fingerprint)
+            record["cached"] = facts is not None
+            if facts is None:
+                facts = discover_facts(device, running_config)
+                self.put(device.alias, fingerprint, facts)
+            return facts
@@ -0,0 +1,345 @@
+'''
+Offline dry run of the conversion: render and check every device's bundle
+from the saved backups, without connecting to anything.
+
+$ python fleet_compiler.py
+
+For each device the latest backup in backup_configs/ is read, with its
+saved pre-change captures from pre_configs/ when there are any (otherwise
+the ports are classified from the running config alone). The conversion
+bundle is rendered from the same templates and the same rules as the job
+and written to compiled/<timestamp>/, with the diff between the backup and
+the config the bundle leads to. Devices are compiled in a process pool.
+
+Only some devices, rendering the full templates:
+
+$ python fleet_compiler.py --devices sw0001 sw0002 --full-render
+
+The exit code is 1 when any device has an error, so a dry run can gate a
+change window. Neither pyATS nor Genie is imported.
+
+'''
+
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from functools import lru_cache
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from delta_render import DeltaRenderer, interface_blocks, matches
+from device_conversion import PRE_CAPTURES, conversion_bundle, reduce_conversion, render_conversion, untemplated_ports
+from device_conversion import template_dir
+from device_facts import FactsCache, config_fingerprint, discover_facts
+from mac_table import MAC_COMMAND, MacTable
+from port_table import PortTable
+from running_config import RunningConfig, canonical_interface, config_tree
+from state_diff import StateDiff
+from template_render import TemplateRenderer
+
+BACKUP_FILE = re.compile(r"^(?P<alias>.+)_Backup_(?P<run>.+)\.cfg$")
+# Interfaces 'show interfaces status' lists
+PORT_INTERFACE = re.compile(r"^(\D+\d+/\S+|Port-channel\d+)$")
+DOT1X_LINES = ("dot1x pae authenticator", "authentication port-control ", "access-session port-control ")
+# Sections whose text is a config tree rather than interface blocks
+GLOBAL_BLOCKS = ("new_global_config",)
+UNRENDERED = re.compile(r"\{\{|\{%|\bNone\b")
+
+# ----------------
+# Saved state
+# ----------------
+def saved_devices(backup_dir="backup_configs", capture_dir="pre_configs", devices=None):
+    """Latest backup of each device and the pre-change captures saved with it: alias -> task"""
+    backups = {}
+    for filename in sorted(os.listdir(backup_dir)) if os.path.isdir(backup_dir) else ():
+        found = BACKUP_FILE.match(filename)
+        if found and (devices is None or found.group("alias") in devices):
+            alias = found.group("alias")
+            if alias not in backups or found.group("run") > backups[alias][0]:
+                backups[alias] = (found.group("run"), os.path.join(backup_dir, filename))
+
+    captures = os.listdir(capture_dir) if os.path.isdir(capture_dir) else ()
+    tasks = {}
+    for alias, (run, backup) in backups.items():
+        saved = {}
+        for command, label, _ in PRE_CAPTURES:
+            prefix = "%s_Pre_%s_" % (alias, label)
+            runs = sorted(filename[len(prefix):-len(".json")] for filename in captures
+                          if filename.startswith(prefix) and filename.endswith(".json"))
+            if runs:
+                # The backup's own run, else the latest
+                saved[command] = os.path.join(capture_dir, "%s%s.json" % (prefix, run if run in runs else runs[-1]))
+        tasks[alias] = {"alias": alias, "run": run, "backup": backup, "captures": saved}
+    return tasks
+
+def config_captures(running_config):
+    """'show interfaces status' and 'show dot1x all details' as far as the running config tells them"""
+    status = {}
+    dot1x = {}
+    for name, lines in running_config.interfaces.items():
+        if not PORT_INTERFACE.match(name):
+            continue
+        if "no switchport" in lines:
+            vlan = "routed"
+        elif "switchport mode trunk" in lines:
+            vlan = "trunk"
+        else:
+            vlan = next((line.split()[-1] for line in lines if line.startswith("switchport access vlan ")), "1")
+        status[name] = {"vlan": vlan}
+        if any(line.startswith(DOT1X_LINES) for line in lines):
+            dot1x[name] = {"interface": name}
+    return {"show interfaces status": {"interfaces": status}, "show dot1x all details": {"interfaces": dot1x}}
+
+def load_captures(running_config, paths):
+    """Saved pre-change captures, completed from the running config where one is missing"""
+    captures = config_captures(running_config)
+    captures.update({"show authentication sessions": {}, MAC_COMMAND: None})
+    for command, path in paths.items():
+        with open(path) as fid:
+            captures[command] = json.load(fid)
+    if captures[MAC_COMMAND] is not None:
+        captures[MAC_COMMAND] = MacTable.from_stored(captures[MAC_COMMAND])
+    return captures
+
+# ----------------
+# Target state
+# ----------------
+@lru_cache(maxsize=64)
+def blocks(text):
+    """``interface_blocks`` of a rendered text; devices with the same layout share the text"""
+    return tuple((interface, tuple(lines)) for interface, lines in interface_blocks(text))
+
+def apply_lines(node, lines):
+    """Lines of an interface once ``lines`` are applied to it"""
+    for line in lines:
+        if line.startswith("no "):
+            for configured in [configured for configured in node if matches(line[3:], configured)]:
+                del node[configured]
+        else:
+            node.setdefault(line, {})
+    return tuple(node)
+
+def target_config(tree, sections):
+    """The config tree once ``sections`` (name, rendered text) are applied
+
+    ``no`` lines remove what they match, other lines are added under their
+    interface or at the top; global blocks replace the block of the same
+    name. Objects 'authentication display new-style' generates on the
+    device are not modelled.
+    """
+    # Interface blocks are replaced rather than changed, so the backup's tree is left as it is
+    target = dict(tree)
+    interfaces = {canonical_interface(line.split(None, 1)[1]): line for line in target if line.startswith("interface ")}
+    # Global lines in order, so a removal only looks at the lines starting like it
+    global_lines = sorted(target)
+    port_results = {}
+    for name, text in sections:
+        if name in GLOBAL_BLOCKS:
+            for line, children in config_tree(text).items():
+                if line not in target:
+                    insort(global_lines, line)
+                target[line] = children
+            continue
+        for interface, lines in blocks(text):
+            if interface is not None:
+                # Ports configured alike end up alike: each distinct port is worked out once
+                key = interfaces.setdefault(interface, "interface %s" % interface)
+                node = target.setdefault(key, {})
+                applied = (tuple(node), lines)
+                if applied not in port_results:
+                    port_results[applied] = apply_lines(dict(node), lines)
+                target[key] = {line: node.get(line, {}) for line in port_results[applied]}
+                continue
+            for line in lines:
+                if not line.startswith("no "):
+                    if line not in target:
+                        insort(global_lines, line)
+                    target.setdefault(line, {})
+                else:
+                    command = line[3:]
+                    stem, _, value = command.rpartition(" ")
+                    prefix = stem if stem and value.isdigit() else command
+                    start = bisect_left(global_lines, prefix)
+                    end = start
+                    while end < len(global_lines) and global_lines[end].startswith(prefix):
+                        end += 1
+                    for configured in [configured for configured in global_lines[start:end]
+                                       if matches(command, configured)]:
+                        del target[configured]
+                        global_lines.remove(configured)
+    return target
+
+# ----------------
+# Compiling one device
+# ----------------
+# One renderer per worker process
+_renderer = None
+
+def renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = TemplateRenderer(template_dir)
+    return _renderer
+
+def check(running_config, ports, facts, rendered, bundle, role_templates=False):
+    """Problems with a compiled bundle: (level, message), level 'error' or 'warning'"""
+    problems = []
+    if facts["data_vlan"] is None:
+        problems.append(("error", "No VLAN named data_vlan in the running config"))
+    if not ports.count(ports.select(role="access")):
+        problems.append(("warning", "No access ports"))
+    skipped = untemplated_ports(ports, role_templates)
+    if skipped:
+        problems.append(("warning", "%d 802.1X port(s) have no template for their role" % skipped))
+    unknown = set()
+    for name, text in rendered.items():
+        if UNRENDERED.search(text):
+            problems.append(("error", "Section %s has an unrendered value" % name))
+        if name not in GLOBAL_BLOCKS:
+            unknown.update(interface for interface, _ in blocks(text)
+                           if interface is not None and interface not in running_config.interfaces)
+    if unknown:
+        problems.append(("error", "Interface(s) not on the device: %s" % ", ".join(sorted(unknown))))
+    if not bundle.line_count:
+        problems.append(("warning", "Nothing to push: already at the target state"))
+    return problems
+
+def compile_device(task, output_dir, delta_render=True, facts_cache=None, role_templates=False):
+    """Render, check and write out one device's bundle and target diff; returns its result"""
+    started = time.perf_counter()
+    alias = task["alias"]
+    result = {"device": alias, "run": task["run"], "status": "error", "problems": []}
+    try:
+        with open(task["backup"]) as fid:
+            running_config = RunningConfig(fid.read())
+        captures = load_captures(running_config, task["captures"])
+        ports = PortTable.from_captures(captures["show interfaces status"], captures["show dot1x all details"],
+                                        captures["show authentication sessions"], captures[MAC_COMMAND],
+                                        device=alias)
+        facts = facts_cache.get(alias, config_fingerprint(running_config.raw)) if facts_cache else None
+        facts = facts or discover_facts(None, running_config)
+
+        rendered = render_conversion(renderer().render, ports, facts["data_vlan"], role_templates)
+        sections = reduce_conversion(DeltaRenderer(running_config), rendered) if delta_render else rendered
+        # Offline the objects left after new-style are the backup's: those it generates are not modelled
+        objects = DeltaRenderer(running_config)
+        bundle = conversion_bundle(alias, rendered, sections, objects=(lambda device: objects) if delta_render else None,
+                                   weights=ports.endpoint_weights())
+        texts = dict(sections)
+        for section in bundle.sections:
+            if section.render is not None:
+                texts[section.name] = "\n".join(section.resolve(None))
+
+        target = target_config(running_config.tree, [(section.name, texts[section.name])
+                                                     for section in bundle.sections if not section.exec_command])
+        state_diff = StateDiff(running_config.tree, target)
+        with open(os.path.join(output_dir, "%s_Bundle.txt" % alias), "w") as fid:
+            fid.write(bundle.text())
+        with open(os.path.join(output_dir, "%s_Target_Diff.txt" % alias), "w") as fid:
+            state_diff.write(fid)
+
+        result["problems"] = check(running_config, ports, facts, rendered, bundle, role_templates)
+        levels = {level for level, _ in result["problems"]}
+        result["status"] = "error" if "error" in levels else "warning" if levels else "ok"
+        result.update(ports=len(ports), access=ports.count(ports.select(role="access")),
+                      captures=sorted(task["captures"]), data_vlan=facts["data_vlan"],
+                      lines={section.name: len(section.lines) for section in bundle.sections
+                             if not section.exec_command},
+                      endpoints=sum(ports.endpoint_weights().values()), target_diff=dict(state_diff.counts))
+    except Exception as e:
+        result["problems"].append(("error", "Could not compile: %s" % e))
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+def _compile_task(arguments):
+    task, output_dir, delta_render, facts_dir, facts_ttl, role_templates = arguments
+    return compile_device(task, output_dir, delta_render, FactsCache(facts_dir, ttl=facts_ttl) if facts_dir else None,
+                          role_templates)
+
+# ----------------
+# Fleet
+# ----------------
+def compile_fleet(tasks, output_dir, workers=None, delta_render=True, facts_dir=None, facts_ttl=86400,
+                  role_templates=False):
+    """Compile every device of ``tasks`` in ``workers`` processes (0 for this one); results in device order"""
+    os.makedirs(output_dir, exist_ok=True)
+    arguments = [(tasks[alias], output_dir, delta_render, facts_dir, facts_ttl, role_templates)
+                 for alias in sorted(tasks)]
+    if workers == 0:
+        return [_compile_task(argument) for argument in arguments]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_compile_task, arguments, chunksize=max(1, len(arguments) // (workers * 4))))
+
+def summarize(results, seconds):
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return {
+        "devices": len(results),
+        "ok": statuses.get("ok", 0),
+        "warning": statuses.get("warning", 0),
+        "error": statuses.get("error", 0),
+        "lines": sum(sum(result.get("lines", {}).values()) for result in results),
+        "endpoints": sum(result.get("endpoints", 0) for result in results),
+        "seconds": round(seconds, 3),
+    }
+
+# ----------------
+# Command line
+# ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render and check the conversion of every saved device, offline")
+    parser.add_argument("--backups", default="backup_configs", help="folder of the running config backups")
+    parser.add_argument("--captures", default="pre_configs", help="folder of the saved pre-change captures")
+    parser.add_argument("--facts-cache", default="facts_cache", help="folder of the cached device facts")
+    parser.add_argument("--facts-ttl", type=int, default=86400,
+                        help="seconds cached facts stay valid while the config is unchanged (0 ignores the cache)")
+    parser.add_argument("--output", default="compiled", help="folder the bundles and diffs are written under")
+    parser.add_argument("--devices", nargs="+", help="only these devices (default: every saved backup)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU, 0 for none)")
+    parser.add_argument("--full-render", dest="delta_render", action="store_false",
+                        help="compile the full templates instead of only the lines that change each port")
+    parser.add_argument("--role-templates", action="store_true",
+                        help="give 802.1X ports only their role's template, leaving uplinks and trunks as is")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    output_dir = os.path.join(args.output, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    tasks = saved_devices(args.backups, args.captures, set(args.devices) if args.devices else None)
+    started = time.perf_counter()
+    results = compile_fleet(tasks, output_dir, workers=args.workers, delta_render=args.delta_render,
+                            facts_dir=args.facts_cache, facts_ttl=args.facts_ttl,
+                            role_templates=args.role_templates)
+    summary = summarize(results, time.perf_counter() - started)
+    with open(os.path.join(output_dir, "summary.json"), "w") as fid:
+        json.dump({"summary": summary, "devices": results}, fid, indent=4, sort_keys=True)
+
+    if args.json:
+        json.dump({"summary": summary, "devices": results}, sys.stdout, indent=4)
+        print()
+    else:
+        for result in results:
+            if result["status"] != "ok":
+                for level, message in result["problems"]:
+                    print("%-8s %-20s %s" % (level.upper(), result["device"], message))
+        print("  ".join("%10s" % column for column in summary))
+        print("  ".join("%10s" % value for value in summary.values()))
+        print("Bundles and target diffs in %s" % output_dir)
+
+    if summary["error"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
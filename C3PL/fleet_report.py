@@ -0,0 +1,533 @@
+'''
+Fleet-wide report over the artifacts of the conversion runs, indexed in SQLite.
+
+$ python fleet_report.py summary
+
+Each command first brings the index up to date: it reads only the
+changelogs and captures that are new or changed since the last update,
+and only the journal and metrics lines appended since. Files are read line
+by line into the index, so memory does not grow with the fleet. The job
+also updates the index as each device finishes.
+
+By device, by port, or by change:
+
+$ python fleet_report.py device sw0001
+$ python fleet_report.py port sw0001 Gi1/0/4
+$ python fleet_report.py changes --capture MAC_Table --kind removed
+
+What to look at after a run:
+
+$ python fleet_report.py unchanged
+$ python fleet_report.py lost-macs
+$ python fleet_report.py unauthorized
+$ python fleet_report.py failures
+
+'''
+
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from artifact_store import ContentAddressedStore
+from conversion_journal import STAGES
+from running_config import canonical_interface
+from state_diff import format_path, is_changelog, parse_change_line
+from wave_scheduler import AUTHENTICATED
+
+log = logging.getLogger(__name__)
+
+CHANGELOG_FILE = re.compile(r"^(?P<device>.+)_C3PL_Conversion_(?P<capture>.+?)\.txt_(?P<run>.+)$")
+CAPTURE_FILE = re.compile(r"^(?P<device>.+)_Post_Authentication_Sessions_(?P<run>.+)\.json$")
+CONVERGENCE_FILE = re.compile(r"^(?P<device>.+)_Convergence_(?P<run>.+)\.json$")
+METRICS_FILE = re.compile(r"^(?P<run>.+)_metrics\.jsonl$")
+# Path keys followed by a MAC address, in the captures that hold endpoints
+MAC_KEYS = ("mac_addresses", "client", "clients")
+# Captures whose removed MAC addresses are lost endpoints
+ENDPOINT_CAPTURES = ("MAC_Table", "Authentication_Sessions", "Dot1x")
+BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, offset INTEGER);
+CREATE TABLE IF NOT EXISTS blobs (source TEXT PRIMARY KEY, hash TEXT);
+CREATE TABLE IF NOT EXISTS devices (device TEXT PRIMARY KEY, run TEXT, last_stage TEXT, next_stage TEXT,
+                                    converged INTEGER, updated REAL);
+CREATE TABLE IF NOT EXISTS diffs (source TEXT PRIMARY KEY, device TEXT, run TEXT, capture TEXT,
+                                  added INTEGER, removed INTEGER, modified INTEGER);
+CREATE TABLE IF NOT EXISTS changes (source TEXT, device TEXT, run TEXT, capture TEXT, kind TEXT, port TEXT,
+                                    mac TEXT, path TEXT, old TEXT, new TEXT);
+CREATE TABLE IF NOT EXISTS unauthorized (source TEXT, device TEXT, run TEXT, port TEXT, mac TEXT, status TEXT);
+CREATE TABLE IF NOT EXISTS failures (source TEXT, device TEXT, run TEXT, stage TEXT, result TEXT, started REAL);
+CREATE INDEX IF NOT EXISTS diffs_device ON diffs (device, run);
+CREATE INDEX IF NOT EXISTS changes_device ON changes (device, run, capture);
+CREATE INDEX IF NOT EXISTS changes_port ON changes (port, device);
+CREATE INDEX IF NOT EXISTS changes_kind ON changes (kind, capture);
+CREATE INDEX IF NOT EXISTS changes_mac ON changes (mac);
+CREATE INDEX IF NOT EXISTS unauthorized_device ON unauthorized (device, port);
+CREATE INDEX IF NOT EXISTS failures_device ON failures (device, stage);
+"""
+
+# Rows of the latest run of each device
+LATEST = "JOIN devices USING (device) WHERE {table}.run = devices.run"
+
+def change_keys(path):
+    """Port and MAC address a changelog path is about, either possibly None"""
+    port = None
+    mac = None
+    if path and path[0].startswith("interface "):
+        port = canonical_interface(path[0].split(None, 1)[1])
+    for key, value in zip(path, path[1:]):
+        if key == "interfaces" and port is None:
+            port = canonical_interface(value)
+        elif key in MAC_KEYS and mac is None:
+            mac = value
+    return port, mac
+
+def removed_ports(old):
+    """Ports of a removed MAC table entry, from its JSON value"""
+    try:
+        return [canonical_interface(port) for port in json.loads(old).get("interfaces", {})]
+    except (ValueError, AttributeError):
+        return []
+
+# ----------------
+# Index
+# ----------------
+class FleetReport:
+    """SQLite index of the changelogs, captures, journal and metrics of a run folder
+
+    ``update`` brings it up to date: a changelog or capture is (re)read
+    only when its size or modification time changed, and the append-only
+    journal and metrics files from where the last update stopped. Every
+    query reads the latest run of each device. Changelogs without the
+    StateDiff header, such as the Genie diffs of older runs, are skipped.
+    Runs kept in a content-addressed store under ``artifacts`` are read
+    through its run indexes, each stored artifact once.
+    """
+    def __init__(self, path="reports/fleet_report.sqlite", root=".", journal="journal/C3PL_journal.jsonl",
+                 artifacts="artifacts"):
+        self.path = path
+        self.root = root
+        self.journal = os.path.join(root, journal)
+        self.artifacts = os.path.join(root, artifacts)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ---------------------------------------
+    # Updating
+    # ---------------------------------------
+    def _changed(self, path):
+        """Size, mtime and offset read so far if ``path`` changed since it was indexed, else None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.db.execute("SELECT size, mtime, offset FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return None
+        return stat.st_size, stat.st_mtime, row[2] if row is not None else 0
+
+    def _indexed(self, path, size, mtime, offset=0):
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, size, mtime, offset))
+
+    def _files(self, folder, pattern, devices):
+        folder = os.path.join(self.root, folder)
+        for filename in sorted(os.listdir(folder)) if os.path.isdir(folder) else ():
+            found = pattern.match(filename)
+            if found and (devices is None or found.group("device") in devices):
+                yield os.path.join(folder, filename), found
+
+    def update(self, devices=None):
+        """Index what changed since the last update, only for ``devices`` if given; returns the files read"""
+        read = 0
+        with self.db:
+            for path, found in self._files("changelog", CHANGELOG_FILE, devices):
+                read += self._changelog(path, found)
+            for path, found in self._files("post_configs", CAPTURE_FILE, devices):
+                read += self._sessions(path, found)
+            for path, found in self._files("post_configs", CONVERGENCE_FILE, devices):
+                read += self._convergence(path, found)
+            read += self._stored(devices)
+            read += self._journal()
+            metrics = os.path.join(self.root, "metrics")
+            for filename in sorted(os.listdir(metrics)) if os.path.isdir(metrics) else ():
+                found = METRICS_FILE.match(filename)
+                if found:
+                    read += self._metrics(os.path.join(metrics, filename), found.group("run"))
+        return read
+
+    def _device_run(self, device, run):
+        """Make ``run`` the run of ``device`` if it is not older than the one known"""
+        self.db.execute("INSERT INTO devices (device, run, updated) VALUES (?, ?, ?) "
+                        "ON CONFLICT (device) DO UPDATE SET run = excluded.run, updated = excluded.updated "
+                        "WHERE excluded.run >= devices.run OR devices.run IS NULL", (device, run, time.time()))
+
+    def _changelog(self, path, found):
+        changed = self._changed(path)
+        if changed is None:
+            return 0
+        with open(path) as fid:
+            self._index_changelog(path, found, fid)
+        self._indexed(path, *changed[:2])
+        return 1
+
+    def _index_changelog(self, source, found, lines):
+        device, capture, run = found.group("device", "capture", "run")
+        self.db.execute("DELETE FROM changes WHERE source = ?", (source,))
+        if not is_changelog(next(lines, "")):
+            # A Genie diff from an older run: nothing to index, and not read again unless it changes
+            self.db.execute("DELETE FROM diffs WHERE source = ?", (source,))
+            return
+        counts = {"added": 0, "removed": 0, "modified": 0}
+        rows = []
+        for line in lines:
+            parsed = parse_change_line(line)
+            if parsed is None:
+                continue
+            kind, keys, old, new = parsed
+            counts[kind] += 1
+            port, mac = change_keys(keys)
+            ports = [port]
+            if port is None and kind == "removed" and capture == "MAC_Table":
+                ports = removed_ports(old) or [None]
+            for port in ports:
+                rows.append((source, device, run, capture, kind, port, mac, format_path(keys), old, new))
+            if len(rows) >= BATCH:
+                self.db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                rows = []
+        self.db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.execute("INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (source, device, run, capture, counts["added"], counts["removed"], counts["modified"]))
+        self._device_run(device, run)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as fid:
+                return json.load(fid)
+        except ValueError:
+            return None
+
+    def _sessions(self, path, found):
+        changed = self._changed(path)
+        if changed is None:
+            return 0
+        self._index_sessions(path, found, self._load(path))
+        self._indexed(path, *changed[:2])
+        return 1
+
+    def _index_sessions(self, source, found, parsed):
+        """Post-change sessions that are not authorized"""
+        device, run = found.group("device", "run")
+        self.db.execute("DELETE FROM unauthorized WHERE source = ?", (source,))
+        rows = []
+        for port, values in (parsed or {}).get("interfaces", {}).items():
+            for mac, client in values.get("client", {}).items():
+                if client.get("status") not in AUTHENTICATED:
+                    rows.append((source, device, run, canonical_interface(port), mac, client.get("status")))
+        self.db.executemany("INSERT INTO unauthorized VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._device_run(device, run)
+
+    def _convergence(self, path, found):
+        changed = self._changed(path)
+        if changed is None:
+            return 0
+        self._index_convergence(path, found, self._load(path))
+        self._indexed(path, *changed[:2])
+        return 1
+
+    def _index_convergence(self, source, found, report):
+        """Endpoints that were still not authorized when the convergence wait ended"""
+        device, run = found.group("device", "run")
+        self.db.execute("DELETE FROM unauthorized WHERE source = ?", (source,))
+        pending = report.get("pending", {}) if isinstance(report, dict) else {}
+        self.db.executemany("INSERT INTO unauthorized VALUES (?, ?, ?, ?, ?, ?)",
+                            [(source, device, run, port, mac, "not back") for port, macs in pending.items()
+                             for mac in macs])
+        self._device_run(device, run)
+
+    def _stored(self, devices):
+        """Changelogs and captures of the runs kept in the content-addressed store"""
+        index = os.path.join(self.artifacts, "index")
+        if not os.path.isdir(index):
+            return 0
+        store = ContentAddressedStore(None, root=self.artifacts)
+        # Index lines are key-sorted JSON: other devices' lines are skipped unparsed
+        wanted = None if devices is None else ['"device": %s' % json.dumps(device) for device in devices]
+        read = 0
+        for filename in sorted(os.listdir(index)):
+            path = os.path.join(index, filename)
+            # A whole update reads an index once; one for some devices always reads it
+            changed = self._changed(path)
+            if changed is None and devices is None:
+                continue
+            with open(path) as fid:
+                for line in fid:
+                    if wanted is not None and not any(device in line for device in wanted):
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    read += self._stored_entry(store, entry, devices)
+            if changed is not None and devices is None:
+                self._indexed(path, *changed[:2])
+        return read
+
+    def _stored_entry(self, store, entry, devices):
+        for folder, pattern, kind in (("changelog", CHANGELOG_FILE, "text"), ("post_configs", CAPTURE_FILE, "json"),
+                                      ("post_configs", CONVERGENCE_FILE, "json")):
+            found = pattern.match(entry.get("filename", ""))
+            if entry.get("folder") == folder and entry.get("kind") == kind and found:
+                break
+        else:
+            return 0
+        if devices is not None and found.group("device") not in devices:
+            return 0
+        # Where an export of the run would write it
+        source = os.path.join(self.artifacts, folder, entry["filename"])
+        if self.db.execute("SELECT hash FROM blobs WHERE source = ?", (source,)).fetchone() == (entry["hash"],):
+            return 0
+        if pattern is CHANGELOG_FILE:
+            self._index_changelog(source, found, store.text_lines(entry["hash"]))
+        elif pattern is CAPTURE_FILE:
+            self._index_sessions(source, found, store.get(entry["hash"]))
+        else:
+            self._index_convergence(source, found, store.get(entry["hash"]))
+        self.db.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?)", (source, entry["hash"]))
+        return 1
+
+    def _tail(self, path):
+        """Lines appended to ``path`` since the last update, then remember where they end"""
+        changed = self._changed(path)
+        if changed is None:
+            return
+        size, mtime, offset = changed
+        if size < offset:
+            # Truncated or replaced: read it again
+            offset = 0
+        with open(path, "rb") as fid:
+            fid.seek(offset)
+            for line in fid:
+                if not line.endswith(b"\n"):
+                    # Still being written: picked up by the next update
+                    break
+                offset += len(line)
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        self._indexed(path, size, mtime, offset)
+
+    def _journal(self):
+        read = 0
+        last = {}
+        for entry in self._tail(self.journal):
+            read = 1
+            if entry.get("event") == "reset":
+                last[entry["device"]] = (entry["run"], None)
+            else:
+                last[entry["device"]] = (entry["run"], entry["stage"])
+        for device, (run, stage) in last.items():
+            self._device_run(device, run)
+            index = STAGES.index(stage) if stage in STAGES else -1
+            self.db.execute("UPDATE devices SET last_stage = ?, next_stage = ?, converged = ? WHERE device = ?",
+                            (stage, STAGES[index + 1] if index + 1 < len(STAGES) else None,
+                             int(stage == "diff"), device))
+        return read
+
+    def _metrics(self, path, run):
+        rows = [(path, record.get("device"), run, record.get("stage"), record.get("result"), record.get("started"))
+                for record in self._tail(path) if record.get("result") not in (None, "passed")]
+        self.db.executemany("INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return int(bool(rows))
+
+    # ---------------------------------------
+    # Queries
+    # ---------------------------------------
+    def _rows(self, query, *parameters):
+        cursor = self.db.execute(query, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def summary(self):
+        """Counts across the fleet"""
+        one = lambda query, *parameters: self.db.execute(query, parameters).fetchone()[0]
+        return {
+            "devices": one("SELECT COUNT(*) FROM devices"),
+            "converted": one("SELECT COUNT(*) FROM devices WHERE converged"),
+            "unchanged": len(self.unchanged()),
+            "stopped_before": {row["next_stage"]: row["devices"] for row in self._rows(
+                "SELECT next_stage, COUNT(*) AS devices FROM devices WHERE NOT converged AND next_stage IS NOT NULL "
+                "GROUP BY next_stage")},
+            "changes": {"%s %s" % (row["capture"], row["kind"]): row["changes"] for row in self._rows(
+                "SELECT capture, kind, COUNT(*) AS changes FROM changes " + LATEST.format(table="changes") +
+                " GROUP BY capture, kind")},
+            "lost_macs": one("SELECT COUNT(*) FROM (SELECT DISTINCT changes.device, mac FROM changes " +
+                             LATEST.format(table="changes") + " AND capture = 'MAC_Table' AND kind = 'removed')"),
+            "lost_endpoints": one("SELECT COUNT(*) FROM (SELECT DISTINCT changes.device, mac FROM changes " +
+                                  LATEST.format(table="changes") + " AND kind = 'removed' AND mac IS NOT NULL AND "
+                                  "capture IN (%s))" % ", ".join("?" * len(ENDPOINT_CAPTURES)), *ENDPOINT_CAPTURES),
+            "unauthorized_ports": one("SELECT COUNT(*) FROM (SELECT DISTINCT unauthorized.device, port "
+                                      "FROM unauthorized " + LATEST.format(table="unauthorized") + ")"),
+            "unauthorized_endpoints": one("SELECT COUNT(*) FROM (SELECT DISTINCT unauthorized.device, mac "
+                                          "FROM unauthorized " + LATEST.format(table="unauthorized") + ")"),
+            "failed_stages": {row["stage"]: row["devices"] for row in self._rows(
+                "SELECT stage, COUNT(DISTINCT failures.device) AS devices FROM failures " +
+                LATEST.format(table="failures") + " GROUP BY stage")},
+        }
+
+    def unchanged(self):
+        """Converted devices whose every changelog is empty"""
+        return [row["device"] for row in self._rows(
+            "SELECT diffs.device FROM diffs " + LATEST.format(table="diffs") + " AND converged "
+            "GROUP BY diffs.device HAVING SUM(added + removed + modified) = 0 ORDER BY diffs.device")]
+
+    def changes(self, device=None, port=None, capture=None, kind=None, mac=None, limit=None):
+        """Changes of the latest runs, narrowed by any of device, port, capture, kind and MAC address"""
+        query = ("SELECT changes.device, capture, kind, port, mac, path, old, new FROM changes " +
+                 LATEST.format(table="changes"))
+        parameters = []
+        for column, value in (("changes.device", device), ("port", port and canonical_interface(port)),
+                              ("capture", capture), ("kind", kind), ("mac", mac)):
+            if value is not None:
+                query += " AND %s = ?" % column
+                parameters.append(value)
+        query += " ORDER BY changes.device, capture, path"
+        if limit:
+            query += " LIMIT %d" % int(limit)
+        return self._rows(query, *parameters)
+
+    def lost_macs(self, device=None):
+        """MAC addresses learned before the change and gone after it"""
+        return self.changes(device=device, capture="MAC_Table", kind="removed")
+
+    def unauthorized(self, device=None):
+        """Endpoints not authorized after the change, by port, with the status of each source"""
+        query = ("SELECT unauthorized.device, port, mac, GROUP_CONCAT(DISTINCT status) AS status FROM unauthorized " +
+                 LATEST.format(table="unauthorized"))
+        parameters = []
+        if device is not None:
+            query += " AND unauthorized.device = ?"
+            parameters.append(device)
+        return self._rows(query + " GROUP BY unauthorized.device, port, mac ORDER BY unauthorized.device, port, mac",
+                          *parameters)
+
+    def failures(self, device=None):
+        """Devices that stopped before the end of the conversion, and the stages that failed"""
+        query = ("SELECT device, run, last_stage, next_stage, "
+                 "(SELECT GROUP_CONCAT(DISTINCT stage) FROM failures WHERE failures.device = devices.device "
+                 "AND failures.run = devices.run) AS failed_stages FROM devices "
+                 "WHERE (NOT converged OR converged IS NULL OR failed_stages IS NOT NULL)")
+        parameters = []
+        if device is not None:
+            query += " AND device = ?"
+            parameters.append(device)
+        return self._rows(query + " ORDER BY device", *parameters)
+
+    def device(self, device):
+        """Everything known about one device"""
+        rows = self._rows("SELECT * FROM devices WHERE device = ?", device)
+        if not rows:
+            return None
+        report = rows[0]
+        report["diffs"] = {row["capture"]: {kind: row[kind] for kind in ("added", "removed", "modified")}
+                           for row in self._rows("SELECT diffs.capture, added, removed, modified FROM diffs " +
+                                                 LATEST.format(table="diffs") + " AND diffs.device = ?", device)}
+        report["lost_macs"] = len(self.lost_macs(device))
+        report["unauthorized"] = self.unauthorized(device)
+        report["failures"] = self._rows("SELECT stage, result, started FROM failures " +
+                                        LATEST.format(table="failures") + " AND failures.device = ?", device)
+        return report
+
+# ----------------
+# Command line
+# ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fleet-wide report over the artifacts of the conversion runs")
+    parser.add_argument("--report", default="reports/fleet_report.sqlite", help="index file")
+    parser.add_argument("--root", default=".", help="folder holding changelog/, post_configs/, journal/, metrics/")
+    parser.add_argument("--journal", default="journal/C3PL_journal.jsonl", help="journal of the job, under --root")
+    parser.add_argument("--artifacts", default="artifacts",
+                        help="content-addressed store of the runs kept with --artifact-store cas, under --root")
+    parser.add_argument("--no-update", dest="update", action="store_false", help="query the index as it is")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    subparsers = parser.add_subparsers(dest="query", required=True)
+
+    update = subparsers.add_parser("update", help="index what changed since the last update")
+    update.add_argument("--follow", type=float, default=0, help="keep updating every FOLLOW seconds")
+    subparsers.add_parser("summary", help="counts across the fleet")
+    device = subparsers.add_parser("device", help="everything known about one device")
+    device.add_argument("device")
+    port = subparsers.add_parser("port", help="changes and unauthorized endpoints of one port")
+    port.add_argument("device")
+    port.add_argument("port")
+    changes = subparsers.add_parser("changes", help="changes narrowed by device, port, capture, kind or MAC")
+    for option in ("device", "port", "capture", "kind", "mac"):
+        changes.add_argument("--%s" % option)
+    changes.add_argument("--limit", type=int, default=None)
+    subparsers.add_parser("unchanged", help="converted devices with no changes")
+    for name, help_text in (("lost-macs", "MAC addresses gone after the change"),
+                            ("unauthorized", "endpoints not authorized after the change"),
+                            ("failures", "devices that stopped, and the stages that failed")):
+        query = subparsers.add_parser(name, help=help_text)
+        query.add_argument("--device")
+    args = parser.parse_args(argv)
+
+    report = FleetReport(args.report, root=args.root, journal=args.journal, artifacts=args.artifacts)
+    try:
+        if args.update or args.query == "update":
+            report.update()
+        if args.query == "update":
+            while args.follow:
+                time.sleep(args.follow)
+                read = report.update()
+                if read:
+                    log.info("Indexed %d new or changed file(s)", read)
+            result = report.summary()
+        elif args.query == "summary":
+            result = report.summary()
+        elif args.query == "device":
+            result = report.device(args.device)
+        elif args.query == "port":
+            result = {"changes": report.changes(device=args.device, port=args.port),
+                      "unauthorized": [row for row in report.unauthorized(args.device)
+                                       if row["port"] == canonical_interface(args.port)]}
+        elif args.query == "changes":
+            result = report.changes(device=args.device, port=args.port, capture=args.capture, kind=args.kind,
+                                    mac=args.mac, limit=args.limit)
+        elif args.query == "unchanged":
+            result = report.unchanged()
+        elif args.query == "lost-macs":
+            result = report.lost_macs(args.device)
+        elif args.query == "unauthorized":
+            result = report.unauthorized(args.device)
+        else:
+            result = report.failures(args.device)
+    finally:
+        report.close()
+
+    if args.json or not isinstance(result, list):
+        json.dump(result, sys.stdout, indent=4, default=str)
+        print()
+    else:
+        for row in result:
+            print(row if not isinstance(row, dict) else "  ".join(str(value) for value in row.values()))
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,63 @@
-
+from running_config import RunningConfig
+from stage_metrics import StageMetrics
+from parse_cache import ParseResult, default_parser, empty_parse
 
 class ParseShowCommandFunction:
     @staticmethod
-    def parse_show_command(steps, device, command_name: str):
-        with steps.start(f"Parsing {command_name}", continue_=True) as step:
-            try:
-                return device.parse(command_name)
-            except Exception as e:
-                step.failed('Could not parse it correctly\n{e}'.format(e=e))
-                return None
+    def parse_show_command(steps, device, command_name: str, metrics=None, parser=None):
+        return ParseShowCommandFunction.parse_show_commands(steps, device, [command_name], metrics, parser)[command_name]
 
-class ParseLearnFunction:
     @staticmethod
-    def parse_learn(steps, device, function_name: str):
-            with steps.start(f'Learning {function_name}',continue_=True) as step:
-                try:
-                    return device.learn(function_name).info
-                except Exception as e:
-                    step.failed('Could not learn it correctly\n{e}'.format(e=e))
-                    return None
+    def parse_show_commands(steps, device, command_names, metrics=None, parser=None):
+        """Collect each command, handing its output to the parser while the next one is collected"""
+        metrics = metrics or StageMetrics()
+        parser = parser or default_parser
+        pending = {}
+        for command_name in command_names:
+            try:
+                with metrics.stage(device.alias, f"collect {command_name}") as record:
+                    output = device.execute(command_name)
+                    record["bytes_received"] = len(output)
+                    pending[command_name] = parser.submit(device, command_name, output)
+            except Exception as e:
+                pending[command_name] = e
 
-class ParseConfigFunction:
-    @staticmethod
-    def parse_learn(steps, device, function_name: str):
-            with steps.start(f'Learning {function_name}',continue_=True) as step:
+        parsed = {}
+        for command_name in command_names:
+            parsed[command_name] = None
+            with steps.start(f"Parsing {command_name}", continue_=True) as step:
                 try:
-                    return device.learn(function_name)
+                    if isinstance(pending[command_name], Exception):
+                        raise pending[command_name]
+                    with metrics.stage(device.alias, f"parse {command_name}") as record:
+                        try:
+                            result = pending[command_name].result()
+                        except Exception as e:
+                            if not empty_parse(e):
+                                raise
+                            # Nothing to parse, e.g. no sessions on the device
+                            result = ParseResult({})
+                        record["cached"] = result.cached
+                        record["parse_cpu"] = round(result.cpu, 4)
+                        parsed[command_name] = result.parsed
                 except Exception as e:
-                    step.failed('Could not learn it correctly\n{e}'.format(e=e))
-                    return None
+                    step.failed('Could not parse it correctly\n{e}'.format(e=e))
+        return parsed
 
-class ParseDictFunction:
+class ParseRunningConfigFunction:
     @staticmethod
-    def parse_learn(steps, device, function_name: str):
-            with steps.start(f'Learning {function_name}',continue_=True) as step:
-                try:
-                    return device.learn(function_name).to_dict()
-                except Exception as e:
-                    step.failed('Could not learn it correctly\n{e}'.format(e=e))
-                    return None                                  
\ No newline at end of file
+    def parse_running_config(steps, device, phase: str, metrics=None, parser=None):
+        metrics = metrics or StageMetrics()
+        parser = parser or default_parser
+        with steps.start(f'Capturing {phase} running config', continue_=True) as step:
+            try:
+                with metrics.stage(device.alias, f"capture {phase} running config") as record:
+                    raw = device.execute("show running-config")
+                    record["bytes_received"] = len(raw)
+                    result = parser.submit_config(raw).result()
+                    record["cached"] = result.cached
+                    record["parse_cpu"] = round(result.cpu, 4)
+                    return RunningConfig(raw, tree=result.parsed)
+            except Exception as e:
+                step.failed('Could not capture it correctly\n{e}'.format(e=e))
+                return None
@@ -0,0 +1,306 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import re
+import time
+from array import array
+from running_config import canonical_interface
+from state_diff import Change, write_changelog
+
+MAC_COMMAND = "show mac address-table"
+# The full table and its per-interface form are parsed here rather than by Genie
+STREAMED_COMMAND = re.compile(r"^show mac address-table(?: interface \S+)?$")
+MAC_ADDRESS = re.compile(r"^[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}$")
+# Stored form of a MacTable, in place of Genie's nested dict
+STORED_FORMAT = "mac-table/1"
+
+def mac_to_int(mac):
+    return int(mac.replace(".", ""), 16)
+
+def int_to_mac(value):
+    digits = "%012x" % value
+    return "%s.%s.%s" % (digits[0:4], digits[4:8], digits[8:12])
+
+# ----------------
+# Compact table
+# ----------------
+class MacTable:
+    """MAC address table as parallel arrays, one row per (VLAN, MAC, port)
+
+    The VLAN and MAC of a row are one 64-bit key, ``vlan << 48 | mac``;
+    ports and entry types are interned and stored as small indexes. A row
+    takes 11 bytes where Genie's nested dict takes around a kilobyte. Rows
+    are kept sorted by key and port once the table is complete.
+    """
+    def __init__(self):
+        self.keys = array("Q")
+        self.ports = array("H")
+        self.types = array("B")
+        self.port_names = []
+        self.type_names = []
+        self._port_codes = {}
+        self._type_codes = {}
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _port(self, name):
+        code = self._port_codes.get(name)
+        if code is None:
+            canonical = canonical_interface(name)
+            code = self._port_codes.get(canonical)
+            if code is None:
+                code = len(self.port_names)
+                self.port_names.append(canonical)
+                self._port_codes[canonical] = code
+            self._port_codes[name] = code
+        return code
+
+    def _type(self, name):
+        code = self._type_codes.get(name)
+        if code is None:
+            code = self._type_codes[name] = len(self.type_names)
+            self.type_names.append(name)
+        return code
+
+    def add(self, vlan, mac, entry_type, port):
+        """One entry; ``vlan`` 0 is 'All', ``mac`` an int"""
+        key = vlan << 48 | mac
+        port = self._port(port)
+        if self._sorted and self.keys and (self.keys[-1], self.ports[-1]) > (key, port):
+            self._sorted = False
+        self.keys.append(key)
+        self.ports.append(port)
+        self.types.append(self._type(entry_type))
+
+    def sort(self):
+        """Order the rows by VLAN, MAC and port"""
+        if self._sorted:
+            return self
+        order = sorted(range(len(self)), key=lambda row: (self.keys[row], self.ports[row]))
+        self.keys = array("Q", (self.keys[row] for row in order))
+        self.ports = array("H", (self.ports[row] for row in order))
+        self.types = array("B", (self.types[row] for row in order))
+        self._sorted = True
+        return self
+
+    # ---------------------------------------
+    # Building
+    # ---------------------------------------
+    @classmethod
+    def from_lines(cls, lines, interfaces=None):
+        """Parse 'show mac address-table' output line by line, keeping only ``interfaces`` if given"""
+        table = cls()
+        wanted = {}
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            if fields[0] == "*":
+                fields = fields[1:]
+            vlan, mac, entry_type, port = fields[0], fields[1], fields[2], fields[-1]
+            if not (vlan.isdigit() or vlan == "All") or not MAC_ADDRESS.match(mac):
+                continue
+            if interfaces is not None:
+                if port not in wanted:
+                    wanted[port] = canonical_interface(port) in interfaces
+                if not wanted[port]:
+                    continue
+            table.add(int(vlan) if vlan != "All" else 0, mac_to_int(mac), entry_type.lower(), port)
+        return table.sort()
+
+    @classmethod
+    def from_output(cls, raw, interfaces=None):
+        return cls.from_lines((match.group(0) for match in re.finditer(r"[^\n]+", raw)), interfaces)
+
+    @classmethod
+    def from_parsed(cls, parsed, interfaces=None):
+        """From Genie's parsed structure"""
+        table = cls()
+        for vlan, interface, mac, entry_type in mac_entries(parsed):
+            if interfaces is None or canonical_interface(interface) in interfaces:
+                table.add(int(vlan) if str(vlan).isdigit() else 0, mac_to_int(mac), entry_type, interface)
+        return table.sort()
+
+    @classmethod
+    def from_stored(cls, data):
+        """From a stored Genie structure, or the columns ``to_stored`` gives"""
+        if not data or data.get("format") != STORED_FORMAT:
+            return cls.from_parsed(data)
+        table = cls()
+        table.port_names = list(data["port_names"])
+        table.type_names = list(data["type_names"])
+        table._port_codes = {name: code for code, name in enumerate(table.port_names)}
+        table._type_codes = {name: code for code, name in enumerate(table.type_names)}
+        table.keys = array("Q", data["keys"])
+        table.ports = array("H", data["ports"])
+        table.types = array("B", data["types"])
+        return table.sort()
+
+    @classmethod
+    def concat(cls, tables):
+        """One table with the rows of ``tables``, e.g. per-interface captures"""
+        combined = cls()
+        for table in tables:
+            ports = [combined._port(name) for name in table.port_names]
+            types = [combined._type(name) for name in table.type_names]
+            combined.keys.extend(table.keys)
+            combined.ports.extend(ports[port] for port in table.ports)
+            combined.types.extend(types[entry_type] for entry_type in table.types)
+            combined._sorted = False
+        return combined.sort()
+
+    def to_stored(self):
+        """Compact JSON-ready form: the columns and the interned names"""
+        return {"format": STORED_FORMAT, "port_names": self.port_names, "type_names": self.type_names,
+                "keys": self.keys.tolist(), "ports": self.ports.tolist(), "types": self.types.tolist()}
+
+    # ---------------------------------------
+    # Reading
+    # ---------------------------------------
+    def rows(self):
+        """(key, port, entry type) of every row, in order"""
+        port_names = self.port_names
+        type_names = self.type_names
+        for key, port, entry_type in zip(self.keys, self.ports, self.types):
+            yield key, port_names[port], type_names[entry_type]
+
+    def entries(self):
+        """(VLAN, interface, MAC address, entry type) of every row, like ``mac_entries``"""
+        for key, port, entry_type in self.rows():
+            vlan = key >> 48
+            yield str(vlan) if vlan else "all", port, int_to_mac(key & 0xFFFFFFFFFFFF), entry_type
+
+    def slice(self, interfaces):
+        """The rows learned on ``interfaces``"""
+        wanted = [name in interfaces for name in self.port_names]
+        table = MacTable()
+        table.port_names = list(self.port_names)
+        table.type_names = list(self.type_names)
+        table._port_codes = dict(self._port_codes)
+        table._type_codes = dict(self._type_codes)
+        for key, port, entry_type in zip(self.keys, self.ports, self.types):
+            if wanted[port]:
+                table.keys.append(key)
+                table.ports.append(port)
+                table.types.append(entry_type)
+        return table
+
+    def to_parsed(self):
+        """Genie's nested structure, the layout captures are stored in"""
+        vlans = {}
+        for vlan, interface, mac, entry_type in self.entries():
+            entry = vlans.setdefault(vlan, {"mac_addresses": {}, "vlan": int(vlan) if vlan != "all" else vlan})
+            address = entry["mac_addresses"].setdefault(mac, {"interfaces": {}, "mac_address": mac})
+            address["interfaces"][interface] = {"entry_type": entry_type, "interface": interface}
+        return {"mac_table": {"vlans": vlans}, "total_mac_addresses": len(self)}
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.keys, self.ports, self.types))
+
+def mac_entries(mac_table):
+    """(VLAN, interface, MAC address, entry type) of a MacTable or Genie's parsed MAC table"""
+    if isinstance(mac_table, MacTable):
+        yield from mac_table.entries()
+        return
+    for vlan, values in (mac_table or {}).get("mac_table", {}).get("vlans", {}).items():
+        for mac, entry in values.get("mac_addresses", {}).items():
+            for interface, details in entry.get("interfaces", {}).items():
+                yield vlan, interface, mac, details.get("entry_type", "dynamic")
+
+def stream_parser(command):
+    """Parser of ``command`` if its output is parsed into a MacTable, else None"""
+    if not STREAMED_COMMAND.match(command):
+        return None
+
+    def parse(raw):
+        started = time.thread_time()
+        return MacTable.from_output(raw), time.thread_time() - started
+    return parse
+
+# ----------------
+# Diff
+# ----------------
+class MacTableDiff:
+    """Compare two sorted MacTables in one merge pass, yielding changes as they are found
+
+    Changes have the paths StateDiff gives for Genie's structure: a MAC
+    address only on one side is added or removed whole, otherwise each of
+    its interfaces is compared. A side that is not a MacTable (a Genie
+    structure, or None for a failed capture) is converted first.
+    """
+    def __init__(self, pre, post):
+        self.pre = pre if isinstance(pre, MacTable) else MacTable.from_stored(pre)
+        self.post = post if isinstance(post, MacTable) else MacTable.from_stored(post)
+        self.counts = {"added": 0, "removed": 0, "modified": 0}
+
+    @staticmethod
+    def _grouped(table):
+        """(key, {interface: entry type}) per VLAN and MAC, in key order"""
+        key = None
+        group = {}
+        for row_key, port, entry_type in table.rows():
+            if row_key != key and key is not None:
+                yield key, group
+                group = {}
+            key = row_key
+            group[port] = entry_type
+        if key is not None:
+            yield key, group
+
+    @staticmethod
+    def _path(key, *rest):
+        vlan = key >> 48
+        mac = int_to_mac(key & 0xFFFFFFFFFFFF)
+        return ("mac_table", "vlans", str(vlan) if vlan else "all", "mac_addresses", mac) + rest
+
+    @staticmethod
+    def _entry(key, group):
+        return {"interfaces": {port: {"entry_type": entry_type, "interface": port}
+                               for port, entry_type in group.items()},
+                "mac_address": int_to_mac(key & 0xFFFFFFFFFFFF)}
+
+    def _compare(self, key, pre, post):
+        for port, entry_type in pre.items():
+            if port not in post:
+                yield Change("removed", self._path(key, "interfaces", port),
+                             old={"entry_type": entry_type, "interface": port})
+            elif post[port] != entry_type:
+                yield Change("modified", self._path(key, "interfaces", port, "entry_type"),
+                             old=entry_type, new=post[port])
+        for port, entry_type in post.items():
+            if port not in pre:
+                yield Change("added", self._path(key, "interfaces", port),
+                             new={"entry_type": entry_type, "interface": port})
+
+    def _merge(self):
+        pre = self._grouped(self.pre)
+        post = self._grouped(self.post)
+        old = next(pre, None)
+        new = next(post, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old[0] < new[0]):
+                yield Change("removed", self._path(old[0]), old=self._entry(*old))
+                old = next(pre, None)
+            elif old is None or new[0] < old[0]:
+                yield Change("added", self._path(new[0]), new=self._entry(*new))
+                new = next(post, None)
+            else:
+                yield from self._compare(old[0], old[1], new[1])
+                old = next(pre, None)
+                new = next(post, None)
+
+    def changes(self):
+        for change in self._merge():
+            self.counts[change.kind] += 1
+            yield change
+
+    def write(self, fid):
+        """Stream the changelog into ``fid``; returns the number of changes"""
+        return write_changelog(fid, self.changes())
@@ -0,0 +1,285 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import re
+import copy
+import json
+import time
+from genie.metaparser.util.exceptions import SchemaEmptyParserError
+from running_config import canonical_interface
+from post_verification import SCOPED_COMMANDS
+from mac_table import MAC_COMMAND, MacTable, STREAMED_COMMAND, mac_entries
+
+# ----------------
+# Mock device
+# ----------------
+class MockCommandFailure(Exception):
+    """Raised like unicon's SubCommandFailure when a rejected line is pushed"""
+
+class MockDevice:
+    """Local stand-in for a connected IOS-XE switch
+
+    Sleeps to model the cost of the CLI: a fixed cost per config session or
+    exec command and a cost per config line, so push strategies can be timed
+    without a live switch. Lines matching ``reject`` are answered with an IOS
+    error marker. ``connect`` takes ``connect_latency`` seconds and times out
+    the first ``connect_failures`` times.
+    """
+    def __init__(self, name, alias=None, session_latency=0.5, line_latency=0.002,
+                 exec_latency=0.1, merge_line_latency=0.0002, transfer_rate=1000000,
+                 outputs=None, reject=None, file_root=None, connect_latency=0.0, connect_failures=0):
+        self.name = name
+        self.alias = alias or name
+        self.os = "iosxe"
+        self.platform = "c9300"
+        self.session_latency = session_latency
+        self.line_latency = line_latency
+        self.exec_latency = exec_latency
+        self.merge_line_latency = merge_line_latency
+        self.transfer_rate = transfer_rate
+        self.outputs = outputs or {}
+        self.reject = [re.compile(pattern) for pattern in (reject or [])]
+        self.file_root = file_root
+        self.connect_latency = connect_latency
+        self.connect_failures = connect_failures
+        self.connected = True
+        self.connects = 0
+        self.files = {}
+        self.sessions = 0
+        self.commands = 0
+        self.lines_received = 0
+        self.applied = []
+
+    def connect(self, **kwargs):
+        time.sleep(self.connect_latency)
+        self.connects += 1
+        if self.connect_failures:
+            self.connect_failures -= 1
+            raise TimeoutError("Timed out connecting to %s" % self.name)
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def _apply(self, lines, prompt_echo=True):
+        output = []
+        mode = "config"
+        for line in lines:
+            line = line.strip()
+            if not line or line == "end":
+                continue
+            if line.startswith("interface "):
+                mode = "config-if"
+            if prompt_echo:
+                output.append("%s(%s)#%s" % (self.name, mode, line))
+            if any(pattern.search(line) for pattern in self.reject):
+                if not prompt_echo:
+                    output.append(line)
+                output.append("                 ^")
+                output.append("% Invalid input detected at '^' marker.")
+            else:
+                self.applied.append(line)
+        return output
+
+    def configure(self, command, error_pattern=None, **kwargs):
+        lines = command.splitlines() if isinstance(command, str) else list(command)
+        self.sessions += 1
+        self.lines_received += len(lines)
+        time.sleep(self.session_latency + self.line_latency * len(lines))
+        output = self._apply(lines)
+        if error_pattern is None and any(line.startswith("% Invalid") for line in output):
+            raise MockCommandFailure("\n".join(output))
+        return "\n".join(output)
+
+    def execute(self, command, **kwargs):
+        self.commands += 1
+        time.sleep(self.exec_latency)
+
+        copy = re.match(r"^copy (\S+) (\S+)$", command)
+        if copy:
+            source, destination = copy.groups()
+            if destination.startswith("flash:"):
+                filename = os.path.basename(source)
+                text = ""
+                if self.file_root and os.path.exists(os.path.join(self.file_root, filename)):
+                    with open(os.path.join(self.file_root, filename)) as fid:
+                        text = fid.read()
+                time.sleep(len(text) / float(self.transfer_rate))
+                self.files[destination] = text
+                return "%d bytes copied" % len(text)
+            if destination == "running-config":
+                lines = self.files.get(source, "").splitlines()
+                self.lines_received += len(lines)
+                time.sleep(self.merge_line_latency * len(lines))
+                output = self._apply(lines, prompt_echo=False)
+                output.append("%d bytes copied" % len(self.files.get(source, "")))
+                return "\n".join(output)
+        if command.startswith("delete "):
+            self.files.pop(command.split()[-1], None)
+            return ""
+        return self.outputs.get(command, "")
+
+# ----------------
+# Replay device
+# ----------------
+class Learned:
+    """What ``device.learn()`` returns: the learned structure on ``.info``"""
+    def __init__(self, info):
+        self.info = info
+
+# Recorded capture files, by the command that produced them
+CAPTURE_FILES = (
+    ("_Backup_", "show running-config"),
+    ("_Running_Config_", "learn config"),
+    ("_MAC_Table_", "show mac address-table"),
+    ("_Dot1x_", "show dot1x all details"),
+    ("_Authentication_Sessions_", "show authentication sessions"),
+    ("_Interfaces_Status_", "show interfaces status"),
+    ("_Interfaces_", "show interfaces status"),
+    ("_Vlan_", "learn vlan"),
+)
+
+# Per-interface commands, answered by slicing the full-device recording
+SCOPED_PARSES = tuple((re.compile("^%s$" % re.escape(template).replace(re.escape("{interface}"), r"(\S+)")),
+                       command, slicer)
+                      for command, (template, slicer) in SCOPED_COMMANDS.items() if template)
+INTERFACE_CONFIG = re.compile(r"^show running-config interface (\S+)$")
+SECTION_FILTER = re.compile(r"^show running-config \| section (.+)$")
+INCLUDE_FILTER = re.compile(r"^show running-config \| include (.+)$")
+
+def format_mac_table(parsed):
+    """What IOS prints for 'show mac address-table', from its parsed structure"""
+    lines = ["          Mac Address Table", "-------------------------------------------", "",
+             "Vlan    Mac Address       Type        Ports", "----    -----------       --------    -----"]
+    count = 0
+    for vlan, interface, mac, entry_type in mac_entries(parsed):
+        lines.append("%4s    %s    %-8s    %s" % ("All" if vlan == "all" else vlan, mac, entry_type.upper(), interface))
+        count += 1
+    lines.append("Total Mac Addresses for this criterion: %d" % count)
+    return "\n".join(lines) + "\n"
+
+def config_include(raw, pattern):
+    """What IOS prints for ``| include``: the matching lines alone"""
+    pattern = re.compile(pattern)
+    return "\n".join(line for line in raw.splitlines() if pattern.search(line)) + "\n"
+
+def config_section(raw, pattern):
+    """What IOS prints for ``| section``: matching lines and the lines indented under them"""
+    pattern = re.compile(pattern)
+    output = []
+    depth = None
+    for line in raw.splitlines():
+        indent = len(line) - len(line.lstrip())
+        if depth is not None and line.strip() and indent > depth:
+            output.append(line)
+            continue
+        depth = None
+        if pattern.search(line):
+            output.append(line)
+            depth = indent
+    return "\n".join(output) + "\n"
+
+class ReplayDevice(MockDevice):
+    """MockDevice that answers show commands from recorded outputs
+
+    ``recordings`` maps a phase (``pre``, ``post``) to ``{command: output}``,
+    where the output is raw text for ``execute`` or an already parsed
+    structure for ``parse``/``learn``. The device answers from ``pre`` until
+    ``wr mem`` is run, then from ``post`` where a post recording exists.
+    Per-interface, ``| section`` and ``| include`` commands are answered
+    from the full recording.
+    """
+    def __init__(self, name, recordings, **kwargs):
+        kwargs.setdefault("session_latency", 0.0)
+        kwargs.setdefault("line_latency", 0.0)
+        kwargs.setdefault("exec_latency", 0.0)
+        super().__init__(name, **kwargs)
+        self.recordings = recordings
+        self.phase = "pre"
+
+    def _recorded(self, command):
+        for phase in (self.phase, "pre"):
+            if command in self.recordings.get(phase, {}):
+                return self.recordings[phase][command]
+        for pattern, full_command, slicer in SCOPED_PARSES:
+            scoped = pattern.match(command)
+            if scoped:
+                return slicer(self._recorded(full_command), {canonical_interface(scoped.group(1))})
+        raise KeyError("No recorded output for %r on %s" % (command, self.name))
+
+    def execute(self, command, **kwargs):
+        if command in ("wr mem", "write memory"):
+            self.phase = "post"
+        for phase in (self.phase, "pre"):
+            output = self.recordings.get(phase, {}).get(command)
+            if isinstance(output, str):
+                self.commands += 1
+                time.sleep(self.exec_latency)
+                return output
+        scoped = INTERFACE_CONFIG.match(command)
+        if scoped:
+            command = "show running-config | section ^interface %s$" % re.escape(canonical_interface(scoped.group(1)))
+        scoped = SECTION_FILTER.match(command)
+        if scoped:
+            self.commands += 1
+            time.sleep(self.exec_latency)
+            return config_section(self._recorded("show running-config"), scoped.group(1))
+        scoped = INCLUDE_FILTER.match(command)
+        if scoped:
+            self.commands += 1
+            time.sleep(self.exec_latency)
+            return config_include(self._recorded("show running-config"), scoped.group(1))
+        try:
+            recorded = self._recorded(command)
+        except KeyError:
+            return super().execute(command, **kwargs)
+        self.commands += 1
+        time.sleep(self.exec_latency)
+        if STREAMED_COMMAND.match(command):
+            return format_mac_table(recorded)
+        # Only the parsed form was recorded: its JSON stands in for the raw text
+        return json.dumps(recorded, sort_keys=True)
+
+    def parse(self, command, output=None, **kwargs):
+        self.commands += 1
+        time.sleep(self.exec_latency)
+        parsed = self._recorded(command)
+        if isinstance(parsed, dict) and not any(parsed.values()):
+            # Like Genie, e.g. for the sessions of a port with none
+            raise SchemaEmptyParserError(data=parsed)
+        return copy.deepcopy(parsed)
+
+    def learn(self, feature, **kwargs):
+        self.commands += 1
+        time.sleep(self.exec_latency)
+        return Learned(copy.deepcopy(self._recorded("learn %s" % feature)))
+
+    @classmethod
+    def from_captures(cls, alias, folders=("backup_configs", "pre_configs", "post_configs"), **kwargs):
+        """Build a replay device from the files a previous run left behind"""
+        recordings = {"pre": {}, "post": {}}
+        for folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            for filename in sorted(os.listdir(folder)):
+                if not filename.startswith(alias + "_"):
+                    continue
+                phase = "post" if "_Post_" in filename else "pre"
+                for marker, command in CAPTURE_FILES:
+                    if marker in filename:
+                        with open(os.path.join(folder, filename)) as fid:
+                            if filename.endswith(".json"):
+                                recordings[phase][command] = json.load(fid)
+                                if command == MAC_COMMAND:
+                                    recordings[phase][command] = MacTable.from_stored(
+                                        recordings[phase][command]).to_parsed()
+                            else:
+                                recordings[phase][command] = fid.read()
+                        break
+        return cls(alias, recordings, alias=alias, **kwargs)
@@ -0,0 +1,141 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+log = logging.getLogger(__name__)
+
+# ----------------
+# Step recording
+# ----------------
+class StepFailed(Exception):
+    """Raised by a recorded step to leave its block, like a pyATS step signal"""
+
+class RecordedStep:
+    """Stand-in for a pyATS step that keeps its result in memory
+
+    Worker threads cannot share the testcase ``steps`` object, so each device
+    records its own tree of steps and the parent replays it afterwards.
+    """
+    def __init__(self, name, continue_=False):
+        self.name = name
+        self.continue_ = continue_
+        self.result = "passed"
+        self.reason = None
+        self.children = []
+
+    def start(self, name, continue_=False):
+        child = RecordedStep(name, continue_=continue_)
+        self.children.append(child)
+        return child
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            return False
+        if exc_type is not StepFailed:
+            self.result = "errored"
+            self.reason = str(exc_value)
+        # pyATS swallows the failure when the step was started with continue_
+        return self.continue_
+
+    def _set(self, result, reason):
+        self.result = result
+        self.reason = reason
+        raise StepFailed(reason)
+
+    def passed(self, reason=None):
+        self._set("passed", reason)
+
+    def failed(self, reason=None):
+        self._set("failed", reason)
+
+    def errored(self, reason=None):
+        self._set("errored", reason)
+
+    def skipped(self, reason=None):
+        self._set("skipped", reason)
+
+    @property
+    def worst_result(self):
+        # Like pyATS roll-up, a skipped step does not fail its parent
+        results = [self.result] + [child.worst_result for child in self.children]
+        for result in ("errored", "failed"):
+            if result in results:
+                return result
+        return "passed"
+
+    def report(self, step):
+        """Replay the recorded children and result onto a real pyATS step"""
+        for child in self.children:
+            with step.start(child.name, continue_=True) as child_step:
+                child.report(child_step)
+        if self.result != "passed":
+            getattr(step, self.result)(self.reason)
+
+class StepRecorder(RecordedStep):
+    """Root of a device's recorded steps, used in place of ``steps``"""
+    def __init__(self, name):
+        super().__init__(name, continue_=True)
+
+# ----------------
+# Device results
+# ----------------
+class DeviceResult:
+    """Outcome of running the conversion against one device"""
+    def __init__(self, device_name, steps):
+        self.device_name = device_name
+        self.steps = steps
+        self.artifacts = []
+        self.exception = None
+
+    @property
+    def result(self):
+        if self.exception is not None:
+            return "errored"
+        return self.steps.worst_result
+
+# ----------------
+# Parallel runner
+# ----------------
+class ParallelRunner:
+    """Run a per-device function across the testbed with a worker cap
+
+    ``target`` is called as ``target(device, steps)`` and returns the list of
+    artifacts it wrote. Each device gets its own ``StepRecorder`` so one slow
+    or failing switch does not block or pollute the others. ``on_finish`` is
+    called with each ``DeviceResult`` as it comes in, on the calling thread.
+    """
+    def __init__(self, max_workers=1, on_finish=None):
+        self.max_workers = max(1, int(max_workers))
+        self.on_finish = on_finish
+
+    def _run_one(self, target, device):
+        recorder = StepRecorder(device.name)
+        device_result = DeviceResult(device.name, recorder)
+        try:
+            device_result.artifacts = target(device, recorder) or []
+        except Exception as e:
+            log.exception("Conversion of %s stopped", device.name)
+            device_result.exception = e
+        return device_result
+
+    def run(self, devices, target):
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._run_one, target, device): device for device in devices}
+            for future in as_completed(futures):
+                device_result = future.result()
+                results[device_result.device_name] = device_result
+                log.info("%s finished: %s", device_result.device_name, device_result.result)
+                if self.on_finish is not None:
+                    self.on_finish(device_result)
+        return results
@@ -0,0 +1,256 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from running_config import config_tree
+from mac_table import stream_parser
+
+log = logging.getLogger(__name__)
+
+# Platform key of the running config, which is parsed locally rather than by Genie
+CONFIG_PLATFORM = "running-config"
+
+def parse_key(command, platform, raw):
+    """Cache key of one output: command, platform and the raw text"""
+    digest = hashlib.sha256(("%s\0%s\0" % (command, platform)).encode())
+    digest.update(raw.encode())
+    return digest.hexdigest()
+
+def device_platform(device):
+    return "%s/%s" % (getattr(device, "os", None), getattr(device, "platform", None))
+
+# ----------------
+# Worker functions
+# ----------------
+# One parser-only Genie device per platform, per worker process
+_offline_devices = {}
+
+def offline_parse(command, os_name, platform, raw):
+    """Parse ``raw`` with Genie without a connection; returns (parsed, cpu seconds)"""
+    started = time.thread_time()
+    key = (os_name, platform)
+    if key not in _offline_devices:
+        from genie.conf.base import Device
+        device = Device("offline", os=os_name, platform=platform)
+        device.custom.setdefault("abstraction", {})["order"] = ["os", "platform"]
+        _offline_devices[key] = device
+    return _offline_devices[key].parse(command, output=raw), time.thread_time() - started
+
+def empty_parse(error):
+    """Whether ``error`` is Genie's for an output with nothing to parse, e.g. no sessions at all"""
+    try:
+        from genie.metaparser.util.exceptions import SchemaEmptyParserError
+    except ImportError:
+        return False
+    return isinstance(error, SchemaEmptyParserError)
+
+def offline_config_tree(raw):
+    started = time.thread_time()
+    return config_tree(raw), time.thread_time() - started
+
+# ----------------
+# Cache
+# ----------------
+class ParseCache:
+    """Parsed outputs keyed by command, platform and a hash of the raw text
+
+    The last ``max_entries`` are kept in memory as JSON text, so every hit
+    returns a copy its caller may change. With a ``root`` the parsed form
+    of each show output is also written there and outlives the run; raw
+    outputs and running config trees, which hold secrets, never are. Files
+    older than ``max_age`` seconds are dropped, and the least recently used
+    beyond ``max_files``.
+    """
+    def __init__(self, root=None, max_entries=256, max_files=10000, max_age=7 * 86400):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._files = 0
+        if root:
+            os.makedirs(root, exist_ok=True)
+            self.prune()
+
+    def _path(self, key):
+        return os.path.join(self.root, "%s.json" % key)
+
+    def prune(self):
+        """Drop expired and least recently used files, and any raw output an earlier version kept"""
+        now = time.time()
+        kept = []
+        for filename in os.listdir(self.root):
+            path = os.path.join(self.root, filename)
+            try:
+                if not filename.endswith(".json"):
+                    os.remove(path)
+                    continue
+                used = os.path.getmtime(path)
+                if now - used > self.max_age:
+                    os.remove(path)
+                else:
+                    kept.append((used, path))
+            except OSError:
+                continue
+        kept.sort()
+        for _, path in kept[:max(0, len(kept) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._files = min(len(kept), self.max_files)
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path) as fid:
+                text = json.dumps(json.load(fid)["parsed"])
+            # The mtime is the last use, for pruning
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return text
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+        if text is None and self.root:
+            text = self._load(key)
+            if text is not None:
+                self._remember(key, text)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(text)
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, command, platform, parsed):
+        try:
+            text = json.dumps(parsed, sort_keys=True)
+        except (TypeError, ValueError):
+            # Not JSON: parsed again next time
+            return
+        self._remember(key, text)
+        if not self.root or platform == CONFIG_PLATFORM:
+            return
+        path = self._path(key)
+        new = not os.path.exists(path)
+        with open(path, "w") as fid:
+            fid.write('{"command": %s, "platform": %s, "parsed": %s}' % (
+                json.dumps(command), json.dumps(platform), text))
+        with self._lock:
+            self._files += new
+            full = self._files > self.max_files
+        if full:
+            self.prune()
+
+# ----------------
+# Parser
+# ----------------
+class ParseResult:
+    """A parsed output, whether it came from the cache and the CPU it took"""
+    def __init__(self, parsed, cached=False, cpu=0.0):
+        self.parsed = parsed
+        self.cached = cached
+        self.cpu = cpu
+
+class Parser:
+    """Parse raw outputs through a ParseCache, in a process pool with ``workers``
+
+    ``submit`` returns at once with a future of a ParseResult, so the next
+    command can be collected while the last one is parsed. Without workers
+    outputs are parsed by the device itself, in the calling thread. MAC
+    address tables skip Genie and the cache: they are read line by line
+    into a MacTable, which is faster than a cache lookup.
+    """
+    def __init__(self, cache=None, workers=0):
+        self.cache = cache or ParseCache()
+        self.workers = int(workers or 0)
+        self._pool = ProcessPoolExecutor(self.workers) if self.workers else None
+
+    def _submit(self, key, command, platform, function, *args):
+        future = Future()
+        parsed = self.cache.get(key)
+        if parsed is not None:
+            future.set_result(ParseResult(parsed, cached=True))
+            return future
+
+        def done(parsed, cpu):
+            self.cache.put(key, command, platform, parsed)
+            future.set_result(ParseResult(parsed, cpu=cpu))
+
+        if self._pool is None:
+            try:
+                done(*function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        def finished(worker):
+            try:
+                done(*worker.result())
+            except Exception as e:
+                future.set_exception(e)
+        self._pool.submit(function, *args).add_done_callback(finished)
+        return future
+
+    def submit(self, device, command, raw):
+        """Future ParseResult of ``command``'s ``raw`` output on ``device``"""
+        streamed = stream_parser(command)
+        if streamed is not None:
+            future = Future()
+            parsed, cpu = streamed(raw)
+            future.set_result(ParseResult(parsed, cpu=cpu))
+            return future
+        platform = device_platform(device)
+        key = parse_key(command, platform, raw)
+        if self._pool is None:
+            def parse_inline():
+                started = time.thread_time()
+                return device.parse(command, output=raw), time.thread_time() - started
+            return self._submit(key, command, platform, parse_inline)
+        return self._submit(key, command, platform, offline_parse, command,
+                            getattr(device, "os", None), getattr(device, "platform", None), raw)
+
+    def submit_config(self, raw):
+        """Future ParseResult of a running config's tree"""
+        key = parse_key("show running-config", CONFIG_PLATFORM, raw)
+        return self._submit(key, "show running-config", CONFIG_PLATFORM, offline_config_tree, raw)
+
+    def parse(self, device, command, raw):
+        return self.submit(device, command, raw).result().parsed
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+# Parses inline, caching in memory, for callers that do not pass a Parser
+default_parser = Parser()
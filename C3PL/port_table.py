@@ -0,0 +1,270 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import re
+from array import array
+from running_config import canonical_interface
+from wave_scheduler import AUTHENTICATED
+from mac_table import mac_entries
+
+# Member/module/port of a stack interface, e.g. GigabitEthernet2/1/4
+PORT_NAME = re.compile(r"^(\D+)(\d+)/(\d+)/(\d+)$")
+
+# Columns holding one of a few strings, stored as integer codes: array typecode of each
+CATEGORICAL = {
+    "device": "I",
+    "kind": "B",
+    "status": "B",
+    "mode": "B",
+    "role": "B",
+}
+# Columns holding numbers: array typecode of each
+NUMERIC = {
+    "member": "B",
+    "module": "B",
+    "vlan": "H",
+    "dot1x": "B",
+    "dot1x_clients": "H",
+    "macs": "H",
+    "sessions": "H",
+    "authorized": "H",
+}
+
+# ----------------
+# Port roles
+# ----------------
+# Classification rules, in order: the first rule whose mask holds a port
+# gives it its role. Ports no rule holds are "other".
+DEFAULT_RULES = (
+    ("app", lambda ports: ports.equal("kind", "AppGigabitEthernet")),
+    ("uplink", lambda ports: ports.where("module", lambda module: module != 0)),
+    ("trunk", lambda ports: ports.equal("mode", "trunk")),
+    ("routed", lambda ports: ports.equal("mode", "routed")),
+    ("access", lambda ports: ports.equal("mode", "access")),
+)
+
+def port_mode(vlan):
+    """Mode of a port from the VLAN column of 'show interfaces status'"""
+    if vlan is None:
+        return "unknown"
+    if vlan in ("trunk", "routed"):
+        return vlan
+    return "access"
+
+# ----------------
+# Port table
+# ----------------
+class PortTable:
+    """One row per port, one array per column
+
+    Strings are dictionary-encoded and numbers kept in typed arrays, so a
+    432-port stack takes a few kilobytes and tables of a whole fleet can be
+    concatenated and queried together. Queries return masks, Python ints
+    with one bit per row, that combine with ``&``, ``|`` and ``~``; the
+    mask of a categorical value is built once and cached.
+    """
+    def __init__(self):
+        self.names = []
+        self.codes = {column: array(typecode) for column, typecode in CATEGORICAL.items()}
+        self.values = {column: [] for column in CATEGORICAL}
+        self._lookup = {column: {} for column in CATEGORICAL}
+        self.numbers = {column: array(typecode) for column, typecode in NUMERIC.items()}
+        self._index = {}
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _code(self, column, value):
+        lookup = self._lookup[column]
+        if value not in lookup:
+            lookup[value] = len(self.values[column])
+            self.values[column].append(value)
+        return lookup[value]
+
+    def append(self, name, **columns):
+        self._index[(columns.get("device"), name)] = len(self.names)
+        self.names.append(name)
+        for column in CATEGORICAL:
+            self.codes[column].append(self._code(column, columns.get(column)))
+        for column in NUMERIC:
+            self.numbers[column].append(min(int(columns.get(column) or 0), 255 if NUMERIC[column] == "B" else 65535))
+        self._masks.clear()
+
+    # ---------------------------------------
+    # Building
+    # ---------------------------------------
+    @classmethod
+    def from_captures(cls, status, dot1x, sessions, mac_table, device=None, rules=DEFAULT_RULES):
+        """Join the pre-change captures of a device into one row per port
+
+        Rows follow 'show interfaces status', then ports only 'show dot1x all
+        details' lists; every capture is joined on the full interface name.
+        """
+        rows = {}
+
+        def row(name):
+            name = canonical_interface(name)
+            if name not in rows:
+                rows[name] = {"device": device, "vlan_name": None}
+            return rows[name]
+
+        for name, values in (status or {}).get("interfaces", {}).items():
+            port = row(name)
+            port["vlan_name"] = values.get("vlan")
+            port["status"] = values.get("status")
+        for name, values in (dot1x or {}).get("interfaces", {}).items():
+            port = row(name)
+            port["dot1x"] = 1
+            port["dot1x_clients"] = len(values.get("clients", {}))
+        for name, values in (sessions or {}).get("interfaces", {}).items():
+            port = row(name)
+            clients = values.get("client", {}).values()
+            port["sessions"] = len(clients)
+            port["authorized"] = sum(1 for client in clients if client.get("status") in AUTHENTICATED)
+        for _, name, _, entry_type in mac_entries(mac_table):
+            if entry_type == "dynamic":
+                port = row(name)
+                port["macs"] = port.get("macs", 0) + 1
+
+        table = cls()
+        for name, port in rows.items():
+            found = PORT_NAME.match(name)
+            vlan = port.pop("vlan_name")
+            port["mode"] = port_mode(vlan)
+            port["vlan"] = int(vlan) if vlan and vlan.isdigit() else 0
+            if found:
+                port["kind"] = found.group(1)
+                port["member"] = int(found.group(2))
+                port["module"] = int(found.group(3))
+            else:
+                port["kind"] = re.match(r"^\D*", name).group(0)
+            table.append(name, **port)
+        table.classify(rules)
+        return table
+
+    @classmethod
+    def concat(cls, tables):
+        """One table holding the rows of ``tables``, e.g. a whole fleet"""
+        fleet = cls()
+        for table in tables:
+            offset = len(fleet)
+            for column in CATEGORICAL:
+                recode = [fleet._code(column, value) for value in table.values[column]]
+                fleet.codes[column].extend(recode[code] for code in table.codes[column])
+            for column in NUMERIC:
+                fleet.numbers[column].extend(table.numbers[column])
+            for (device, name), row in table._index.items():
+                fleet._index[(device, name)] = offset + row
+            fleet.names.extend(table.names)
+        return fleet
+
+    def classify(self, rules=DEFAULT_RULES):
+        """Give every port the role of the first rule that holds it"""
+        roles = self.codes["role"]
+        remaining = self.all()
+        for role, rule in rules:
+            matched = rule(self) & remaining
+            code = self._code("role", role)
+            for row in self.rows(matched):
+                roles[row] = code
+            remaining &= ~matched
+        code = self._code("role", "other")
+        for row in self.rows(remaining):
+            roles[row] = code
+        self._masks.clear()
+
+    # ---------------------------------------
+    # Queries
+    # ---------------------------------------
+    def _mask(self, flags):
+        """Mask of the rows whose flag is true"""
+        bits = bytearray((len(self) + 7) // 8)
+        for row, flag in enumerate(flags):
+            if flag:
+                bits[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(bits, "little")
+
+    def all(self):
+        return (1 << len(self)) - 1
+
+    def equal(self, column, value):
+        """Rows where ``column`` is ``value``"""
+        key = (column, value)
+        if key not in self._masks:
+            if column in self.codes:
+                code = self._lookup[column].get(value)
+                if code is None:
+                    return 0
+                self._masks[key] = self._mask(found == code for found in self.codes[column])
+            else:
+                self._masks[key] = self._mask(found == value for found in self.numbers[column])
+        return self._masks[key]
+
+    def where(self, column, predicate):
+        """Rows where ``predicate`` holds for the value of ``column``"""
+        if column in self.codes:
+            values = [predicate(value) for value in self.values[column]]
+            return self._mask(values[code] for code in self.codes[column])
+        return self._mask(predicate(value) for value in self.numbers[column])
+
+    def select(self, **conditions):
+        """Rows matching every ``column=value``; a callable value is a predicate"""
+        mask = self.all()
+        for column, value in conditions.items():
+            mask &= self.where(column, value) if callable(value) else self.equal(column, value)
+        return mask
+
+    def rows(self, mask):
+        """Row numbers set in ``mask``, in order"""
+        data = mask.to_bytes((len(self) + 7) // 8, "little")
+        for byte_index, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                yield (byte_index << 3) + low.bit_length() - 1
+                byte ^= low
+
+    def count(self, mask):
+        return bin(mask).count("1")
+
+    def column(self, column, mask=None):
+        """Values of ``column`` for the rows of ``mask`` (every row by default)"""
+        rows = range(len(self)) if mask is None else self.rows(mask)
+        if column == "name":
+            return [self.names[row] for row in rows]
+        if column in self.codes:
+            values = self.values[column]
+            codes = self.codes[column]
+            return [values[codes[row]] for row in rows]
+        return [self.numbers[column][row] for row in rows]
+
+    def row(self, name, device=None):
+        """Row of a port, or None"""
+        return self._index.get((device, canonical_interface(name)))
+
+    def interfaces(self, mask):
+        return self.column("name", mask)
+
+    def role_counts(self, mask=None):
+        counts = {}
+        for role in self.column("role", mask):
+            counts[role] = counts.get(role, 0) + 1
+        return counts
+
+    def endpoint_weights(self, mask=None):
+        """Endpoints on each port: its session clients or its learned MAC addresses, whichever is more"""
+        mask = self.all() if mask is None else mask
+        sessions = self.numbers["sessions"]
+        macs = self.numbers["macs"]
+        return {self.names[row]: max(sessions[row], macs[row]) for row in self.rows(mask)
+                if sessions[row] or macs[row]}
+
+    def nbytes(self):
+        """Bytes held by the column arrays"""
+        arrays = list(self.codes.values()) + list(self.numbers.values())
+        return sum(column.itemsize * len(column) for column in arrays)
@@ -0,0 +1,195 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import re
+import logging
+from running_config import RunningConfig, canonical_interface
+from parse_cache import default_parser, empty_parse
+from mac_table import MacTable
+
+log = logging.getLogger(__name__)
+
+# Global objects the templates add or remove, as they head a config block
+OBJECT_LINE = re.compile(r"^(?:no )?((?:service-template|class-map|policy-map|parameter-map) .+)$")
+
+# One filtered capture of every such object in the running config
+OBJECTS_SECTION = "show running-config | section ^(service-template|class-map|policy-map|parameter-map) "
+INTERFACE_CONFIG = "show running-config interface {interface}"
+INTERFACES_SECTION = "show running-config | section ^interface "
+
+# ----------------
+# Slicing parsed captures to a scope
+# ----------------
+def slice_interfaces(parsed, interfaces):
+    """Keep the entries of an ``{"interfaces": {...}}`` capture for ``interfaces``"""
+    return {"interfaces": {name: values for name, values in (parsed or {}).get("interfaces", {}).items()
+                           if canonical_interface(name) in interfaces}}
+
+def slice_mac_table(parsed, interfaces):
+    """Keep the MAC addresses learned on ``interfaces``"""
+    if isinstance(parsed, MacTable):
+        return parsed.slice(interfaces)
+    vlans = {}
+    for vlan, values in (parsed or {}).get("mac_table", {}).get("vlans", {}).items():
+        addresses = {mac: entry for mac, entry in values.get("mac_addresses", {}).items()
+                     if any(canonical_interface(name) in interfaces for name in entry.get("interfaces", {}))}
+        if addresses:
+            vlans[vlan] = dict(values, mac_addresses=addresses)
+    return {"mac_table": {"vlans": vlans}}
+
+def slice_config(tree, interfaces, objects):
+    """Keep the interface blocks and global objects in scope of a config tree"""
+    return {line: children for line, children in (tree or {}).items()
+            if line in objects or (line.startswith("interface ") and
+                                   canonical_interface(line.split(None, 1)[1]) in interfaces)}
+
+def merge(into, data):
+    """Fold one per-interface capture into the others"""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(into.get(key), dict):
+            merge(into[key], value)
+        else:
+            into[key] = value
+    return into
+
+def parsed_output(pending):
+    """Parsed output of a parser future; an output with nothing to parse, like a port without sessions, is empty"""
+    try:
+        return pending.result().parsed
+    except Exception as e:
+        if empty_parse(e):
+            return {}
+        raise
+
+def combine(captures):
+    """One capture from the per-interface captures of a command"""
+    if captures and all(isinstance(capture, MacTable) for capture in captures):
+        return MacTable.concat(captures)
+    combined = {}
+    for capture in captures:
+        merge(combined, capture)
+    return combined
+
+# Per-interface form of each full-device capture, and how to slice the full
+# capture to the same scope. Dot1x has no per-interface parser.
+SCOPED_COMMANDS = {
+    "show mac address-table": ("show mac address-table interface {interface}", slice_mac_table),
+    "show dot1x all details": (None, slice_interfaces),
+    "show authentication sessions": ("show authentication sessions interface {interface}", slice_interfaces),
+    "show interfaces status": ("show interfaces {interface} status", slice_interfaces),
+}
+
+# ----------------
+# Scope
+# ----------------
+class VerificationScope:
+    """The interfaces and global objects a pushed bundle touched"""
+    def __init__(self, interfaces=(), objects=()):
+        self.interfaces = set(canonical_interface(name) for name in interfaces)
+        self.objects = set(objects)
+
+    @classmethod
+    def from_lines(cls, lines):
+        interfaces = set()
+        objects = set()
+        for line in lines or ():
+            if line.startswith("interface "):
+                interfaces.add(line.split(None, 1)[1])
+                continue
+            found = OBJECT_LINE.match(line)
+            if found:
+                objects.add(found.group(1))
+        return cls(interfaces, objects)
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        scope = cls()
+        for section in bundle.sections:
+            if not section.exec_command:
+                scope.update(cls.from_lines(section.lines))
+        return scope
+
+    def update(self, other):
+        self.interfaces.update(other.interfaces)
+        self.objects.update(other.objects)
+
+    def slice(self, command, parsed):
+        return SCOPED_COMMANDS[command][1](parsed, self.interfaces)
+
+    def slice_config(self, tree):
+        return slice_config(tree, self.interfaces, self.objects)
+
+# ----------------
+# Scoped re-capture
+# ----------------
+class PostVerification:
+    """Re-capture only what a push touched
+
+    While the touched interfaces are at most ``per_interface_share`` of the
+    device's ``total_interfaces``, each is captured with one per-interface
+    command; past that, one full-device command is cheaper and its output
+    is sliced to the same scope instead. Each output
+    goes to the ``parser`` as soon as it is collected.
+    """
+    def __init__(self, device, scope, metrics, total_interfaces=0, per_interface_share=0.1, parser=None):
+        self.device = device
+        self.scope = scope
+        self.metrics = metrics
+        self.total_interfaces = total_interfaces
+        self.per_interface_share = per_interface_share
+        self.parser = parser or default_parser
+
+    def _per_interface(self, template):
+        return template is not None and len(self.scope.interfaces) <= self.per_interface_share * self.total_interfaces
+
+    def _execute(self, command, record):
+        output = self.device.execute(command)
+        record["commands"] += 1
+        record["bytes_received"] += len(output)
+        return output
+
+    def _parse(self, command, record):
+        """Collect ``command`` and hand its output to the parser; returns the future result"""
+        return self.parser.submit(self.device, command, self._execute(command, record))
+
+    def capture(self, steps, command):
+        """Post-change ``command`` for the scope, or None if it could not be parsed"""
+        template, _ = SCOPED_COMMANDS[command]
+        with steps.start(f"Verifying {command} on {len(self.scope.interfaces)} interface(s)", continue_=True) as step:
+            try:
+                with self.metrics.stage(self.device.alias, f"verify {command}", commands=0, bytes_received=0,
+                                        interfaces=len(self.scope.interfaces)) as record:
+                    if not self.scope.interfaces:
+                        return self.scope.slice(command, {})
+                    if not self._per_interface(template):
+                        return self.scope.slice(command, parsed_output(self._parse(command, record)))
+                    pending = [self._parse(template.format(interface=interface), record)
+                               for interface in sorted(self.scope.interfaces)]
+                    return self.scope.slice(command, combine([parsed_output(result) for result in pending]))
+            except Exception as e:
+                step.failed('Could not verify it correctly\n{e}'.format(e=e))
+                return None
+
+    def running_config(self, steps):
+        """Post-change config tree of the touched interfaces and objects"""
+        with steps.start('Verifying post-change running config', continue_=True) as step:
+            try:
+                with self.metrics.stage(self.device.alias, "verify running config", commands=0, bytes_received=0,
+                                        interfaces=len(self.scope.interfaces)) as record:
+                    raw = []
+                    if self.scope.objects:
+                        raw.append(self._execute(OBJECTS_SECTION, record))
+                    if self._per_interface(INTERFACE_CONFIG):
+                        for interface in sorted(self.scope.interfaces):
+                            raw.append(self._execute(INTERFACE_CONFIG.format(interface=interface), record))
+                    elif self.scope.interfaces:
+                        raw.append(self._execute(INTERFACES_SECTION, record))
+                    return self.scope.slice_config(RunningConfig("\n".join(raw)).tree)
+            except Exception as e:
+                step.failed('Could not verify it correctly\n{e}'.format(e=e))
+                return None
@@ -0,0 +1,142 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import re
+from functools import cached_property
+
+# Lines IOS prints around the configuration that are not configuration
+IGNORED_LINES = re.compile(r"^(Building configuration\.\.\.|Current configuration\s*:.*|end)$")
+BANNER_LINE = re.compile(r"^banner\s+\S+\s+(\S)(\S)?")
+
+# Abbreviated interface types as IOS accepts them, longest first
+INTERFACE_PREFIXES = (
+    ("TwentyFiveGigE", "TwentyFiveGigE"),
+    ("TwoGigabitEthernet", "TwoGigabitEthernet"),
+    ("TenGigabitEthernet", "TenGigabitEthernet"),
+    ("FortyGigabitEthernet", "FortyGigabitEthernet"),
+    ("AppGigabitEthernet", "AppGigabitEthernet"),
+    ("GigabitEthernet", "GigabitEthernet"),
+    ("FastEthernet", "FastEthernet"),
+    ("HundredGigE", "HundredGigE"),
+    ("Port-channel", "Port-channel"),
+    ("Twe", "TwentyFiveGigE"),
+    ("Tw", "TwoGigabitEthernet"),
+    ("Te", "TenGigabitEthernet"),
+    ("Fo", "FortyGigabitEthernet"),
+    ("Ap", "AppGigabitEthernet"),
+    ("Gi", "GigabitEthernet"),
+    ("Fa", "FastEthernet"),
+    ("Hu", "HundredGigE"),
+    ("Po", "Port-channel"),
+)
+
+# Shortest abbreviation of each full interface type, e.g. GigabitEthernet -> Gi
+SHORT_INTERFACE_TYPES = {}
+for prefix, full in INTERFACE_PREFIXES:
+    if prefix != full:
+        SHORT_INTERFACE_TYPES.setdefault(full, prefix)
+
+# ----------------
+# Running config
+# ----------------
+class RunningConfig:
+    """A raw ``show running-config`` capture and the views derived from it
+
+    The raw text is fetched once per phase; the backup file, the structured
+    tree used for the diff and any template decisions all come from here.
+    """
+    def __init__(self, raw, tree=None):
+        self.raw = raw or ""
+        if tree is not None:
+            # Already parsed, e.g. from the parse cache
+            self.__dict__["tree"] = tree
+
+    @cached_property
+    def tree(self):
+        """Nested dict of the config, same shape as Genie ``learn('config')``"""
+        return config_tree(self.raw)
+
+    @cached_property
+    def interfaces(self):
+        """Config lines under each ``interface``, keyed by full interface name"""
+        interfaces = {}
+        for line, children in self.tree.items():
+            if line.startswith("interface "):
+                interfaces[canonical_interface(line.split(None, 1)[1])] = list(children)
+        return interfaces
+
+# ----------------
+# Interface names
+# ----------------
+def canonical_interface(name):
+    """Expand an abbreviated interface name, e.g. Gi1/0/1 -> GigabitEthernet1/0/1"""
+    name = name.strip()
+    for prefix, full in INTERFACE_PREFIXES:
+        if name.startswith(prefix) and name[len(prefix):len(prefix) + 1].isdigit():
+            return full + name[len(prefix):]
+    return name
+
+_short_names = {}
+
+def short_interface(name):
+    """Abbreviate a full interface name, e.g. GigabitEthernet1/0/1 -> Gi1/0/1
+
+    This is how IOS names the per-port objects ``authentication display
+    new-style`` generates (``POLICY_Gi1/0/1``). Names are looked up once.
+    """
+    short = _short_names.get(name)
+    if short is None:
+        short = full_name = canonical_interface(name)
+        for full, prefix in SHORT_INTERFACE_TYPES.items():
+            if full_name.startswith(full) and full_name[len(full):len(full) + 1].isdigit():
+                short = prefix + full_name[len(full):]
+                break
+        _short_names[name] = short
+    return short
+
+# ----------------
+# Parsing
+# ----------------
+def config_tree(raw):
+    """Build a nested dict keyed by config line, children nested by indentation"""
+    tree = {}
+    stack = [(-1, tree)]
+    banner_end = None
+
+    for line in raw.splitlines():
+        stripped = line.strip()
+
+        # Banner bodies are kept verbatim under their banner line
+        if banner_end is not None:
+            if stripped and stripped != banner_end:
+                stack[-1][1][stripped] = {}
+            if banner_end in stripped:
+                banner_end = None
+                stack.pop()
+            continue
+
+        if not stripped or stripped.startswith("!") or IGNORED_LINES.match(stripped):
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        while stack[-1][0] >= indent:
+            stack.pop()
+
+        children = stack[-1][1].setdefault(stripped, {})
+        stack.append((indent, children))
+
+        banner = BANNER_LINE.match(stripped)
+        if banner:
+            delimiter = "^C" if banner.group(1) == "^" and banner.group(2) == "C" else banner.group(1)
+            # The banner may open and close on the same line
+            if stripped.count(delimiter) < 2:
+                banner_end = delimiter
+            else:
+                stack.pop()
+
+    return tree
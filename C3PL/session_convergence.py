@@ -0,0 +1,177 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import time
+import logging
+from running_config import canonical_interface
+from post_verification import SCOPED_COMMANDS, merge
+from stage_metrics import percentiles
+from wave_scheduler import AUTHENTICATED
+from mac_table import mac_entries
+from parse_cache import empty_parse
+
+log = logging.getLogger(__name__)
+
+SESSIONS = "show authentication sessions"
+
+# ----------------
+# Expected endpoints
+# ----------------
+def expected_clients(dot1x, sessions, mac_table):
+    """Endpoints each converted port should authorize again: interface -> set of MAC addresses
+
+    The ports are those with 802.1X configured before the change. Their
+    dot1x clients and session clients are expected back, as are the
+    dynamic MAC addresses learned on them, which covers endpoints that had
+    no session before the change.
+    """
+    expected = {canonical_interface(name): set(values.get("clients", {}))
+                for name, values in (dot1x or {}).get("interfaces", {}).items()}
+    for name, values in (sessions or {}).get("interfaces", {}).items():
+        name = canonical_interface(name)
+        if name in expected:
+            expected[name].update(values.get("client", {}))
+    for _, name, mac, entry_type in mac_entries(mac_table):
+        name = canonical_interface(name)
+        if name in expected and entry_type == "dynamic":
+            expected[name].add(mac)
+    return {name: macs for name, macs in expected.items() if macs}
+
+def authorized_clients(parsed):
+    """Authorized MAC addresses in a parsed 'show authentication sessions': interface -> set"""
+    authorized = {}
+    for name, values in (parsed or {}).get("interfaces", {}).items():
+        macs = {mac for mac, client in values.get("client", {}).items() if client.get("status") in AUTHENTICATED}
+        authorized.setdefault(canonical_interface(name), set()).update(macs)
+    return authorized
+
+# ----------------
+# Watcher
+# ----------------
+class ConvergenceWatcher:
+    """Poll a converted device until its endpoints are authorized again
+
+    Polls start ``initial_interval`` seconds apart; every poll that brings
+    no new endpoint back doubles the interval, up to ``max_interval``, and
+    any progress resets it. While few ports are still pending they are
+    polled one by one instead of parsing every session on the device.
+    Latencies are counted from ``origin``, when the ports got their new
+    config, and resolved to the poll that first saw the endpoint authorized.
+    """
+    def __init__(self, device, expected, timeout=300, initial_interval=1.0, max_interval=15.0, backoff=2.0,
+                 per_interface_limit=8, clock=time.time, sleep=time.sleep):
+        self.device = device
+        self.expected = expected
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.per_interface_limit = per_interface_limit
+        self.clock = clock
+        self.sleep = sleep
+        self.polls = 0
+        self.commands = 0
+
+    def _parse(self, command):
+        """Parsed sessions; none at all, the usual state right after the push, parse to nothing"""
+        self.commands += 1
+        try:
+            return self.device.parse(command)
+        except Exception as e:
+            if empty_parse(e):
+                return {}
+            raise
+
+    def _poll(self, pending):
+        """Authorized endpoints on the ``pending`` ports"""
+        self.polls += 1
+        template, _ = SCOPED_COMMANDS[SESSIONS]
+        if len(pending) > self.per_interface_limit:
+            return authorized_clients(self._parse(SESSIONS))
+        parsed = {}
+        for interface in sorted(pending):
+            merge(parsed, self._parse(template.format(interface=interface)))
+        return authorized_clients(parsed)
+
+    def watch(self, origin=None):
+        """Wait for the expected endpoints and return when each came back"""
+        started = self.clock()
+        origin = started if origin is None else min(origin, started)
+        deadline = started + self.timeout
+        latencies = {}
+        pending = {interface: set(macs) for interface, macs in self.expected.items()}
+        interval = self.initial_interval
+
+        while pending:
+            authorized = self._poll(pending)
+            now = self.clock()
+            progress = False
+            for interface, macs in list(pending.items()):
+                back = macs & authorized.get(interface, set())
+                for mac in back:
+                    latencies.setdefault(interface, {})[mac] = round(now - origin, 3)
+                macs -= back
+                progress = progress or bool(back)
+                if not macs:
+                    del pending[interface]
+            if not pending or now >= deadline:
+                break
+            interval = self.initial_interval if progress else min(interval * self.backoff, self.max_interval)
+            self.sleep(min(interval, max(0.0, deadline - now)))
+
+        return ConvergenceReport(self.device.name, self.expected, latencies, pending,
+                                 waited=self.clock() - started, polls=self.polls, commands=self.commands)
+
+# ----------------
+# Report
+# ----------------
+class ConvergenceReport:
+    """Time-to-reauthorize of every endpoint, port and the device as a whole"""
+    def __init__(self, device, expected, latencies, pending, waited=0.0, polls=0, commands=0):
+        self.device = device
+        self.expected = expected
+        self.latencies = latencies
+        self.pending = pending
+        self.waited = waited
+        self.polls = polls
+        self.commands = commands
+
+    @property
+    def converged(self):
+        return not self.pending
+
+    def port_latencies(self):
+        """Seconds until each fully converged port had all its endpoints back"""
+        return {interface: max(self.latencies[interface].values()) for interface in self.expected
+                if interface not in self.pending and interface in self.latencies}
+
+    def summary(self):
+        ports = self.port_latencies()
+        clients = [latency for macs in self.latencies.values() for latency in macs.values()]
+        return {
+            "device": self.device,
+            "converged": self.converged,
+            "ports": len(self.expected),
+            "ports_converged": len(ports),
+            "endpoints": sum(len(macs) for macs in self.expected.values()),
+            "endpoints_converged": len(clients),
+            "device_latency": max(ports.values(), default=0.0) if self.converged else None,
+            "port_latency": percentiles(ports.values()),
+            "endpoint_latency": percentiles(clients),
+            "waited": round(self.waited, 3),
+            "polls": self.polls,
+            "commands": self.commands,
+        }
+
+    def to_dict(self):
+        return {
+            "summary": self.summary(),
+            "ports": self.port_latencies(),
+            "endpoints": self.latencies,
+            "pending": {interface: sorted(macs) for interface, macs in self.pending.items()},
+        }
@@ -0,0 +1,148 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import copy
+import time
+import threading
+from collections import deque
+from mock_device import ReplayDevice
+
+# ----------------
+# Clock
+# ----------------
+class ScaledClock:
+    """Simulated seconds that pass ``scale`` times faster than real ones"""
+    def __init__(self, scale=1.0):
+        self.scale = float(scale)
+        self._started = time.monotonic()
+
+    def time(self):
+        return (time.monotonic() - self._started) * self.scale
+
+    def sleep(self, seconds):
+        time.sleep(max(0.0, seconds) / self.scale)
+
+# ----------------
+# RADIUS load model
+# ----------------
+class RadiusModel:
+    """RADIUS servers answering ``capacity`` authentications per second
+
+    Requests queue in arrival order. One that waited longer than
+    ``timeout`` seconds is dropped by the switch and sent again, as 802.1X
+    and MAB retries do, so a burst far above capacity keeps feeding itself.
+    """
+    def __init__(self, capacity, timeout=5.0, clock=None):
+        self.capacity = float(capacity)
+        self.timeout = timeout
+        self.clock = clock or ScaledClock()
+        self.requests = 0
+        self.timeouts = 0
+        self.max_backlog = 0
+        self.offered = {}
+        self._pending = deque()
+        self._authenticated = {}
+        self._free_at = self.clock.time()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        """Serve, in simulated time, every request the servers got to by now"""
+        now = self.clock.time()
+        service = 1.0 / self.capacity
+        while self._pending:
+            requested, device, mac = self._pending[0]
+            started = max(self._free_at, requested)
+            if started + service > now:
+                break
+            self._pending.popleft()
+            self._free_at = started + service
+            if started - requested > self.timeout:
+                # Answered too late: the endpoint gave up and sent it again
+                self.timeouts += 1
+                self._request(requested + self.timeout, device, mac)
+            else:
+                self._authenticated.setdefault(device, set()).add(mac)
+
+    def _request(self, requested, device, mac):
+        self._pending.append((requested, device, mac))
+        self.requests += 1
+        second = int(requested)
+        self.offered[second] = self.offered.get(second, 0) + 1
+
+    def authenticate(self, device, macs):
+        """``macs`` on ``device`` start authenticating now"""
+        with self._lock:
+            self._advance()
+            now = self.clock.time()
+            for mac in macs:
+                self._authenticated.get(device, set()).discard(mac)
+                self._request(now, device, mac)
+            self.max_backlog = max(self.max_backlog, len(self._pending))
+
+    def authenticated(self, device):
+        with self._lock:
+            self._advance()
+            return set(self._authenticated.get(device, ()))
+
+    def summary(self):
+        with self._lock:
+            self._advance()
+            return {
+                "requests": self.requests,
+                "timeouts": self.timeouts,
+                "max_backlog": self.max_backlog,
+                "peak_offered_per_second": max(self.offered.values()) if self.offered else 0,
+                "backlog": len(self._pending),
+            }
+
+# ----------------
+# Simulated switch
+# ----------------
+class SimulatedSwitch(ReplayDevice):
+    """Replay device whose endpoints re-authenticate against a RadiusModel
+
+    Configuring ``access-session port-control auto`` on a port sends every
+    endpoint recorded on it to the model. 'show authentication sessions'
+    then reports them ``Running`` until the model authenticates them.
+    """
+    def __init__(self, name, recordings, model, **kwargs):
+        super().__init__(name, recordings, **kwargs)
+        self.model = model
+        self.converted = set()
+        sessions = recordings["pre"].get("show authentication sessions", {})
+        self.endpoints = {interface: list(values.get("client", {}))
+                          for interface, values in sessions.get("interfaces", {}).items()}
+
+    def configure(self, command, **kwargs):
+        output = super().configure(command, **kwargs)
+        lines = command.splitlines() if isinstance(command, str) else list(command)
+        interface = None
+        macs = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith("interface "):
+                interface = line.split(None, 1)[1]
+            elif line == "access-session port-control auto" and interface not in self.converted:
+                self.converted.add(interface)
+                macs.extend(self.endpoints.get(interface, ()))
+        if macs:
+            self.model.authenticate(self.name, macs)
+        return output
+
+    def _recorded(self, command):
+        # Per-interface session commands are sliced from this one too
+        if command != "show authentication sessions" or not self.converted:
+            return super()._recorded(command)
+        parsed = copy.deepcopy(self.recordings["pre"][command])
+        authenticated = self.model.authenticated(self.name)
+        for interface, values in parsed.get("interfaces", {}).items():
+            if interface not in self.converted:
+                continue
+            for mac, client in values.get("client", {}).items():
+                client["status"] = "Auth" if mac in authenticated else "Running"
+        return parsed
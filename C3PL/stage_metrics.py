@@ -0,0 +1,134 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles and the maximum of ``values``, None when there are none"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    result = {"p%d" % point: ordered[max(0, -(-point * len(ordered) // 100) - 1)] for point in points}
+    result["max"] = ordered[-1]
+    return result
+
+# ----------------
+# Stage metrics
+# ----------------
+class StageMetrics:
+    """Time every stage of every device and write one JSON line per stage
+
+    Each record carries the device (its alias, as in the artifact file names
+    and the journal), the stage, its wall duration, the CPU time of the
+    thread that ran it and whatever counters the stage filled in
+    (``bytes_received``, ``bytes_sent``, ``lines_pushed``, ``parse_cpu``).
+    Several devices can record at once; writes are serialised.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, device, stage, **fields):
+        record = {"device": device, "stage": stage, "result": "passed"}
+        record.update(fields)
+        started = time.time()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        except Exception:
+            record["result"] = "errored"
+            raise
+        finally:
+            record["started"] = round(started, 3)
+            record["duration"] = round(time.perf_counter() - wall, 4)
+            record["cpu"] = round(time.thread_time() - cpu, 4)
+            self.add(record)
+
+    def add(self, record):
+        record.setdefault("started", round(time.time(), 3))
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, "a") as fid:
+                    fid.write(json.dumps(record, sort_keys=True) + "\n")
+
+    # ---------------------------------------
+    # Summary
+    # ---------------------------------------
+    def summary(self, top=10):
+        """Slowest devices, slowest stages and per-stage totals of the run"""
+        with self._lock:
+            records = list(self.records)
+
+        spans = {}
+        stages = {}
+        for record in records:
+            # A device's time is the span of its stages; stages can nest
+            first, last = spans.get(record["device"], (record["started"], record["started"]))
+            spans[record["device"]] = (min(first, record["started"]), max(last, record["started"] + record["duration"]))
+            totals = stages.setdefault(record["stage"], {"stage": record["stage"], "count": 0, "duration": 0.0,
+                                                         "cpu": 0.0, "max_duration": 0.0, "max_device": None})
+            totals["count"] += 1
+            totals["duration"] += record["duration"]
+            totals["cpu"] += record["cpu"]
+            if record["duration"] >= totals["max_duration"]:
+                totals["max_duration"] = record["duration"]
+                totals["max_device"] = record["device"]
+        devices = {device: last - first for device, (first, last) in spans.items()}
+        # Time-to-reauthorize of the converted devices, across the fleet
+        convergence = [record for record in records if record["stage"] == "convergence"]
+
+        return {
+            "devices": len(devices),
+            "total_duration": round(sum(devices.values()), 3),
+            "slowest_devices": [{"device": device, "duration": round(duration, 3)} for device, duration in
+                                sorted(devices.items(), key=lambda item: item[1], reverse=True)[:top]],
+            "slowest_stages": sorted(stages.values(), key=lambda totals: totals["duration"], reverse=True)[:top],
+            "slowest_records": sorted(records, key=lambda record: record["duration"], reverse=True)[:top],
+            "convergence": {
+                "devices": len(convergence),
+                "converged": sum(1 for record in convergence if record.get("converged")),
+                "device_latency": percentiles(record["device_latency"] for record in convergence
+                                              if record.get("device_latency") is not None),
+                "port_latency_p90": percentiles(record["port_latency"]["p90"] for record in convergence
+                                                if record.get("port_latency")),
+            },
+        }
+
+    def write_summary(self, path, top=10):
+        with open(path, "w") as fid:
+            json.dump(self.summary(top=top), fid, indent=4, sort_keys=True)
+
+    def format_summary(self, top=10):
+        summary = self.summary(top=top)
+        lines = ["%d device(s), %.1fs of device time" % (summary["devices"], summary["total_duration"]),
+                 "Slowest devices:"]
+        for entry in summary["slowest_devices"]:
+            lines.append("  %-30s %10.1fs" % (entry["device"], entry["duration"]))
+        lines.append("Slowest stages (total / count / worst device):")
+        for totals in summary["slowest_stages"]:
+            lines.append("  %-45s %10.1fs %6d  %.1fs on %s" % (totals["stage"], totals["duration"], totals["count"],
+                                                              totals["max_duration"], totals["max_device"]))
+        convergence = summary["convergence"]
+        if convergence["devices"]:
+            lines.append("Sessions back on %d of %d device(s)" % (convergence["converged"], convergence["devices"]))
+            for label, key in (("device", "device_latency"), ("port (p90 per device)", "port_latency_p90")):
+                if convergence[key]:
+                    lines.append("  %-25s p50 %.1fs  p90 %.1fs  p99 %.1fs  max %.1fs" % (
+                        label, convergence[key]["p50"], convergence[key]["p90"], convergence[key]["p99"],
+                        convergence[key]["max"]))
+        return "\n".join(lines)
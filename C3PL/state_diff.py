@@ -0,0 +1,167 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import re
+import json
+
+PATH_SEPARATOR = " > "
+# First line of every changelog, telling it from the Genie diffs older runs wrote
+CHANGELOG_HEADER = "# C3PL state diff 1: + added, - removed, ~ modified"
+# Path keys that would be ambiguous as they are are written as JSON strings
+QUOTED_KEY = re.compile(r'[>:"]|^\s|\s$|^$')
+
+# ----------------
+# Changes
+# ----------------
+class Change:
+    """One added, removed or modified path between the pre and post state"""
+    __slots__ = ("kind", "path", "old", "new")
+
+    SIGNS = {"added": "+", "removed": "-", "modified": "~"}
+
+    def __init__(self, kind, path, old=None, new=None):
+        self.kind = kind
+        self.path = path
+        self.old = old
+        self.new = new
+
+    def line(self):
+        """The changelog line: sign, path, then the value(s) as compact JSON"""
+        path = format_path(self.path)
+        if self.kind == "added":
+            return "+ %s: %s" % (path, compact(self.new))
+        if self.kind == "removed":
+            return "- %s: %s" % (path, compact(self.old))
+        return "~ %s: %s -> %s" % (path, compact(self.old), compact(self.new))
+
+    def to_dict(self):
+        return {"kind": self.kind, "path": [str(key) for key in self.path], "old": self.old, "new": self.new}
+
+def compact(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+def format_path(path):
+    """Keys joined by the separator, quoting those a reader could not split back"""
+    keys = (str(key) for key in path)
+    return PATH_SEPARATOR.join(json.dumps(key) if QUOTED_KEY.search(key) else key for key in keys)
+
+def write_changelog(fid, changes):
+    """Stream ``changes`` into ``fid`` after the header; returns the number of changes"""
+    fid.write(CHANGELOG_HEADER + "\n")
+    written = 0
+    for change in changes:
+        fid.write(change.line() + "\n")
+        written += 1
+    if not written:
+        fid.write("NO CHANGES")
+    return written
+
+# ----------------
+# Diff engine
+# ----------------
+class StateDiff:
+    """Walk two parsed structures and yield what changed, path by path
+
+    Each branch is first compared as a whole; Python's dict and list
+    equality is a structural comparison done in C that stops at the first
+    difference, so identical branches are skipped without walking them in
+    Python. Only branches that differ are descended into. Changes are
+    yielded as they are found, so they can be written out without building
+    the whole diff in memory.
+    """
+    def __init__(self, pre, post):
+        self.pre = pre
+        self.post = post
+        self.counts = {"added": 0, "removed": 0, "modified": 0}
+
+    def changes(self):
+        for change in self._walk((), self.pre, self.post):
+            self.counts[change.kind] += 1
+            yield change
+
+    def _walk(self, path, pre, post):
+        if pre == post:
+            return
+        if isinstance(pre, dict) and isinstance(post, dict):
+            for key in pre:
+                if key not in post:
+                    yield Change("removed", path + (key,), old=pre[key])
+                else:
+                    yield from self._walk(path + (key,), pre[key], post[key])
+            for key in post:
+                if key not in pre:
+                    yield Change("added", path + (key,), new=post[key])
+        elif isinstance(pre, list) and isinstance(post, list):
+            for index in range(max(len(pre), len(post))):
+                if index >= len(post):
+                    yield Change("removed", path + (index,), old=pre[index])
+                elif index >= len(pre):
+                    yield Change("added", path + (index,), new=post[index])
+                else:
+                    yield from self._walk(path + (index,), pre[index], post[index])
+        elif pre is None:
+            yield Change("added", path, new=post)
+        elif post is None:
+            yield Change("removed", path, old=pre)
+        else:
+            yield Change("modified", path, old=pre, new=post)
+
+    def write(self, fid):
+        """Stream the changelog into ``fid``; returns the number of changes"""
+        return write_changelog(fid, self.changes())
+
+# ----------------
+# Reading changelogs back
+# ----------------
+_decoder = json.JSONDecoder()
+
+def is_changelog(first_line):
+    """Whether a file starting with ``first_line`` was written by ``write_changelog``"""
+    return first_line.rstrip("\n") == CHANGELOG_HEADER
+
+def _split_path(text):
+    """The path keys at the start of ``text`` and what follows their ': '"""
+    keys = []
+    position = 0
+    while True:
+        if text.startswith('"', position):
+            key, position = _decoder.raw_decode(text, position)
+        else:
+            ends = [end for end in (text.find(PATH_SEPARATOR, position), text.find(": ", position)) if end >= 0]
+            if not ends:
+                raise ValueError("No value after the path")
+            key, position = text[position:min(ends)], min(ends)
+        keys.append(key)
+        if text.startswith(PATH_SEPARATOR, position):
+            position += len(PATH_SEPARATOR)
+        elif text.startswith(": ", position):
+            return keys, text[position + 2:]
+        else:
+            raise ValueError("Unexpected text after a quoted key")
+
+def parse_change_line(line):
+    """Turn a changelog line back into (kind, path, old, new), or None
+
+    The values are left as the compact JSON text they were written as.
+    """
+    kinds = {"+": "added", "-": "removed", "~": "modified"}
+    if len(line) < 3 or line[0] not in kinds or line[1] != " ":
+        return None
+    try:
+        path, values = _split_path(line[2:].rstrip("\n"))
+        kind = kinds[line[0]]
+        if kind == "modified":
+            _, end = _decoder.raw_decode(values)
+            if not values.startswith(" -> ", end):
+                return None
+            return kind, path, values[:end], values[end + 4:]
+    except ValueError:
+        return None
+    if kind == "added":
+        return kind, path, None, values
+    return kind, path, values, None
@@ -0,0 +1,119 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import random
+from mock_device import ReplayDevice
+
+PORTS_PER_MEMBER = 48
+DATA_VLAN = 100
+
+# ----------------
+# Synthetic captures
+# ----------------
+def mac_address(device_index, port_index, client):
+    value = (device_index << 24) | (port_index << 4) | client
+    digits = "%012x" % value
+    return "%s.%s.%s" % (digits[0:4], digits[4:8], digits[8:12])
+
+def legacy_interface_config(interface):
+    return [
+        "interface %s" % interface,
+        " switchport access vlan %d" % DATA_VLAN,
+        " switchport mode access",
+        " authentication event fail action authorize vlan 1",
+        " authentication event server dead action authorize vlan",
+        " authentication host-mode multi-domain",
+        " authentication order dot1x mab",
+        " authentication priority dot1x mab",
+        " authentication port-control auto",
+        " authentication periodic",
+        " mab",
+        " dot1x pae authenticator",
+        " dot1x timeout tx-period 10",
+        " spanning-tree portfast",
+        "!",
+    ]
+
+def synthetic_recordings(device_index, members, seed=0):
+    """Pre and post captures of one legacy-mode access stack"""
+    rng = random.Random((seed << 20) ^ device_index)
+    hostname = "sw%04d" % device_index
+    access = ["GigabitEthernet%d/0/%d" % (member, port)
+              for member in range(1, members + 1) for port in range(1, PORTS_PER_MEMBER + 1)]
+    uplinks = ["TenGigabitEthernet%d/1/1" % member for member in range(1, members + 1)]
+
+    config = ["Building configuration...", "", "Current configuration : 0 bytes", "!",
+              "version 17.3", "hostname %s" % hostname, "!"]
+    config.extend("switch %d provision c9300-48p" % member for member in range(1, members + 1))
+    config.extend(["!", "vlan %d" % DATA_VLAN, " name data_vlan", "!"])
+    status = {}
+    dot1x = {}
+    sessions = {}
+    mac_addresses = {}
+    for port_index, interface in enumerate(access):
+        config.extend(legacy_interface_config(interface))
+        clients = rng.choice((0, 1, 1, 1, 2))
+        status[interface] = {"name": "", "status": "connected" if clients else "notconnect",
+                             "vlan": str(DATA_VLAN), "duplex_code": "a-full", "port_speed": "a-1000",
+                             "type": "10/100/1000BaseTX"}
+        dot1x[interface] = {"interface": interface, "max_reauth_req": 2, "max_req": 2, "pae": "authenticator",
+                            "timeout": {"quiet_period": 60, "server_timeout": 0, "supp_timeout": 30, "tx_period": 10}}
+        if not clients:
+            continue
+        dot1x[interface]["clients"] = {}
+        sessions[interface] = {"interface": interface, "client": {}}
+        for client in range(clients):
+            mac = mac_address(device_index, port_index, client)
+            session_id = "%024X" % ((device_index << 40) | (port_index << 8) | client)
+            dot1x[interface]["clients"][mac] = {"client": mac, "eap_method": "(0)",
+                                                "session": {session_id: {"auth_sm_state": "authenticated",
+                                                                         "auth_bend_sm_state": "idle",
+                                                                         "session_id": session_id}}}
+            sessions[interface]["client"][mac] = {"client": mac, "domain": "DATA", "method": "dot1x",
+                                                  "session": {session_id: {"session_id": session_id}},
+                                                  "status": "Auth"}
+            mac_addresses[mac] = {"interfaces": {interface: {"entry_type": "dynamic", "interface": interface}},
+                                  "mac_address": mac}
+    for interface in uplinks:
+        config.extend(["interface %s" % interface, " switchport mode trunk", "!"])
+        status[interface] = {"name": "", "status": "connected", "vlan": "trunk", "duplex_code": "full",
+                             "port_speed": "10G", "type": "SFP-10GBase-SR"}
+    config.append("end")
+
+    pre = {
+        "show running-config": "\n".join(config) + "\n",
+        "show interfaces status": {"interfaces": status},
+        "show dot1x all details": {"interfaces": dot1x, "system_auth_control": True, "version": 3},
+        "show authentication sessions": {"interfaces": sessions,
+                                         "session_count": sum(len(s["client"]) for s in sessions.values())},
+        "show mac address-table": {"mac_table": {"vlans": {str(DATA_VLAN): {"mac_addresses": mac_addresses,
+                                                                            "vlan": DATA_VLAN}}},
+                                   "total_mac_addresses": len(mac_addresses)},
+        "learn vlan": {"vlans": {str(DATA_VLAN): {"name": "data_vlan", "vlan_id": str(DATA_VLAN)}}},
+    }
+
+    # A few endpoints do not come back after the conversion
+    post_sessions = {interface: {"interface": interface,
+                                 "client": {mac: dict(client, domain="DATA" if rng.random() > 0.02 else "UNKNOWN",
+                                                      status="Auth" if rng.random() > 0.02 else "Unauth")
+                                            for mac, client in values["client"].items()}}
+                     for interface, values in sessions.items()}
+    post = {
+        "show authentication sessions": {"interfaces": post_sessions, "session_count": pre["show authentication sessions"]["session_count"]},
+    }
+    return {"pre": pre, "post": post}
+
+def synthetic_device(device_index, members, seed=0, **kwargs):
+    recordings = synthetic_recordings(device_index, members, seed=seed)
+    return ReplayDevice("sw%04d" % device_index, recordings, **kwargs)
+
+def synthetic_fleet(size, min_members=1, max_members=9, seed=0, **kwargs):
+    """Yield ``size`` replay devices of 48 to 432 ports, one at a time"""
+    rng = random.Random(seed)
+    for device_index in range(size):
+        yield synthetic_device(device_index, rng.randint(min_members, max_members), seed=seed, **kwargs)
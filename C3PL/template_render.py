@@ -0,0 +1,86 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from artifact_store import canonical_bytes, content_hash
+from running_config import short_interface
+
+# ----------------
+# Template renderer
+# ----------------
+class TemplateRenderer:
+    """Compile each template once and render each distinct input once
+
+    Rendered text is memoized by template name, template version (a hash of
+    its source) and a hash of the inputs, so stacks with the same port
+    layout share one render. With ``bytecode_dir`` the compiled templates are
+    also kept on disk for the next run. Safe to share between threads.
+    """
+    def __init__(self, template_dir='templates/', bytecode_dir=None, max_entries=1024):
+        bytecode_cache = None
+        if bytecode_dir:
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        self.env = Environment(loader=FileSystemLoader(template_dir), bytecode_cache=bytecode_cache,
+                               auto_reload=False)
+        self.env.filters["shortname"] = short_interface
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._templates = {}
+        self._rendered = OrderedDict()
+        self._lock = threading.Lock()
+
+    def template(self, name):
+        """The compiled template and its version"""
+        with self._lock:
+            if name not in self._templates:
+                source = self.env.loader.get_source(self.env, name)[0]
+                version = hashlib.sha256(source.encode()).hexdigest()[:16]
+                self._templates[name] = (self.env.get_template(name), version)
+            return self._templates[name]
+
+    def render(self, name, **data):
+        return self.render_cached(name, **data)[0]
+
+    def render_cached(self, name, **data):
+        """The rendered text, and whether it came from the memo"""
+        template, version = self.template(name)
+        key = (name, version, content_hash(canonical_bytes(data)))
+        with self._lock:
+            rendered = self._rendered.get(key)
+            if rendered is not None:
+                self._rendered.move_to_end(key)
+                self.hits += 1
+                return rendered, True
+            self.misses += 1
+
+        rendered = template.render(**data)
+        with self._lock:
+            self._rendered[key] = rendered
+            if len(self._rendered) > self.max_entries:
+                self._rendered.popitem(last=False)
+        return rendered, False
+
+    # ---------------------------------------
+    # Batch rendering
+    # ---------------------------------------
+    def render_fleet(self, layouts):
+        """Render the conversions of a whole fleet in one call
+
+        ``layouts`` maps a device name to the ``ports`` and ``data_vlan`` of
+        ``device_conversion.render_conversion``; devices with the same layout
+        share the text.
+        """
+        # Imported here: device_conversion renders through this module
+        from device_conversion import render_conversion
+        return {device: render_conversion(self.render, **layout) for device, layout in layouts.items()}
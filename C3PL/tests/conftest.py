@@ -0,0 +1,62 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import sys
+import pytest
+
+# The job's modules import each other from C3PL/
+C3PL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, C3PL_DIR)
+
+from synthetic_fleet import DATA_VLAN
+from template_render import TemplateRenderer
+
+def make_run_dir(path):
+    """Lay ``path`` out like C3PL/, with the job's templates"""
+    for folder in ("backup_configs", "pre_configs", "post_configs", "changelog", "metrics", "journal", "templates"):
+        (path / folder).mkdir(parents=True)
+    # The run writes its removal text next to the templates: keep it out of the repo
+    for name in os.listdir(os.path.join(C3PL_DIR, "templates")):
+        if name.endswith(".j2"):
+            (path / "templates" / name).symlink_to(os.path.join(C3PL_DIR, "templates", name))
+    return path
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch):
+    """Empty run folder with the job's layout and templates, as the working directory"""
+    monkeypatch.chdir(make_run_dir(tmp_path))
+    return tmp_path
+
+# ----------------
+# Helpers
+# ----------------
+class FakeClock:
+    """``clock`` and ``sleep`` that move time only when slept"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def converted_config(recordings):
+    """The running config of the synthetic device once the conversion is on it"""
+    renderer = TemplateRenderer("templates/")
+    access = sorted(recordings["pre"]["show interfaces status"]["interfaces"])
+    access = [interface for interface in access if interface.startswith("GigabitEthernet")]
+    lines = ["hostname sw0000", "!", "vlan %d" % DATA_VLAN, " name data_vlan", "!"]
+    lines.extend(renderer.render("C3PL_new_global_configs.j2", vlan=DATA_VLAN).strip().splitlines())
+    for block in renderer.render("C3PL_new_int_config_enforcement.j2", interface=access).split("interface ")[1:]:
+        interface, *config = block.strip().splitlines()
+        lines.append("interface %s" % interface)
+        lines.extend(" " + line for line in config)
+        lines.append("!")
+    return "\n".join(lines + ["end"]) + "\n"
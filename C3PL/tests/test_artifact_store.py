@@ -0,0 +1,64 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+from artifact_store import ContentAddressedStore, JsonFileStore
+from synthetic_fleet import synthetic_recordings
+
+DOT1X = "show dot1x all details"
+
+def blobs(root):
+    return sorted(os.path.join(folder, name) for folder, _, names in os.walk(os.path.join(root, "objects"))
+                  for name in names)
+
+def test_captures_come_back_as_stored_and_repeats_are_written_once(tmp_path):
+    root = str(tmp_path / "artifacts")
+    pre = synthetic_recordings(0, 2)["pre"]
+    store = ContentAddressedStore("T1", root=root)
+
+    ref = store.put("pre_configs", "sw0000_Pre_Dot1x_T1.json", pre[DOT1X], device="sw0000")
+    written = blobs(root)
+    again = ContentAddressedStore("T2", root=root).put("pre_configs", "sw0000_Pre_Dot1x_T2.json", pre[DOT1X],
+                                                        device="sw0000")
+
+    assert store.get(ref) == pre[DOT1X]
+    assert again.split(":")[1] == ref.split(":")[1]
+    assert blobs(root) == written
+
+def test_text_is_streamed_in_and_out(tmp_path):
+    root = str(tmp_path / "artifacts")
+    store = ContentAddressedStore("T", root=root)
+    text = "".join("~ interfaces > GigabitEthernet1/0/%d > status\n" % port for port in range(1, 49))
+
+    for filename in ("sw0000_Changes.txt", "sw0001_Changes.txt"):
+        with store.writer("changelog", filename) as fid:
+            fid.write(text[:100])
+            fid.write(text[100:])
+
+    first, second = store.entries()
+    assert first["hash"] == second["hash"]
+    assert len(blobs(root)) == 1
+    assert store.read_text(first["hash"]) == text
+    assert list(store.text_lines(first["hash"], chunk_size=64)) == text.splitlines(True)
+
+def test_export_matches_the_json_layout(tmp_path, monkeypatch):
+    pre = synthetic_recordings(0, 1)["pre"]
+    store = ContentAddressedStore("T", root=str(tmp_path / "artifacts"))
+    store.put("pre_configs", "sw0000_Pre_Dot1x_T.json", pre[DOT1X], device="sw0000")
+    store.put("pre_configs", "sw0000_Pre_Interfaces_T.json", pre["show interfaces status"], device="sw0000")
+    store.export(str(tmp_path / "exported"))
+
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("pre_configs")
+    JsonFileStore("T").put("pre_configs", "sw0000_Pre_Dot1x_T.json", pre[DOT1X])
+    JsonFileStore("T").put("pre_configs", "sw0000_Pre_Interfaces_T.json", pre["show interfaces status"])
+
+    for filename in ("sw0000_Pre_Dot1x_T.json", "sw0000_Pre_Interfaces_T.json"):
+        with open(os.path.join("exported", "pre_configs", filename)) as exported, \
+                open(os.path.join("pre_configs", filename)) as original:
+            assert exported.read() == original.read()
@@ -0,0 +1,58 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import time
+from config_push import ConfigBundle, ConfigPush
+from mock_device import MockDevice
+
+class BusyDevice(MockDevice):
+    """Spends CPU on every configure call, as an SSH session does"""
+    def configure(self, command, **kwargs):
+        started = time.thread_time()
+        while time.thread_time() - started < 0.01:
+            pass
+        return super().configure(command, **kwargs)
+
+def device(reject):
+    return MockDevice("sw0000", session_latency=0, line_latency=0, exec_latency=0, reject=reject)
+
+def bundle():
+    bundle = ConfigBundle("sw0000")
+    bundle.add("removal", "interface Gi1/0/1\nno authentication open", critical=True)
+    bundle.add_exec("new_style", "authentication display new-style")
+    bundle.add("global", "policy-map type control subscriber POLICY\nservice-template TEMPLATE", critical=True)
+    bundle.add("interfaces", "interface Gi1/0/1\naccess-session closed\ninterface Gi1/0/2\naccess-session closed")
+    return bundle
+
+def test_errors_are_attributed_to_their_section():
+    switch = device([r"^access-session closed$"])
+    push_result = ConfigPush().apply(switch, bundle())
+
+    assert push_result.sections["interfaces"].errors == ["access-session closed: % Invalid input detected at '^' marker."] * 2
+    assert not push_result.sections["global"].errors
+    assert not push_result.stopped_by
+    # The removal, then the critical global sections apart from the interfaces
+    assert push_result.sessions == 3
+
+def test_rejected_critical_section_holds_the_rest():
+    switch = device([r"^service-template "])
+    journaled = []
+    push_result = ConfigPush().apply(switch, bundle(),
+                                     checkpoint=lambda sections, result: journaled.extend(s.name for s in sections))
+
+    assert push_result.stopped_by == ["global"]
+    assert push_result.sections["interfaces"].held
+    assert push_result.sections["interfaces"].result == "held"
+    assert "access-session closed" not in switch.applied
+    assert journaled == ["removal", "new_style", "global"]
+
+def test_sections_get_the_cpu_of_their_segment():
+    switch = BusyDevice("sw0000", session_latency=0, line_latency=0, exec_latency=0)
+    push_result = ConfigPush().apply(switch, bundle())
+
+    assert all(push_result.sections[name].cpu >= 0.01 for name in ("removal", "global", "interfaces"))
@@ -0,0 +1,60 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import time
+import pytest
+from connection_pool import ConnectionPool
+from mock_device import MockDevice
+from parallel_execution import ParallelRunner
+from stage_metrics import StageMetrics
+
+def disconnected(name, **kwargs):
+    device = MockDevice(name, **kwargs)
+    device.connected = False
+    return device
+
+def test_failed_connect_is_retried_with_a_doubling_delay():
+    device = disconnected("sw0000", connect_failures=2)
+    metrics = StageMetrics()
+    delays = []
+    pool = ConnectionPool(retries=3, backoff=5, metrics=metrics, sleep=delays.append)
+
+    with pool.session(device):
+        assert device.connected
+
+    assert delays == [5, 10]
+    assert metrics.records[-1]["attempts"] == 3
+    assert not device.connected
+
+def test_connect_gives_up_after_the_retries():
+    device = disconnected("sw0000", connect_failures=5)
+    delays = []
+    pool = ConnectionPool(retries=2, backoff=5, sleep=delays.append)
+
+    with pytest.raises(TimeoutError):
+        with pool.session(device):
+            pass
+
+    assert delays == [5, 10]
+    assert device.connects == 3
+    assert pool.live == 0
+
+def test_sessions_are_bounded_and_closed():
+    devices = [disconnected("sw%04d" % index) for index in range(6)]
+    pool = ConnectionPool(max_sessions=2)
+
+    def work(device, steps):
+        time.sleep(0.02)
+        return [device.connected]
+
+    results = ParallelRunner(4).run(devices, pool.wrap(work))
+
+    assert [result.artifacts for result in results.values()] == [[True]] * 6
+    assert pool.peak == 2
+    assert pool.live == 0
+    assert not any(device.connected for device in devices)
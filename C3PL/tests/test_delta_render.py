@@ -0,0 +1,62 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+from delta_render import DeltaRenderer
+from running_config import RunningConfig
+
+RUNNING_CONFIG = """hostname sw0000
+!
+interface GigabitEthernet1/0/1
+ dot1x timeout quiet-period 5
+ authentication port-control auto
+!
+interface GigabitEthernet1/0/2
+ access-session closed
+!
+policy-map type control subscriber PMAP_DefaultWiredDot1xClosedAuth_1X_MAB
+ event session-started match-all
+  10 class always do-until-failure
+   20 authenticate using dot1x priority 10
+!
+end
+"""
+
+def renderer():
+    return DeltaRenderer(RunningConfig(RUNNING_CONFIG))
+
+def test_removal_is_kept_only_for_what_is_configured_and_not_wanted():
+    delta = renderer()
+    removals = "\n".join(["interface Gi1/0/1", "no dot1x timeout quiet-period 2", "no authentication host-mode multi-auth",
+                          "no authentication port-control auto"])
+
+    reduced = delta.interface_removals(removals, target="interface GigabitEthernet1/0/1\nauthentication port-control auto")
+
+    # The timer matches whatever value is configured; the port-control line is part of the target
+    assert reduced.splitlines() == ["interface GigabitEthernet1/0/1", "no dot1x timeout quiet-period 2"]
+    assert (delta.rendered_lines, delta.delta_lines) == (3, 1)
+
+def test_port_already_at_the_target_drops_out():
+    delta = renderer()
+    additions = "interface GigabitEthernet1/0/1\nauthentication port-control auto\n!\n" \
+                "interface GigabitEthernet1/0/2\naccess-session closed\naccess-session port-control auto"
+
+    reduced = delta.interface_additions(additions)
+
+    assert reduced.splitlines() == ["interface GigabitEthernet1/0/2", "access-session port-control auto"]
+
+def test_global_lines_follow_the_running_config():
+    delta = renderer()
+    policy = ["policy-map type control subscriber PMAP_DefaultWiredDot1xClosedAuth_1X_MAB",
+              " event session-started match-all", "  10 class always do-until-failure",
+              "   20 authenticate using dot1x priority 10"]
+    changed = ["policy-map type control subscriber POLICY", " event session-started match-all"]
+
+    assert delta.global_additions("\n".join(policy + changed)).splitlines() == changed
+    assert delta.global_removals("no policy-map type control subscriber PMAP_DefaultWiredDot1xClosedAuth_1X_MAB\n"
+                                 "no service-template DEFAULT_LINKSEC_POLICY_MUST_SECURE") == \
+        "no policy-map type control subscriber PMAP_DefaultWiredDot1xClosedAuth_1X_MAB"
@@ -0,0 +1,106 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import json
+import pytest
+from conftest import converted_config
+from conversion_journal import ConversionJournal
+from device_conversion import DeviceConversion
+from parallel_execution import StepRecorder
+from synthetic_fleet import synthetic_recordings
+from mock_device import ReplayDevice
+
+def test_rerun_on_converted_device_keeps_the_policy(run_dir):
+    recordings = synthetic_recordings(0, 1)
+    recordings["pre"]["show running-config"] = converted_config(recordings)
+    device = ReplayDevice("sw0000", recordings)
+
+    DeviceConversion(device, "T", resume=False, convergence_timeout=0).run(StepRecorder(device.name))
+
+    assert "no service-policy type control subscriber" not in device.applied
+    assert not [line for line in device.applied if line.startswith("no ")]
+
+@pytest.mark.parametrize("role_templates", [False, True])
+def test_every_dot1x_port_gets_the_new_config_unless_by_role(run_dir, role_templates):
+    recordings = synthetic_recordings(0, 1)
+    uplink = "TenGigabitEthernet1/1/1"
+    recordings["pre"]["show dot1x all details"]["interfaces"][uplink] = {"interface": uplink, "pae": "authenticator"}
+    device = ReplayDevice("sw0000", recordings)
+
+    DeviceConversion(device, "T", resume=False, convergence_timeout=0,
+                     role_templates=role_templates).run(StepRecorder(device.name))
+
+    assert ("interface %s" % uplink in device.applied) is not role_templates
+    assert "interface GigabitEthernet1/0/1" in device.applied
+
+@pytest.mark.parametrize("command", ["show interfaces status", "show dot1x all details"])
+def test_device_without_a_required_capture_is_not_converted(run_dir, command):
+    recordings = synthetic_recordings(0, 1)
+    del recordings["pre"][command]
+    device = ReplayDevice("sw0000", recordings)
+
+    with pytest.raises(RuntimeError, match=command):
+        DeviceConversion(device, "T", convergence_timeout=0).run(StepRecorder(device.name))
+
+    assert device.applied == []
+
+def test_failed_capture_is_taken_again_on_resume(run_dir):
+    recordings = synthetic_recordings(0, 1)
+    dot1x = recordings["pre"].pop("show dot1x all details")
+    device = ReplayDevice("sw0000", recordings)
+    with pytest.raises(RuntimeError, match="show dot1x all details"):
+        DeviceConversion(device, "T1", journal=ConversionJournal("journal/j.jsonl"),
+                         convergence_timeout=0).run(StepRecorder(device.name))
+    assert "pre_capture" not in ConversionJournal("journal/j.jsonl").completed("sw0000")
+
+    recordings["pre"]["show dot1x all details"] = dot1x
+    device = ReplayDevice("sw0000", recordings)
+    journal = ConversionJournal("journal/j.jsonl")
+    DeviceConversion(device, "T2", journal=journal, convergence_timeout=0).run(StepRecorder(device.name))
+
+    assert device.applied
+    assert journal.finished("sw0000")
+    # The backup of the first run is kept, the captures are the second run's
+    assert journal.completed("sw0000")["backup"]["run"] == "T1"
+    assert journal.completed("sw0000")["pre_capture"]["run"] == "T2"
+
+def test_rejected_section_is_not_journaled(run_dir):
+    device = ReplayDevice("sw0000", synthetic_recordings(0, 1), reject=["^access-session closed$"])
+    journal = ConversionJournal()
+    with pytest.raises(RuntimeError, match="new_interface_config"):
+        DeviceConversion(device, "T", journal=journal, convergence_timeout=0).run(StepRecorder(device.name))
+
+    completed = journal.completed("sw0000")
+    assert "new_global_config" in completed
+    assert "new_interface_config" not in completed
+
+def test_rejected_global_config_stops_before_the_ports_and_is_pushed_again(run_dir):
+    recordings = synthetic_recordings(0, 1)
+    device = ReplayDevice("sw0000", recordings, reject=["^service-template "])
+    journal = ConversionJournal()
+    with pytest.raises(RuntimeError, match="new_global_config"):
+        DeviceConversion(device, "T1", journal=journal, convergence_timeout=0).run(StepRecorder(device.name))
+
+    assert "access-session closed" not in device.applied
+    # No wr mem: the device still answers from before the change
+    assert device.phase == "pre"
+    assert "new_global_config" not in journal.completed("sw0000")
+
+    device = ReplayDevice("sw0000", recordings)
+    DeviceConversion(device, "T2", journal=journal, convergence_timeout=0).run(StepRecorder(device.name))
+    assert "access-session closed" in device.applied
+    assert journal.finished("sw0000")
+
+def test_mac_table_is_stored_in_genie_layout(run_dir):
+    recordings = synthetic_recordings(0, 1)
+    device = ReplayDevice("sw0000", recordings)
+    DeviceConversion(device, "T", convergence_timeout=0, stop_after="pre_capture").run(StepRecorder(device.name))
+
+    with open("pre_configs/sw0000_Pre_MAC_Table_T.json") as fid:
+        stored = json.load(fid)
+    assert stored == recordings["pre"]["show mac address-table"]
@@ -0,0 +1,36 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import pytest
+from conftest import converted_config
+from delta_render import interface_blocks
+from device_conversion import DeviceConversion
+from fleet_compiler import compile_device, saved_devices
+from parallel_execution import StepRecorder
+from synthetic_fleet import synthetic_recordings
+from mock_device import ReplayDevice
+
+@pytest.mark.parametrize("converted", [False, True])
+def test_compiled_bundle_is_what_the_job_pushes(run_dir, converted):
+    recordings = synthetic_recordings(0, 1)
+    if converted:
+        recordings["pre"]["show running-config"] = converted_config(recordings)
+    device = ReplayDevice("sw0000", recordings)
+    DeviceConversion(device, "T", resume=False, convergence_timeout=0).run(StepRecorder(device.name))
+
+    (run_dir / "compiled").mkdir()
+    result = compile_device(saved_devices()["sw0000"], "compiled")
+    assert result["status"] != "error", result["problems"]
+
+    with open("compiled/sw0000_Bundle.txt") as fid:
+        compiled = [line for line in fid.read().splitlines() if not line.startswith("!")]
+    # The exec command goes through execute, the config lines through configure
+    compiled.remove("authentication display new-style")
+    # The saved captures list the ports in another order
+    assert sorted(map(repr, interface_blocks("\n".join(compiled)))) == \
+        sorted(map(repr, interface_blocks("\n".join(device.applied))))
@@ -0,0 +1,85 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import shutil
+import pytest
+from artifact_store import artifact_store
+from conftest import C3PL_DIR, make_run_dir
+from conversion_journal import ConversionJournal
+from device_conversion import DeviceConversion
+from fleet_report import FleetReport
+from mock_device import ReplayDevice
+from parallel_execution import StepRecorder
+from stage_metrics import StageMetrics
+from synthetic_fleet import synthetic_recordings
+
+class UnsavedDevice(ReplayDevice):
+    """Fails to save its config"""
+    def execute(self, command, **kwargs):
+        if command == "wr mem":
+            raise RuntimeError("Timed out saving the config")
+        return super().execute(command, **kwargs)
+
+def test_failures_of_a_device_named_apart_from_its_alias(run_dir):
+    device = UnsavedDevice("NAME", synthetic_recordings(0, 1), alias="alias1")
+    with pytest.raises(RuntimeError):
+        DeviceConversion(device, "T", metrics=StageMetrics("metrics/T_metrics.jsonl"),
+                         journal=ConversionJournal("journal/C3PL_journal.jsonl"),
+                         convergence_timeout=0).run(StepRecorder(device.name))
+
+    report = FleetReport()
+    report.update()
+
+    assert report.summary()["failed_stages"] == {"wr mem": 1}
+    assert [(row["device"], row["failed_stages"]) for row in report.failures()] == [("alias1", "wr mem")]
+    assert [failure["stage"] for failure in report.device("alias1")["failures"]] == ["wr mem"]
+
+def test_genie_diffs_of_older_runs_are_skipped(run_dir):
+    sample = "sampledevice_C3PL_Conversion_MAC_Table.txt_20210823_151923"
+    shutil.copy(os.path.join(C3PL_DIR, "changelog", sample), "changelog")
+
+    report = FleetReport()
+    assert report.update() == 1
+    assert report.update() == 0
+
+    summary = report.summary()
+    assert summary["changes"] == {}
+    assert summary["devices"] == 0
+    assert report.changes() == []
+
+def convert_and_report(store):
+    """Report of one synthetic conversion, with an endpoint not authorized after it, stored in ``store``"""
+    recordings = synthetic_recordings(0, 1)
+    sessions = recordings["post"]["show authentication sessions"]
+    port = sorted(sessions["interfaces"])[0]
+    client = sorted(sessions["interfaces"][port]["client"])[0]
+    sessions["interfaces"][port]["client"][client]["status"] = "Unauth"
+    device = ReplayDevice("sw0000", recordings)
+    DeviceConversion(device, "T", store=artifact_store(store, "T"),
+                     journal=ConversionJournal("journal/C3PL_journal.jsonl"), verify="full",
+                     convergence_timeout=0).run(StepRecorder(device.name))
+    report = FleetReport()
+    assert report.update() > 0
+    return report
+
+def test_runs_in_the_content_addressed_store_are_reported(run_dir, monkeypatch):
+    expected = convert_and_report("json")
+    monkeypatch.chdir(make_run_dir(run_dir / "cas"))
+    report = convert_and_report("cas")
+
+    assert not os.listdir("changelog")
+    assert report.summary() == expected.summary()
+    assert report.summary()["changes"] == {"Authentication_Sessions modified": 1}
+    assert len(report.unauthorized()) == len(expected.unauthorized()) == 1
+    assert report.update() == 0
+    # As the job updates it, one device at a time
+    one_device = FleetReport("reports/one_device.sqlite")
+    assert one_device.update(devices=["sw0000"]) > 0
+    assert one_device.update(devices=["sw0001"]) == 0
+    assert one_device.summary() == expected.summary()
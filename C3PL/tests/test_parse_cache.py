@@ -0,0 +1,37 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import os
+import time
+from parse_cache import CONFIG_PLATFORM, ParseCache, parse_key
+
+def test_only_parsed_show_outputs_are_written(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    show = parse_key("show version", "iosxe/cat9k", "secret raw text")
+    config = parse_key("show running-config", CONFIG_PLATFORM, "enable secret 9 x")
+    cache.put(show, "show version", "iosxe/cat9k", {"version": "17.9"})
+    cache.put(config, "show running-config", CONFIG_PLATFORM, {"enable secret 9 x": {}})
+
+    assert os.listdir(str(tmp_path)) == ["%s.json" % show]
+    assert "secret raw text" not in (tmp_path / ("%s.json" % show)).read_text()
+    assert cache.get(config) == {"enable secret 9 x": {}}
+    assert ParseCache(str(tmp_path)).get(show) == {"version": "17.9"}
+
+def test_old_and_least_recently_used_files_are_removed(tmp_path):
+    (tmp_path / "raw.txt").write_text("enable secret 9 x")
+    cache = ParseCache(str(tmp_path), max_files=2, max_age=3600)
+    for key in "abc":
+        cache.put(key, "show version", "iosxe/cat9k", {"key": key})
+        # Used a second apart, in order
+        os.utime(cache._path(key), (time.time() - ord("d") + ord(key),) * 2)
+    cache.put("d", "show version", "iosxe/cat9k", {"key": "d"})
+
+    assert sorted(os.listdir(str(tmp_path))) == ["c.json", "d.json"]
+    os.utime(cache._path("c"), (time.time() - 7200,) * 2)
+    assert ParseCache(str(tmp_path), max_age=3600).get("c") is None
+    assert sorted(os.listdir(str(tmp_path))) == ["d.json"]
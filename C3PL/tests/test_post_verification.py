@@ -0,0 +1,35 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import pytest
+from mock_device import ReplayDevice
+from parallel_execution import StepRecorder
+from post_verification import PostVerification, VerificationScope
+from stage_metrics import StageMetrics
+from synthetic_fleet import synthetic_recordings
+
+SESSIONS = "show authentication sessions"
+
+@pytest.mark.parametrize("per_interface_share, commands", [(0.1, 4), (0.05, 1)])
+def test_port_without_sessions_is_captured_empty(run_dir, per_interface_share, commands):
+    recordings = synthetic_recordings(0, 1)
+    sessions = recordings["post"][SESSIONS]["interfaces"]
+    with_sessions = sorted(sessions)[:3]
+    without = sorted(set(recordings["pre"]["show interfaces status"]["interfaces"]) - set(sessions))[0]
+    device = ReplayDevice("sw0000", recordings)
+    device.phase = "post"
+    steps = StepRecorder(device.name)
+    metrics = StageMetrics()
+
+    # 4 of the 49 ports: one command each up to a tenth of them, one full capture past that
+    captured = PostVerification(device, VerificationScope(with_sessions + [without]), metrics,
+                                total_interfaces=49, per_interface_share=per_interface_share).capture(steps, SESSIONS)
+
+    assert steps.worst_result == "passed"
+    assert metrics.records[-1]["commands"] == commands
+    assert sorted(captured["interfaces"]) == with_sessions
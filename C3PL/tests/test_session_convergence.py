@@ -0,0 +1,30 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+from conftest import FakeClock
+from mock_device import ReplayDevice
+from session_convergence import ConvergenceWatcher, expected_clients
+from synthetic_fleet import synthetic_recordings
+
+def test_no_sessions_after_the_push_is_nothing_authorized(run_dir):
+    recordings = synthetic_recordings(0, 1)
+    pre = recordings["pre"]
+    recordings["post"]["show authentication sessions"] = {"interfaces": {}}
+    device = ReplayDevice("sw0000", recordings)
+    device.phase = "post"
+    expected = expected_clients(pre["show dot1x all details"], pre["show authentication sessions"],
+                                pre["show mac address-table"])
+
+    for per_interface_limit in (0, len(expected)):
+        clock = FakeClock()
+        report = ConvergenceWatcher(device, expected, timeout=10, per_interface_limit=per_interface_limit,
+                                    clock=clock, sleep=clock.sleep).watch()
+
+        assert not report.converged
+        assert report.pending == expected
+        assert report.polls > 1
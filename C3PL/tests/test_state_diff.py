@@ -0,0 +1,28 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import io
+import json
+from state_diff import CHANGELOG_HEADER, Change, StateDiff, parse_change_line
+
+def test_lines_read_back_whatever_the_keys_hold():
+    changes = [
+        Change("added", ("interface Gi1/0/1", "description uplink: core > dist"), new={"a": "b: c"}),
+        Change("removed", ("banner", 'say "hi"', " padded "), old="x -> y"),
+        Change("modified", ("ipv6 address 2001:db8::1/64", ""), old="a -> b", new=["c > d"]),
+        Change("added", ("mac_table", "vlans", "10", "mac_addresses", "0000.0000.beef"), new=1),
+    ]
+    for change in changes:
+        kind, path, old, new = parse_change_line(change.line() + "\n")
+        assert (kind, path) == (change.kind, [str(key) for key in change.path])
+        assert (old and json.loads(old), new and json.loads(new)) == (change.old, change.new)
+
+def test_changelog_starts_with_the_header():
+    fid = io.StringIO()
+    StateDiff({"a": 1}, {"a": 2}).write(fid)
+    assert fid.getvalue().splitlines() == [CHANGELOG_HEADER, "~ a: 1 -> 2"]
@@ -0,0 +1,33 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+from conftest import FakeClock
+from connection_pool import ConnectionPool
+from mock_device import MockDevice
+from parallel_execution import ParallelRunner
+from wave_scheduler import WaveScheduler
+
+def test_settle_polls_hold_one_connection():
+    device = MockDevice("sw0000")
+    device.connected = False
+    pool = ConnectionPool(max_sessions=1)
+    polls = []
+
+    def settle(device, expected):
+        polls.append(device.connected)
+        return len(polls) == 3
+
+    clock = FakeClock()
+    scheduler = WaveScheduler(ParallelRunner(), settle_timeout=60, clock=clock, sleep=clock.sleep)
+    rollout = scheduler.run([device], lambda device, steps: {"endpoints": 10, "sessions": 10},
+                            lambda device, steps: None, settle=settle, lease=pool.wrap)
+
+    assert rollout.settled == [True]
+    assert polls == [True] * 3
+    assert device.connects == 1
+    assert not device.connected
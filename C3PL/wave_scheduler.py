@@ -0,0 +1,248 @@
+# ----------------
+# Copyright
+# ----------------
+# Copyright (c) 2021 John Capobianco
+
+# ----------------
+# Python
+# ----------------
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from parse_cache import empty_parse
+from running_config import canonical_interface
+from mac_table import mac_entries
+
+log = logging.getLogger(__name__)
+
+# Session states that mean the endpoint is back on the network
+AUTHENTICATED = ("Auth", "Authz Success")
+
+# ----------------
+# Endpoint estimates
+# ----------------
+def count_sessions(parsed, statuses=None):
+    """Clients in a parsed 'show authentication sessions', optionally only in ``statuses``"""
+    return sum(1 for values in (parsed or {}).get("interfaces", {}).values()
+               for client in values.get("client", {}).values()
+               if statuses is None or client.get("status") in statuses)
+
+def endpoints_per_interface(sessions, mac_table):
+    """Endpoints on each interface: its session clients or its learned MAC addresses, whichever is more
+
+    Endpoints without a session today (open ports, MAB not configured) are
+    counted from the MAC table.
+    """
+    endpoints = {}
+    for interface, values in (sessions or {}).get("interfaces", {}).items():
+        endpoints[canonical_interface(interface)] = len(values.get("client", {}))
+    learned = {}
+    for _, interface, _, entry_type in mac_entries(mac_table):
+        if entry_type == "dynamic":
+            interface = canonical_interface(interface)
+            learned[interface] = learned.get(interface, 0) + 1
+    for interface, count in learned.items():
+        endpoints[interface] = max(endpoints.get(interface, 0), count)
+    return endpoints
+
+def estimate_endpoints(sessions, mac_table):
+    """Endpoints that will authenticate once the new policy is on their port"""
+    return sum(endpoints_per_interface(sessions, mac_table).values())
+
+# ----------------
+# Session rate limit
+# ----------------
+class SessionRateLimiter:
+    """Fleet-wide token bucket of new sessions per second
+
+    Pushes ask for as many tokens as the endpoints their config makes
+    re-authenticate. A request larger than the bucket waits for a full
+    bucket and leaves it in debt, so the average rate still holds.
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("The session rate limit must be positive, got %r" % rate)
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, sessions):
+        """Block until ``sessions`` new sessions fit under the rate; returns the seconds waited"""
+        needed = min(float(sessions), self.burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= sessions
+                    self.waited += waited
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+# ----------------
+# Wave planning
+# ----------------
+def plan_waves(endpoints, canary=1, wave_endpoints=2000):
+    """Group devices into a canary and waves of at most ``wave_endpoints`` endpoints
+
+    The canary is the ``canary`` smallest devices that have endpoints at
+    all: a problem shows up there at the lowest cost. Waves then fill in
+    order of size; a device bigger than the budget goes alone.
+    """
+    ordered = sorted(endpoints, key=lambda name: (endpoints[name], name))
+    busy = [name for name in ordered if endpoints[name]]
+    canary_wave = busy[:canary] if canary else []
+    waves = [canary_wave] if canary_wave else []
+
+    wave = []
+    total = 0
+    for name in ordered:
+        if name in canary_wave:
+            continue
+        if wave and total + endpoints[name] > wave_endpoints:
+            waves.append(wave)
+            wave = []
+            total = 0
+        wave.append(name)
+        total += endpoints[name]
+    if wave:
+        waves.append(wave)
+    return waves
+
+# ----------------
+# Settling
+# ----------------
+def sessions_settled(device, expected, ratio=0.95):
+    """Whether at least ``ratio`` of the ``expected`` sessions are authenticated again"""
+    if not expected:
+        return True
+    try:
+        parsed = device.parse("show authentication sessions")
+    except Exception as e:
+        if not empty_parse(e):
+            raise
+        # No sessions at all yet
+        parsed = {}
+    return count_sessions(parsed, AUTHENTICATED) >= ratio * expected
+
+# ----------------
+# Scheduler
+# ----------------
+class WaveResult:
+    """What a wave rollout did"""
+    def __init__(self):
+        self.prepared = {}
+        self.converted = {}
+        self.estimates = {}
+        self.waves = []
+        self.settled = []
+        self.unsettled = []
+        self.held = []
+
+class WaveScheduler:
+    """Convert a fleet as a canary and then waves, one wave at a time
+
+    ``prepare(device, steps)`` runs first on every device and returns its
+    estimate, ``{"endpoints": n, "sessions": n}``. Waves are planned from
+    those. Each wave is converted with ``convert(device, steps)`` through
+    ``runner``; the next wave waits until every device of the current one
+    has its sessions back (``settle(device, expected)``), and the rollout
+    stops, holding the remaining devices, if they do not within
+    ``settle_timeout`` seconds. The devices are polled in parallel, each
+    inside one ``lease(target)`` for its whole polling, e.g. a connection
+    pool's ``wrap``.
+    """
+    def __init__(self, runner, canary=1, wave_endpoints=2000, settle_ratio=0.95, settle_timeout=600,
+                 poll_interval=10, clock=time.monotonic, sleep=time.sleep):
+        self.runner = runner
+        self.canary = canary
+        self.wave_endpoints = wave_endpoints
+        self.settle_ratio = settle_ratio
+        self.settle_timeout = settle_timeout
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+
+    def _settle(self, devices, estimates, settle, lease):
+        """Poll each device of the wave until it settled or the timeout passed; returns the unsettled ones"""
+        deadline = self.clock() + self.settle_timeout
+
+        def poll(device, expected):
+            while True:
+                try:
+                    if settle(device, expected):
+                        return True
+                except Exception:
+                    log.exception("Could not check the sessions of %s", device.name)
+                if self.clock() >= deadline:
+                    return False
+                self.sleep(self.poll_interval)
+
+        # One lease per device for its whole loop, rather than a connect per poll
+        polled = lease(poll)
+
+        def settle_one(device):
+            try:
+                return polled(device, estimates[device.name]["sessions"])
+            except Exception:
+                log.exception("Could not check the sessions of %s", device.name)
+                return False
+
+        if not devices:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(devices), self.runner.max_workers)) as pool:
+            settled = list(pool.map(settle_one, devices))
+        return sorted(device.name for device, done in zip(devices, settled) if not done)
+
+    def run(self, devices, prepare, convert, settle=None, lease=None):
+        settle = settle or (lambda device, expected: sessions_settled(device, expected, self.settle_ratio))
+        lease = lease or (lambda target: target)
+        wave_result = WaveResult()
+        by_name = {device.name: device for device in devices}
+
+        def prepare_one(device, steps):
+            wave_result.estimates[device.name] = prepare(device, steps)
+
+        # ---------------------------------------
+        # Estimate every device, then plan the waves
+        # ---------------------------------------
+        wave_result.prepared = self.runner.run(devices, prepare_one)
+        ready = {name: estimate["endpoints"] for name, estimate in wave_result.estimates.items()
+                 if wave_result.prepared[name].exception is None}
+        wave_result.waves = plan_waves(ready, canary=self.canary, wave_endpoints=self.wave_endpoints)
+        log.info("Rollout of %d device(s) in %d wave(s): %s", len(ready), len(wave_result.waves),
+                 ", ".join("%d device(s)/%d endpoints" % (len(wave), sum(ready[name] for name in wave))
+                           for wave in wave_result.waves))
+
+        # ---------------------------------------
+        # One wave at a time
+        # ---------------------------------------
+        for index, wave in enumerate(wave_result.waves):
+            wave_devices = [by_name[name] for name in wave]
+            wave_result.converted.update(self.runner.run(wave_devices, convert))
+            converted = [device for device in wave_devices if wave_result.converted[device.name].exception is None]
+            unsettled = self._settle(converted, wave_result.estimates, settle, lease)
+            wave_result.unsettled.extend(unsettled)
+            failed = [name for name in wave if wave_result.converted[name].exception is not None]
+            wave_result.settled.append(not unsettled and not failed)
+            if (unsettled or failed) and index + 1 < len(wave_result.waves):
+                wave_result.held = [name for later in wave_result.waves[index + 1:] for name in later]
+                log.error("Wave %d did not settle (unsettled: %s, failed: %s), holding %d device(s)",
+                          index + 1, ", ".join(unsettled) or "none", ", ".join(failed) or "none",
+                          len(wave_result.held))
+                break
+            log.info("Wave %d of %d settled", index + 1, len(wave_result.waves))
+        return wave_result